@@ -1,3 +1,46 @@
+import re
+
+# Define positive and negative word lists
+POSITIVE_WORDS = {
+    'хорошо', 'отлично', 'супер', 'класс', 'круто', 'люблю', 'нравится',
+    'замечательно', 'прекрасно', 'восхитительно', 'потрясающе', 'здорово',
+    'полезно', 'интересно', 'увлекательно', 'познавательно', 'спасибо',
+    'благодарю', 'рекомендую', 'советую', 'поддерживаю', 'согласен',
+    'верно', 'правильно', 'точно', 'именно', 'да'
+}
+
+NEGATIVE_WORDS = {
+    'плохо', 'ужасно', 'отстой', 'неудачно', 'неудачный', 'неудача',
+    'неправильно', 'ошибка', 'ошибочно', 'неверно', 'неверный',
+    'негативно', 'отрицательно', 'негативный', 'отрицательный',
+    'неудобно', 'сложно', 'трудно', 'тяжело', 'проблема', 'проблемный',
+    'недостаток', 'недостаточно', 'мало'
+}
+
+
+def _alternation(words):
+    # Longer words first so that a word is never cut short by its own prefix
+    return '|'.join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+
+
+# Both lists compiled once into a single pattern: one pass over the text
+# counts positive and negative words
+LEXICON_RE = re.compile(
+    r'\b(?:(?P<pos>' + _alternation(POSITIVE_WORDS) + r')|(?P<neg>' + _alternation(NEGATIVE_WORDS) + r'))\b'
+)
+
+
+def count_sentiment_words(text):
+    """Returns (positive_count, negative_count) for the given text"""
+    positive_count = negative_count = 0
+    for match in LEXICON_RE.finditer(text.lower()):
+        if match.lastgroup == 'pos':
+            positive_count += 1
+        else:
+            negative_count += 1
+    return positive_count, negative_count
+
+
 def analyze_sentiment(text):
     """
     Analyze the sentiment of a given text using a simple rule-based approach.
@@ -6,29 +49,8 @@ def analyze_sentiment(text):
         0.0 for negative sentiment
         0.5 for neutral sentiment
     """
-    # Convert text to lowercase for case-insensitive matching
-    text = text.lower()
-    
-    # Define positive and negative word lists
-    positive_words = {
-        'хорошо', 'отлично', 'супер', 'класс', 'круто', 'люблю', 'нравится',
-        'замечательно', 'прекрасно', 'восхитительно', 'потрясающе', 'здорово',
-        'полезно', 'интересно', 'увлекательно', 'познавательно', 'спасибо',
-        'благодарю', 'рекомендую', 'советую', 'поддерживаю', 'согласен',
-        'верно', 'правильно', 'точно', 'именно', 'да', 'да', 'да'
-    }
-    
-    negative_words = {
-        'плохо', 'ужасно', 'отстой', 'неудачно', 'неудачный', 'неудача',
-        'неправильно', 'ошибка', 'ошибочно', 'неверно', 'неверный',
-        'негативно', 'отрицательно', 'негативный', 'отрицательный',
-        'неудобно', 'сложно', 'трудно', 'тяжело', 'проблема', 'проблемный',
-        'недостаток', 'недостаточно', 'мало', 'мало', 'мало'
-    }
-    
     # Count positive and negative words
-    positive_count = sum(1 for word in text.split() if word in positive_words)
-    negative_count = sum(1 for word in text.split() if word in negative_words)
+    positive_count, negative_count = count_sentiment_words(text)
     
     # Calculate sentiment score
     total = positive_count + negative_count
@@ -134,13 +134,109 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 # File upload settings
-FILE_UPLOAD_MAX_MEMORY_SIZE = 524288000  # 500MB
+# Файлы больше 10MB из обычной формы пишутся во временный файл, а не держатся в памяти воркера
+FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 524288000  # 500MB
 FILE_UPLOAD_PERMISSIONS = 0o644
 FILE_UPLOAD_DIRECTORY_PERMISSIONS = 0o755
 
+# Возобновляемая загрузка (core.services.chunked_upload, /api/uploads/)
+CHUNKED_UPLOAD_DIR = os.path.join(MEDIA_ROOT, 'uploads_tmp')
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = 16 * 1024 * 1024  # 16MB
+CHUNKED_UPLOAD_MAX_SIZE = 10 * 1024 ** 3  # 10GB
+CHUNKED_UPLOAD_EXPIRY_HOURS = 24
+
+# Video streaming settings
+# None - отдача через Django (Range + sendfile через wsgi.file_wrapper),
+# 'x-accel' - nginx X-Accel-Redirect, 'x-sendfile' - Apache/lighttpd X-Sendfile
+VIDEO_STREAM_OFFLOAD = os.environ.get('VIDEO_STREAM_OFFLOAD') or None
+# internal location в nginx, указывающий на MEDIA_ROOT (только для 'x-accel')
+VIDEO_STREAM_ACCEL_PREFIX = '/protected-media/'
+# Максимум диапазонов в одном multipart/byteranges ответе
+VIDEO_STREAM_MAX_RANGES = 16
+# Ограничитель отдачи (core.services.stream_governor), лимиты на процесс-воркер.
+# Метрики: /api/stream-metrics/
+VIDEO_STREAM_MAX_ACTIVE = 64
+VIDEO_STREAM_MAX_PER_VIDEO = 16
+# Сколько секунд запрос ждет слот в очереди, прежде чем получить 503
+VIDEO_STREAM_QUEUE_TIMEOUT = 10
+VIDEO_STREAM_RETRY_AFTER = 5
+# bytes/sec на соединение и на весь воркер (None - без ограничения, отдача через sendfile)
+VIDEO_STREAM_RATE_LIMIT = None
+VIDEO_STREAM_RATE_BURST = None
+VIDEO_STREAM_NODE_RATE_LIMIT = None
+# Срок жизни кэша валидаторов (ETag/Last-Modified) для 304 без запроса к БД
+MEDIA_VALIDATOR_CACHE_TTL = 3600
+
+# Побочные эффекты лайков/комментариев/подписок (core.services.interaction_effects):
+# пересчет выполняется в фоне не чаще одного раза за окно (сек) на видео / пользователя.
+# Метрики очереди: /api/interaction-effects-metrics/
+INTERACTION_EFFECT_WINDOWS = {
+    'rating': 5,
+    'karma': 30,
+    'sentiment': 2,
+    'up_next': 60,
+    'embedding': 10,
+}
+
+# Модель тональности комментариев (core.services.sentiment_service): загружается
+# один раз на процесс, запросы объединяются в микропакеты, результаты кэшируются
+SENTIMENT_MODEL_NAME = 'seara/rubert-tiny2-russian-sentiment'
+SENTIMENT_MAX_BATCH = 32
+SENTIMENT_MAX_WAIT_MS = 5
+SENTIMENT_CACHE_TTL = 7 * 86400
+# 'torch' (fp32), 'int8' (динамическое квантование torch) или 'onnx' (ONNX Runtime int8, нужен onnxruntime)
+SENTIMENT_BACKEND = os.environ.get('SENTIMENT_BACKEND', 'int8')
+SENTIMENT_ONNX_DIR = os.path.join(BASE_DIR, 'models', 'sentiment')
+# Размер пакета фонового воркера (core.services.comment_sentiment)
+SENTIMENT_WORKER_BATCH_SIZE = 64
+
+# Прогрев веб-воркера (core.warmup): модель тональности загружается в фоне при
+# старте процесса, а не на первом комментарии. Включается явно; manage.py-команды
+# и Celery не прогреваются. CORE_WARMUP_ROLE=web принудительно помечает процесс
+# как веб-воркер (например, для нестандартного ASGI-сервера)
+CORE_WARMUP_ENABLED = os.environ.get('CORE_WARMUP_ENABLED') == '1'
+
+# Рекомендации на странице видео (core.services.recommendation_index): индекс
+# тег -> видео хранится в кэше, готовые списки живут столько секунд
+RECOMMENDATION_CACHE_TTL = 600
+# Граф переходов между видео (core.services.transition_graph): период
+# полураспада кликов и длина списков "смотреть далее"
+TRANSITION_HALF_LIFE_DAYS = 14
+UP_NEXT_LIMIT = 20
+# Буфер кликов по переходам (core.services.transition_buffer): раз в сколько
+# секунд накопленное пишется в БД и при скольких парах в буфере - досрочно
+TRANSITION_FLUSH_INTERVAL = 5.0
+TRANSITION_BUFFER_MAX_PAIRS = 50000
+# Семантические "похожие видео" (core.services.video_embeddings): векторы
+# названия и описания (CPU-модель), матрица float16 на диске + IVF-индекс
+EMBEDDING_MODEL_NAME = 'cointegrated/rubert-tiny2'
+EMBEDDING_INDEX_DIR = os.path.join(BASE_DIR, 'models', 'embeddings')
+EMBEDDING_SIMILAR_LIMIT = 48
+# Полнотекстовый поиск видео (core.services.video_search): SQLite FTS5 или
+# Postgres tsvector + GIN. Итоговая оценка - BM25 с примесью absolute_rating
+# (доля SEARCH_RATING_WEIGHT); списки id результатов кэшируются на SEARCH_CACHE_TTL секунд
+# Индекс создается командой rebuild_search_index, до этого поиск идет через icontains
+SEARCH_RATING_WEIGHT = 0.3
+SEARCH_MAX_RESULTS = 1000
+SEARCH_CACHE_TTL = 60
+SEARCH_RESULTS_PER_PAGE = 24
+# Конфигурация текстового поиска Postgres (russian стеммит и латиницу английским стеммером)
+SEARCH_PG_CONFIG = 'russian'
+
+# HLS packaging (Celery task core.tasks.package_video_hls)
+# Сегменты лежат в MEDIA_ROOT/hls/<video_id>/<build_id>/ - путь меняется при каждой
+# упаковке, поэтому фронтенд может отдавать их с Cache-Control: immutable
+HLS_PACKAGING_ENABLED = True
+HLS_SEGMENT_SECONDS = 6
+HLS_PACKAGING_TIMEOUT = 3600
+
+# WebP-варианты превью (core.services.thumbnail_service), генерируются при импорте/загрузке
+THUMBNAIL_VARIANT_WIDTHS = (320, 640, 1280)
+THUMBNAIL_WEBP_QUALITY = 80
+
 # Create media directories if they don't exist
-MEDIA_DIRS = ['videos', 'thumbnails', 'channel_banners', 'channel_avatars']
+MEDIA_DIRS = ['videos', 'thumbnails', 'channel_banners', 'channel_avatars', 'hls']
 for dir_name in MEDIA_DIRS:
     os.makedirs(os.path.join(MEDIA_ROOT, dir_name), exist_ok=True)
 
@@ -167,6 +263,26 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'youtube_api.tasks.cleanup_failed_downloads',
         'schedule': 3600.0,  # Run every hour
     },
+    'cleanup-stale-uploads': {
+        'task': 'core.tasks.cleanup_stale_uploads',
+        'schedule': 3600.0,
+    },
+    'rescale-sentiment-weights': {
+        'task': 'core.tasks.rescale_sentiment_weights',
+        'schedule': 86400.0,  # Once a day
+    },
+    'refine-comment-sentiment': {
+        'task': 'core.tasks.refine_comment_sentiment',
+        'schedule': 300.0,
+    },
+    'rebuild-transition-graph': {
+        'task': 'core.tasks.rebuild_transition_graph',
+        'schedule': 86400.0,  # Once a day
+    },
+    'train-video-embedding-index': {
+        'task': 'core.tasks.train_video_embedding_index',
+        'schedule': 86400.0,  # Once a day
+    },
 }
 
 # Cache settings (for download status)
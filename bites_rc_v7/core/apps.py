@@ -14,3 +14,10 @@ class CoreConfig(AppConfig):
             logger.info("Successfully registered core signals")
         except Exception as e:
             logger.error(f"Failed to register core signals: {str(e)}", exc_info=True)
+
+        # Opt-in preload of heavy models in web workers (CORE_WARMUP_ENABLED)
+        try:
+            from core.warmup import start_warmup
+            start_warmup()
+        except Exception as e:
+            logger.error(f"Failed to start warm-up: {str(e)}", exc_info=True)
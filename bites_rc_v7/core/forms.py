@@ -1,7 +1,6 @@
 from django import forms
 from .models import Video, Comment, Channel, UserProfile, Ad
 from django.core.exceptions import ValidationError
-from youtube_api.services import YouTubeService
 
 class VideoUploadForm(forms.ModelForm):
     title = forms.CharField(
@@ -0,0 +1,55 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.services.comment_sentiment import SentimentBackfill
+
+
+class Command(BaseCommand):
+    help = 'Rescore sentiment of existing comments with the model (resumable)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Comments read and written per chunk')
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'SENTIMENT_WORKER_BATCH_SIZE', 64),
+                            help='Texts per model forward pass')
+        parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                            help='Scoring processes (0 - score in this process)')
+        parser.add_argument('--limit', type=int, help='Stop after this many comments')
+        parser.add_argument('--coarse-only', action='store_true',
+                            help='Only comments with the old default or coarse scores (0, 0.33, 0.5, 0.66, 1)')
+        parser.add_argument('--checkpoint', default=os.path.join(settings.BASE_DIR, 'sentiment_backfill.json'),
+                            help='File with the last processed comment id')
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start from the beginning')
+        parser.add_argument('--bulk-rescore', action='store_true',
+                            help='Queue one bulk rating rescore at the end instead of per-video recomputes')
+
+    def handle(self, *args, **options):
+        backfill = SentimentBackfill(
+            checkpoint_path=options['checkpoint'],
+            chunk_size=options['chunk_size'],
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            coarse_only=options['coarse_only'],
+            bulk_rescore=options['bulk_rescore'],
+        )
+        if options['restart']:
+            backfill.reset()
+
+        state = backfill.load_checkpoint()
+        if state['last_pk']:
+            self.stdout.write(f"Resuming after comment {state['last_pk']} ({state['processed']} already processed)")
+
+        started = time.monotonic()
+        initial = state['processed']
+
+        def progress(state):
+            rate = (state['processed'] - initial) / max(time.monotonic() - started, 1e-6)
+            self.stdout.write(f"{state['processed']} comments, {state['changed']} changed, "
+                              f"last id {state['last_pk']}, {rate:.0f} comments/s")
+
+        state = backfill.run(limit=options['limit'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {state['processed']} comments processed, {state['changed']} rescored"
+        ))
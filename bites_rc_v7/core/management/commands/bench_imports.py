@@ -0,0 +1,70 @@
+import os
+import re
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Модули, которые загружают то, что импортирует любой процесс (веб, Celery, manage.py)
+DEFAULT_MODULES = ('core.urls', 'core.views', 'core.forms', 'core.tasks', 'youtube_api.views', 'youtube_api.tasks')
+# Тяжелые зависимости, которые должны загружаться только по требованию
+HEAVY_MODULES = ('torch', 'transformers', 'onnxruntime', 'yt_dlp', 'aiohttp', 'supabase')
+
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+
+
+class Command(BaseCommand):
+    help = 'Measure cold import time of the Django app with python -X importtime and fail on regressions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--module', action='append', dest='modules',
+                            help=f'Module to import after django.setup() (default: {", ".join(DEFAULT_MODULES)})')
+        parser.add_argument('--budget-ms', type=float, default=getattr(settings, 'IMPORT_TIME_BUDGET_MS', 2000),
+                            help='Fail if the total import time exceeds this')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs, the fastest one is reported')
+        parser.add_argument('--top', type=int, default=15, help='Show the slowest modules')
+
+    def measure(self, modules):
+        """Один запуск в чистом интерпретаторе: {модуль: (self мкс, cumulative мкс)}, итог мкс"""
+        code = 'import django; django.setup(); ' + '; '.join(f'import {module}' for module in modules)
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'bites_videos.settings'))
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=settings.BASE_DIR,
+                                env=env, capture_output=True, text=True)
+        if result.returncode:
+            raise CommandError(f'Import failed:\n{result.stderr[-2000:]}')
+
+        timings = {}
+        total = 0
+        for line in result.stderr.splitlines():
+            match = IMPORTTIME_RE.match(line)
+            if not match:
+                continue
+            own, cumulative, indent, name = int(match[1]), int(match[2]), match[3], match[4]
+            timings[name] = (own, cumulative)
+            if len(indent) <= 1:
+                total += cumulative  # модуль верхнего уровня
+        return timings, total
+
+    def handle(self, *args, **options):
+        modules = options['modules'] or DEFAULT_MODULES
+        runs = [self.measure(modules) for _ in range(max(1, options['repeat']))]
+        timings, total = min(runs, key=lambda run: run[1])
+        total_ms = total / 1000
+
+        self.stdout.write('Slowest modules (cumulative, ms):')
+        slowest = sorted(timings.items(), key=lambda item: item[1][1], reverse=True)[:options['top']]
+        for name, (own, cumulative) in slowest:
+            self.stdout.write(f'  {cumulative / 1000:8.1f}  (self {own / 1000:6.1f})  {name}')
+
+        heavy = sorted(name for name in timings if name in HEAVY_MODULES)
+        self.stdout.write(f'Total import time: {total_ms:.0f} ms (budget {options["budget_ms"]:.0f} ms)')
+
+        problems = []
+        if heavy:
+            problems.append(f'heavy modules imported eagerly: {", ".join(heavy)}')
+        if total_ms > options['budget_ms']:
+            problems.append(f'import time {total_ms:.0f} ms is over the {options["budget_ms"]:.0f} ms budget')
+        if problems:
+            raise CommandError('; '.join(problems))
+        self.stdout.write(self.style.SUCCESS('Import time is within budget'))
@@ -0,0 +1,74 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import Comment
+from core.services import lexicon
+from core.services.sentiment_service import has_cyrillic, keyword_sentiment
+
+SAMPLE_TEXTS = [
+    'Смотрел до конца, неплохо получилось',
+    'Звук тихий, ничего не слышно',
+    'Отличное видео, автору респект',
+    'What a great video, thanks!',
+    'Монтаж затянутый, но идея интересная',
+    'this is the worst thing i have ever seen',
+    'Не понял, зачем это снимать',
+]
+
+
+def list_scan_sentiment(text):
+    """Прежняя проверка: подстроки из четырех списков, по одному проходу на слово"""
+    content_lower = text.lower()
+    english_negative = lexicon.NEGATIVE_WORDS
+    russian_negative = lexicon.NEGATIVE_STEMS + lexicon.NEGATIVE_ROOTS
+    english_positive = lexicon.POSITIVE_WORDS
+    russian_positive = lexicon.POSITIVE_STEMS + lexicon.POSITIVE_ROOTS
+    cyrillic = has_cyrillic(content_lower)
+
+    negative = english_negative + russian_negative if cyrillic else english_negative
+    if any(word in content_lower for word in negative):
+        return 0.0
+    positive = english_positive + russian_positive if cyrillic else english_positive
+    if any(word in content_lower for word in positive):
+        return 1.0
+    return None
+
+
+class Command(BaseCommand):
+    help = 'Compare the compiled lexicon matcher with the list scan on comment texts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--texts', type=int, default=10000, help='Number of texts to check')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per method, the best one is reported')
+        parser.add_argument('--from-db', action='store_true', help='Use the latest comments instead of sample texts')
+
+    def texts(self, count, from_db):
+        if from_db:
+            texts = list(Comment.objects.order_by('-pk').values_list('content', flat=True)[:count])
+        else:
+            texts = []
+        source = texts or SAMPLE_TEXTS
+        return [source[i % len(source)] for i in range(count)]
+
+    def best_time(self, func, texts, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for text in texts:
+                func(text)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def handle(self, *args, **options):
+        texts = self.texts(options['texts'], options['from_db'])
+        repeat = options['repeat']
+
+        old = self.best_time(list_scan_sentiment, texts, repeat)
+        new = self.best_time(keyword_sentiment, texts, repeat)
+        changed = sum(1 for text in texts if list_scan_sentiment(text) != keyword_sentiment(text))
+
+        self.stdout.write(f'list scan: {len(texts) / old:10.0f} texts/s ({old * 1e6 / len(texts):.2f} us/text)')
+        self.stdout.write(f' compiled: {len(texts) / new:10.0f} texts/s ({new * 1e6 / len(texts):.2f} us/text)')
+        self.stdout.write(f'  speedup: x{old / new:.1f}, verdict differs on {changed} of {len(texts)} texts')
@@ -0,0 +1,65 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import Comment
+from core.services.sentiment_service import SentimentService
+
+SAMPLE_TEXTS = [
+    'Смотрел до конца, неплохо получилось',
+    'Звук тихий, ничего не слышно',
+    'А где продолжение?',
+    'Монтаж затянутый, но идея интересная',
+    'Спасибо автору за подробный разбор',
+    'Не понял, зачем это снимать',
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare per-text and batched sentiment inference throughput on CPU'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--texts', type=int, default=256, help='Number of texts to score')
+        parser.add_argument('--batch-size', type=int, default=32)
+        parser.add_argument('--backend', choices=SentimentService.BACKENDS, action='append', dest='backends',
+                            help='Backend to benchmark (can be repeated, default: all)')
+        parser.add_argument('--from-db', action='store_true', help='Use the latest comments instead of sample texts')
+
+    def texts(self, count, from_db):
+        if from_db:
+            texts = list(Comment.objects.order_by('-pk').values_list('content', flat=True)[:count])
+        else:
+            texts = []
+        source = texts or SAMPLE_TEXTS
+        # Суффикс делает тексты уникальными, как в реальном потоке комментариев
+        return [f"{source[i % len(source)]} #{i}" for i in range(count)]
+
+    def handle(self, *args, **options):
+        texts = self.texts(options['texts'], options['from_db'])
+        batch_size = options['batch_size']
+
+        for backend in options['backends'] or SentimentService.BACKENDS:
+            service = SentimentService.from_settings()
+            service.backend = backend
+            try:
+                started = time.perf_counter()
+                service.load()
+                load_time = time.perf_counter() - started
+                service._forward(texts[:batch_size], batch_size)  # прогрев
+            except Exception as e:
+                self.stdout.write(self.style.WARNING(f'{backend}: unavailable ({e})'))
+                continue
+
+            started = time.perf_counter()
+            for text in texts:
+                service._forward([text], 1)
+            single = time.perf_counter() - started
+
+            started = time.perf_counter()
+            service._forward(texts, batch_size)
+            batched = time.perf_counter() - started
+
+            self.stdout.write(
+                f'{backend:>6}: load {load_time:.1f}s | per-text {len(texts) / single:8.1f} texts/s | '
+                f'batched({batch_size}) {len(texts) / batched:8.1f} texts/s | speedup x{single / batched:.1f}'
+            )
@@ -0,0 +1,65 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import Video
+from core.services.video_embeddings import video_embedder, video_embedding_index, video_text
+
+
+class Command(BaseCommand):
+    help = 'Embed titles and descriptions of all videos and train the semantic similar-video index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Videos read and written per chunk')
+        parser.add_argument('--batch-size', type=int, default=32, help='Texts per model forward pass')
+        parser.add_argument('--limit', type=int, help='Stop after this many videos')
+        parser.add_argument('--no-train', action='store_true', help='Only write vectors, keep the IVF centroids')
+        parser.add_argument('--bench', type=int, default=0, metavar='N',
+                            help='Afterwards time N similar-video queries for random videos')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        rows = Video.objects.order_by('pk').values_list('pk', 'title', 'description')
+        if options['limit']:
+            rows = rows[:options['limit']]
+
+        done = 0
+        chunk = []
+        for row in rows.iterator(chunk_size=options['chunk_size']):
+            chunk.append(row)
+            if len(chunk) >= options['chunk_size']:
+                done += self.embed(chunk, options['batch_size'])
+                chunk = []
+        if chunk:
+            done += self.embed(chunk, options['batch_size'])
+        self.stdout.write(f'Embedded {done} videos in {time.monotonic() - started:.1f}s')
+
+        if not options['no_train']:
+            lists = video_embedding_index.train()
+            self.stdout.write(f'Trained {lists} IVF lists' if lists else 'Too few videos for IVF, using exact search')
+
+        if options['bench']:
+            self.bench(options['bench'])
+        self.stdout.write(self.style.SUCCESS('Video embedding index is ready'))
+
+    def embed(self, chunk, batch_size):
+        vectors = video_embedder.encode([video_text(title, description) for _, title, description in chunk],
+                                        batch_size=batch_size)
+        written = video_embedding_index.upsert([(pk, vector) for (pk, _, _), vector in zip(chunk, vectors)],
+                                               model_name=video_embedder.model_name)
+        self.stdout.write(f'  ... up to video {chunk[-1][0]}')
+        return written
+
+    def bench(self, queries):
+        video_ids = list(Video.objects.values_list('pk', flat=True))
+        if not video_ids:
+            return
+        timings = []
+        for video_id in random.choices(video_ids, k=queries):
+            started = time.perf_counter()
+            video_embedding_index.similar(video_id)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        self.stdout.write(f'similar(): p50 {timings[len(timings) // 2]:.2f} ms, '
+                          f'p99 {timings[int(len(timings) * 0.99)]:.2f} ms over {queries} queries')
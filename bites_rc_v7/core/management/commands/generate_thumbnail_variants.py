@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from core.models import Video
+from core.services.thumbnail_service import ThumbnailService
+
+
+class Command(BaseCommand):
+    help = 'Generate WebP thumbnail variants for existing videos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate variants even if they already exist')
+
+    def handle(self, *args, **options):
+        force = options['force']
+        videos = Video.objects.exclude(thumbnail='').exclude(thumbnail__isnull=True)
+        if not force:
+            videos = videos.filter(thumbnail_variants=[])
+
+        generated = 0
+        failed = 0
+        for video in videos.iterator():
+            if ThumbnailService.generate_variants(video, force=force):
+                generated += 1
+            else:
+                failed += 1
+                self.stdout.write(self.style.WARNING(f'Could not generate variants for video {video.id}'))
+
+        self.stdout.write(self.style.SUCCESS(f'Generated thumbnail variants for {generated} videos ({failed} failed)'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.services.recommendation_index import RecommendationIndex
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the tag -> video posting lists used for video recommendations'
+
+    def handle(self, *args, **options):
+        tags = RecommendationIndex.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt posting lists for {tags} tags'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.services.video_search import VideoSearch
+
+
+class Command(BaseCommand):
+    help = 'Create (on first run) and rebuild the full-text search index of video titles and descriptions'
+
+    def handle(self, *args, **options):
+        if VideoSearch.backend() is None:
+            self.stdout.write(self.style.WARNING('This database has no full-text search, search falls back to icontains'))
+            return
+        videos = VideoSearch.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {videos} videos'))
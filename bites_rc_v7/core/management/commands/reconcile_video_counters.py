@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from core.services.engagement_counters import EngagementCounters
+
+
+class Command(BaseCommand):
+    help = 'Recount likes, dislikes, comments and sentiment sums on videos and repair drifted counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--video', type=int, action='append', dest='video_ids',
+                            help='Reconcile only the given video id (can be repeated)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report videos with drifted counters')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        drifted = EngagementCounters.reconcile(
+            video_ids=options['video_ids'],
+            dry_run=options['dry_run'],
+            batch_size=options['batch_size'],
+        )
+        for video_id in drifted:
+            self.stdout.write(self.style.WARNING(f'Counters drifted on video {video_id}'))
+
+        action = 'Found' if options['dry_run'] else 'Repaired'
+        self.stdout.write(self.style.SUCCESS(f'{action} drifted counters on {len(drifted)} videos'))
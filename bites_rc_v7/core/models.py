@@ -1,11 +1,11 @@
 from django.db import models
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.files.storage import FileSystemStorage
-import math
-from django.utils import timezone
 from django.db.models import Avg
 import os
 import re
+import uuid
 from urllib.parse import unquote
 from django.utils.text import slugify
 import logging
@@ -107,37 +107,41 @@ class UserProfile(models.Model):
         return self.user.username
     
     def calculate_karma(self):
-        # Fetch data needed for karma calculation
-        uploaded_videos = self.user.uploaded_videos.all()
-        total_likes = sum(video.likes.count() for video in uploaded_videos)
-        comments = self.user.comments.all()
-        comment_sentiments = [c.sentiment for c in comments]
+        """
+        Karma from four aggregate queries: uploaded videos (counter columns),
+        the user's own comments, likes given and subscribers of the first channel.
+        Views schedule it through KarmaService instead of calling it per event.
+        """
+        video_totals = self.user.uploaded_videos.aggregate(
+            count=models.Count('id'),
+            likes=models.Sum('likes_total'),
+            comments=models.Sum('comments_total'),
+            sentiment=models.Sum('sentiment_sum'),
+        )
+        comment_totals = self.user.comments.aggregate(
+            count=models.Count('id'),
+            sentiment=models.Sum('sentiment'),
+        )
+        total_likes = video_totals['likes'] or 0
+        videos_uploaded = video_totals['count']
         likes_given = self.user.liked_videos.count()
-        videos_uploaded = uploaded_videos.count()
         
-        # Get subscriber count
-        try:
-            subscribers = self.user.channels.first().subscribers.count() if self.user.channels.first() else 0
-        except:
-            subscribers = 0
+        # Get subscriber count of the first channel
+        subscribers = self.user.channels.order_by('pk').annotate(
+            subscriber_count=models.Count('subscribers')
+        ).values_list('subscriber_count', flat=True).first() or 0
         
         # Assume unsubscribers as 0 for now since it's not tracked
         unsubscribers = 0
         
-        # Get sentiments for comments on user's videos
-        comment_sentiments_on_videos = []
-        for video in uploaded_videos:
-            video_comments = video.comments.all()
-            comment_sentiments_on_videos.extend([c.sentiment for c in video_comments])
-        
-        # Calculate averages
-        avg_sentiment_comments = sum(comment_sentiments) / (len(comment_sentiments) or 1)
-        avg_sentiment_video = sum(comment_sentiments_on_videos) / (len(comment_sentiments_on_videos) or 1)
+        # Calculate averages (sentiment on user's videos comes from the counter columns)
+        avg_sentiment_comments = (comment_totals['sentiment'] or 0) / (comment_totals['count'] or 1)
+        avg_sentiment_video = (video_totals['sentiment'] or 0) / (video_totals['comments'] or 1)
         
         # Calculate karma components
         karma = 0
         karma += likes_given * 0.5
-        karma += len(comments) * avg_sentiment_comments * 1.2
+        karma += comment_totals['count'] * avg_sentiment_comments * 1.2
         karma += videos_uploaded * 10
         karma += (subscribers + unsubscribers) * 2
         karma += total_likes * 0.8
@@ -147,11 +151,16 @@ class UserProfile(models.Model):
         karma *= 66.6
         
         self.karma = round(karma, 2)
-        self.save()
+        self.save(update_fields=['karma'])
         
         return self.karma
 
 class Video(models.Model):
+    # Счетчики, которые core.services.engagement_counters меняет только через F();
+    # обычный save() их не перезаписывает (см. save)
+    COUNTER_FIELDS = ('likes_total', 'dislikes_total', 'comments_total',
+                      'sentiment_sum', 'weighted_sentiment', 'sentiment_weight')
+
     title = models.CharField(max_length=200)
     description = models.TextField(blank=True)
     file = models.FileField(upload_to='videos/', blank=True, null=True)
@@ -177,8 +186,35 @@ class Video(models.Model):
     youtube_likes = models.PositiveIntegerField(default=0)
     youtube_dislikes = models.PositiveIntegerField(default=0)
     youtube_thumbnail_url = models.URLField(blank=True, null=True)
+    # WebP variants of the thumbnail: [{'width': 320, 'name': 'thumbnails/..._320w.webp'}, ...]
+    thumbnail_variants = models.JSONField(blank=True, default=list)
     is_downloaded = models.BooleanField(default=False)
-    
+    # File validators captured when the download/upload completes (ETag/Last-Modified without stat)
+    file_size = models.BigIntegerField(blank=True, null=True)
+    file_mtime = models.FloatField(blank=True, null=True)
+    file_inode = models.BigIntegerField(blank=True, null=True)
+    # file.name the validators above were taken from; a replaced file invalidates them
+    file_validated_name = models.CharField(max_length=255, blank=True, default='')
+
+    # HLS packaging (master playlist path is relative to MEDIA_ROOT)
+    hls_status = models.CharField(max_length=20, blank=True, default='', choices=[
+        ('pending', 'В очереди'),
+        ('processing', 'Упаковка'),
+        ('ready', 'Готово'),
+        ('failed', 'Ошибка')
+    ])
+    hls_master = models.CharField(max_length=255, blank=True, default='')
+    hls_renditions = models.JSONField(blank=True, default=list)
+
+    # Денормализованные счетчики реакций (core.services.engagement_counters)
+    likes_total = models.PositiveIntegerField(default=0)
+    dislikes_total = models.PositiveIntegerField(default=0)
+    comments_total = models.PositiveIntegerField(default=0)
+    sentiment_sum = models.FloatField(default=0)
+    weighted_sentiment = models.FloatField(default=0)  # sum(sentiment * weight)
+    sentiment_weight = models.FloatField(default=0)  # sum(weight)
+    sentiment_anchor = models.FloatField(default=0)  # days since ENGAGEMENT_EPOCH the weights are relative to
+
     # Rating calculations
     absolute_rating = models.FloatField(default=0)
     analysis = models.JSONField(blank=True, null=True, default=dict)  # JSON characteristics from video analysis
@@ -188,22 +224,41 @@ class Video(models.Model):
 
     @property
     def likes_count(self):
+        """Platform likes from the counter column, plus YouTube likes for imported videos"""
         if self.is_youtube:
-            print(f"Video {self.pk} is YouTube video, returning youtube_likes plus user likes: {self.youtube_likes + self.likes.count()}")
-            return self.youtube_likes + self.likes.count()
-        else:
-            count = self.likes.count()
-            print(f"Video {self.pk} is local video, returning likes count: {count}")
-            return count
+            return self.youtube_likes + self.likes_total
+        return self.likes_total
 
     def get_dislikes_count(self):
         """Get total dislikes count - only platform dislikes for non-YouTube videos"""
         if self.is_youtube:
-            print(f"Video {self.pk} is YouTube video, returning 0 dislikes")
             return 0  # Не показываем дизлайки для YouTube видео
-        count = self.dislikes.count()
-        print(f"Video {self.pk} is local video, returning dislikes count: {count}")
-        return count
+        return self.dislikes_total
+
+    @property
+    def sentiment_avg(self):
+        """Recency-weighted average comment sentiment, 0.5 if there are no comments"""
+        if self.comments_total > 0 and self.sentiment_weight > 0:
+            return self.weighted_sentiment / self.sentiment_weight
+        return 0.5
+
+    @property
+    def hls_master_url(self):
+        """URL of the HLS master playlist, or None until packaging is finished"""
+        if self.hls_status == 'ready' and self.hls_master:
+            return f"{settings.MEDIA_URL}{self.hls_master}"
+        return None
+
+    @property
+    def thumbnail_srcset(self):
+        """srcset string with the WebP thumbnail variants, empty if none were generated"""
+        if not self.thumbnail_variants:
+            return ''
+        storage = self._meta.get_field('thumbnail').storage
+        return ', '.join(
+            f"{storage.url(variant['name'])} {variant['width']}w"
+            for variant in self.thumbnail_variants
+        )
 
     def recalculate_ratings(self):
         """Recalculate ratings"""
@@ -228,7 +283,17 @@ class Video(models.Model):
             current_path = str(self.thumbnail)
             if 'thumbnails' in current_path and not current_path.startswith('thumbnails/'):
                 self.thumbnail.name = f"thumbnails/{os.path.basename(current_path)}"
-        
+
+        # Счетчики в памяти могут быть устаревшими: сохранение формы или команды
+        # затерло бы дельты, внесенные через F(). Их пишут только явно через update_fields
+        if (not self._state.adding and self.pk and not args
+                and kwargs.get('update_fields') is None and not kwargs.get('force_insert')):
+            protected = self.COUNTER_FIELDS + ('sentiment_anchor',)
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in protected
+            ]
+
         super().save(*args, **kwargs)
 
     def calculate_absolute_rating(self):
@@ -240,73 +305,11 @@ class Video(models.Model):
         - Video duration
         - Engagement rate (likes/views ratio)
         """
+        # Формула и пересчет живут в сервисе, который импортирует модели
+        from core.services.rating_engine import RatingEngine
+
         try:
-            # Get likes, dislikes and views count based on video type
-            if self.is_youtube:
-                likes = self.youtube_likes + self.likes.count()  # Combine YouTube and local likes
-                views = max(self.youtube_views, 1)  # Avoid division by zero
-                dislikes = self.youtube_dislikes
-            else:
-                likes = self.likes.count()
-                views = max(self.views, 1)  # Avoid division by zero
-                dislikes = self.dislikes.count()
-
-            # Calculate engagement metrics
-            engagement_rate = likes / views if views > 0 else 0
-            
-            # Calculate average sentiment from comments with more weight on recent comments
-            comments = list(self.comments.all())
-            comments_count = len(comments)
-            
-            if comments_count > 0:
-                # Weight comments by recency (newer comments have more weight)
-                now = timezone.now()
-                total_weight = 0
-                weighted_sentiment = 0
-                
-                for comment in comments:
-                    # Calculate weight based on comment age (in days)
-                    age_days = (now - comment.created_at).days
-                    weight = 1.0 / (1 + age_days/30)  # 30-day half-life
-                    weighted_sentiment += comment.sentiment * weight
-                    total_weight += weight
-                
-                sentiment_avg = weighted_sentiment / total_weight if total_weight > 0 else 0.5
-            else:
-                sentiment_avg = 0.5  # Neutral sentiment if no comments
-            
-            # Calculate engagement score with diminishing returns
-            engagement_score = (
-                math.log1p(likes) * 1.5 +  # More weight to likes
-                math.log1p(comments_count) * 1.2 * sentiment_avg +  # Weighted by sentiment
-                math.log1p(self.duration / 60) * 0.8  # Duration in minutes
-            )
-            
-            # Calculate view boost with diminishing returns
-            view_boost = math.log10(1 + views) * 0.8
-            
-            # Apply penalties (if any)
-            penalty = 1.0
-            if dislikes > 0:
-                # Reduce penalty based on like/dislike ratio
-                like_ratio = likes / (likes + dislikes) if (likes + dislikes) > 0 else 1.0
-                penalty *= like_ratio
-            
-            # Calculate final rating with Hell Multiplier
-            HELL_MULTIPLIER = 666
-            rating = HELL_MULTIPLIER * engagement_score * view_boost * penalty
-            
-            # Apply minimum and maximum bounds
-            min_rating = 1.0
-            max_rating = 10000.0
-            rating = max(min_rating, min(max_rating, rating))
-            
-            # Smooth the rating changes to avoid big jumps
-            if self.absolute_rating > 0:
-                # Use weighted average to smooth changes (70% old, 30% new)
-                rating = (self.absolute_rating * 0.7) + (rating * 0.3)
-            
-            self.absolute_rating = round(rating, 3)
+            self.absolute_rating = RatingEngine.score(self)
             self.save(update_fields=['absolute_rating'])
             
             logger.info(f"Calculated rating for video {self.id} ({self.title}): {self.absolute_rating}")
@@ -338,6 +341,8 @@ class Comment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='comments')
     content = models.TextField()
     sentiment = models.FloatField(default=0.5)  # 0 = negative, 0.5 = neutral, 1 = positive
+    # Provisional score, refined by the background sentiment worker
+    sentiment_pending = models.BooleanField(default=False, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -371,6 +376,10 @@ class VideoTransition(models.Model):
     from_video = models.ForeignKey(Video, related_name='transitions_from', on_delete=models.CASCADE)
     to_video = models.ForeignKey(Video, related_name='transitions_to', on_delete=models.CASCADE)
     count = models.PositiveIntegerField(default=0)
+    # Затухающий счетчик переходов на дату score_day (дни от ENGAGEMENT_EPOCH),
+    # см. core.services.transition_graph
+    score = models.FloatField(default=0.0)
+    score_day = models.FloatField(default=0.0)
 
     class Meta:
         unique_together = ('from_video', 'to_video')
@@ -405,3 +414,36 @@ class VideoDownloadQueue(models.Model):
     
     def __str__(self):
         return f"Download {self.video.title} ({self.status})"
+
+
+class ChunkedUpload(models.Model):
+    """
+    Resumable upload session. Chunks are appended to a temporary part file
+    (see core.services.chunked_upload); `offset` is the number of bytes
+    already received and verified.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chunked_uploads')
+    filename = models.CharField(max_length=255)
+    total_size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=[
+        ('uploading', 'Загрузка'),
+        ('finalizing', 'Сборка'),
+        ('complete', 'Завершено'),
+        ('failed', 'Ошибка')
+    ], default='uploading')
+
+    # Video metadata collected at init, applied on finalize
+    title = models.CharField(max_length=200)
+    description = models.TextField(blank=True)
+    tags = models.CharField(max_length=500, blank=True)
+    auto_generate_tags = models.BooleanField(default=False)
+    channel = models.ForeignKey(Channel, on_delete=models.SET_NULL, null=True, blank=True)
+    video = models.ForeignKey(Video, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Upload {self.filename} ({self.offset}/{self.total_size})"
@@ -0,0 +1,255 @@
+import hashlib
+import logging
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from core.models import ChunkedUpload, Tag, Video
+
+logger = logging.getLogger(__name__)
+
+# Размер блока при чтении тела запроса: память воркера не зависит от размера чанка
+READ_BLOCK_SIZE = 64 * 1024
+
+ALLOWED_EXTENSIONS = ('.mp4', '.webm', '.mkv', '.mov', '.avi')
+
+
+class ChunkedUploadError(Exception):
+    """Ошибка протокола загрузки; status - HTTP-код ответа"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def run_upload_pipeline(video, tags=None, auto_generate_tags=False):
+    """
+    Общая обработка только что загруженного видео (форма и chunked-загрузка):
+    валидаторы файла, превью, теги и фоновая упаковка в HLS.
+    Рейтинг пересчитывается сигналом post_save модели Video.
+    """
+    from core.services.hls_packaging import HlsPackagingService
+    from core.services.tag_service import generate_tags_for_video
+    from core.services.thumbnail_service import ThumbnailService
+    from core.services.video_streaming import store_file_validators
+
+    store_file_validators(video)
+    ThumbnailService.generate_variants(video)
+
+    if tags:
+        tag_names = [tag.strip() for tag in tags.split(',') if tag.strip()]
+        video.tags.add(*[Tag.objects.get_or_create(name=name)[0] for name in tag_names])
+
+    if auto_generate_tags:
+        generate_tags_for_video(video)
+
+    # Упаковка в HLS выполняется в фоне (Celery)
+    HlsPackagingService.schedule(video)
+
+
+def run_file_replaced_pipeline(video):
+    """
+    Обработка замены файла уже опубликованного видео (edit_video): валидаторы
+    снимаются с нового файла, упаковка HLS старого файла сбрасывается и ставится заново.
+    """
+    from core.services.hls_packaging import HlsPackagingService
+    from core.services.video_streaming import forget_file_validators, store_file_validators
+
+    # Валидаторы старого файла дали бы неверные Content-Length, Range и 304
+    if store_file_validators(video) is None:
+        forget_file_validators(video)
+
+    # Иначе плеер продолжит получать HLS-рендишены старого файла
+    HlsPackagingService.reset(video)
+    HlsPackagingService.schedule(video)
+
+
+class ChunkedUploadService:
+    """
+    Возобновляемая загрузка видео по протоколу init / append / finalize.
+
+    - init создает сессию и пустой part-файл в CHUNKED_UPLOAD_DIR;
+    - append пишет тело запроса прямо в part-файл со смещения offset блоками
+      по 64 КБ, параллельно считая sha256; при несовпадении с X-Chunk-Sha256
+      записанное отбрасывается (truncate), offset не двигается;
+    - повтор уже принятого чанка (обрыв связи после записи) безопасен: клиент
+      узнает актуальный offset через status и продолжает с него;
+    - finalize переносит part-файл в MEDIA_ROOT/videos/ через os.replace
+      (без повторного чтения) и запускает обычную обработку загруженного видео.
+    """
+
+    @classmethod
+    def upload_dir(cls):
+        return getattr(settings, 'CHUNKED_UPLOAD_DIR', os.path.join(settings.MEDIA_ROOT, 'uploads_tmp'))
+
+    @classmethod
+    def max_chunk_size(cls):
+        return getattr(settings, 'CHUNKED_UPLOAD_MAX_CHUNK_SIZE', 16 * 1024 * 1024)
+
+    @classmethod
+    def part_path(cls, upload):
+        return os.path.join(cls.upload_dir(), f"{upload.pk}.part")
+
+    @classmethod
+    def init_upload(cls, user, data):
+        filename = get_valid_filename(os.path.basename(str(data.get('filename') or '')))
+        if not filename or os.path.splitext(filename)[1].lower() not in ALLOWED_EXTENSIONS:
+            raise ChunkedUploadError('Неподдерживаемый формат файла')
+        try:
+            total_size = int(data.get('size'))
+        except (TypeError, ValueError):
+            raise ChunkedUploadError('Не указан размер файла')
+        max_size = getattr(settings, 'CHUNKED_UPLOAD_MAX_SIZE', 10 * 1024 ** 3)
+        if total_size <= 0 or total_size > max_size:
+            raise ChunkedUploadError('Недопустимый размер файла', status=413)
+        title = (data.get('title') or '').strip()
+        if not title:
+            raise ChunkedUploadError('Не указано название видео')
+
+        # Как и в обычной загрузке, видео привязывается к каналу пользователя
+        channel_id = data.get('channel')
+        channel = user.channels.filter(pk=channel_id).first() if channel_id else user.channels.first()
+
+        upload = ChunkedUpload.objects.create(
+            user=user,
+            filename=filename,
+            total_size=total_size,
+            title=title[:200],
+            description=data.get('description') or '',
+            tags=(data.get('tags') or '')[:500],
+            auto_generate_tags=bool(data.get('auto_generate_tags')),
+            channel=channel,
+        )
+        os.makedirs(cls.upload_dir(), exist_ok=True)
+        open(cls.part_path(upload), 'wb').close()
+        logger.info(f"[CHUNKED_UPLOAD_INIT] Upload {upload.pk} started by {user.username}: {filename}, {total_size} bytes")
+        return upload
+
+    @classmethod
+    def append_chunk(cls, upload, offset, stream, length, checksum):
+        """
+        Дописывает чанк длиной length со смещения offset. Возвращает новый offset.
+        """
+        if upload.status != 'uploading':
+            raise ChunkedUploadError('Загрузка уже завершена', status=409)
+        if not checksum:
+            raise ChunkedUploadError('Не указан заголовок X-Chunk-Sha256')
+        if length <= 0:
+            raise ChunkedUploadError('Пустой чанк')
+        if length > cls.max_chunk_size():
+            raise ChunkedUploadError('Слишком большой чанк', status=413)
+        if offset + length > upload.total_size:
+            raise ChunkedUploadError('Чанк выходит за пределы файла', status=416)
+        if offset + length <= upload.offset:
+            # Чанк уже принят ранее (повтор после обрыва связи)
+            return upload.offset
+        if offset != upload.offset:
+            raise ChunkedUploadError(f'Ожидается offset {upload.offset}', status=409)
+
+        digest = hashlib.sha256()
+        written = 0
+        with open(cls.part_path(upload), 'r+b') as f:
+            f.seek(offset)
+            while written < length:
+                block = stream.read(min(READ_BLOCK_SIZE, length - written))
+                if not block:
+                    break
+                digest.update(block)
+                f.write(block)
+                written += len(block)
+            if written != length or digest.hexdigest() != checksum.lower():
+                f.truncate(offset)
+                reason = 'Соединение оборвалось' if written != length else 'Контрольная сумма не совпадает'
+                logger.warning(f"[CHUNKED_UPLOAD_REJECT] Upload {upload.pk} chunk at {offset}: {reason}")
+                raise ChunkedUploadError(reason, status=400 if written == length else 408)
+            f.truncate(offset + length)
+
+        new_offset = offset + length
+        # Условное обновление: параллельный повтор того же чанка не сдвинет offset дважды
+        ChunkedUpload.objects.filter(pk=upload.pk, offset=offset).update(offset=new_offset, updated_at=timezone.now())
+        upload.offset = new_offset
+        return new_offset
+
+    @staticmethod
+    def _fail(upload):
+        upload.status = 'failed'
+        ChunkedUpload.objects.filter(pk=upload.pk).update(status='failed', updated_at=timezone.now())
+
+    @classmethod
+    def finalize(cls, upload):
+        """Собирает видео из part-файла и запускает обработку. Возвращает Video"""
+        if upload.status == 'complete' and upload.video_id:
+            return upload.video
+        if upload.offset != upload.total_size:
+            raise ChunkedUploadError(f'Получено {upload.offset} из {upload.total_size} байт', status=409)
+
+        # Захват сессии: из параллельных finalize дальше проходит только один
+        claimed = ChunkedUpload.objects.filter(pk=upload.pk, status='uploading').update(
+            status='finalizing', updated_at=timezone.now(),
+        )
+        if not claimed:
+            upload.refresh_from_db()
+            if upload.status == 'complete' and upload.video_id:
+                return upload.video
+            raise ChunkedUploadError('Загрузка уже собирается или завершилась ошибкой', status=409)
+        upload.status = 'finalizing'
+
+        part_path = cls.part_path(upload)
+        if not os.path.exists(part_path) or os.path.getsize(part_path) != upload.total_size:
+            cls._fail(upload)
+            raise ChunkedUploadError('Временный файл загрузки поврежден', status=410)
+
+        storage = Video._meta.get_field('file').storage
+        name = storage.get_available_name(f"videos/{upload.filename}")
+        final_path = storage.path(name)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(part_path, final_path)
+        os.chmod(final_path, getattr(settings, 'FILE_UPLOAD_PERMISSIONS', None) or 0o644)
+
+        try:
+            with transaction.atomic():
+                video = Video(
+                    title=upload.title,
+                    description=upload.description,
+                    uploaded_by=upload.user,
+                    channel=upload.channel,
+                )
+                video.file.name = name
+                video.save()
+                upload.status = 'complete'
+                upload.video = video
+                upload.save(update_fields=['status', 'video', 'updated_at'])
+        except Exception:
+            # Видео не создано - перемещенный файл никому не принадлежит
+            try:
+                os.remove(final_path)
+            except OSError:
+                pass
+            cls._fail(upload)
+            raise
+
+        logger.info(f"[CHUNKED_UPLOAD_COMPLETE] Upload {upload.pk} assembled into video {video.pk}")
+        run_upload_pipeline(video, upload.tags, upload.auto_generate_tags)
+        return video
+
+    @classmethod
+    def cleanup_stale(cls):
+        """Удаляет незавершенные загрузки старше CHUNKED_UPLOAD_EXPIRY_HOURS вместе с part-файлами"""
+        hours = getattr(settings, 'CHUNKED_UPLOAD_EXPIRY_HOURS', 24)
+        cutoff = timezone.now() - timedelta(hours=hours)
+        stale = ChunkedUpload.objects.filter(updated_at__lt=cutoff).exclude(status='complete')
+        removed = 0
+        for upload in stale:
+            try:
+                os.remove(cls.part_path(upload))
+            except OSError:
+                pass
+            upload.delete()
+            removed += 1
+        if removed:
+            logger.info(f"[CHUNKED_UPLOAD_CLEANUP] Removed {removed} stale uploads")
+        return removed
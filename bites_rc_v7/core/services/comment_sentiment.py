@@ -0,0 +1,239 @@
+import itertools
+import json
+import logging
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from core.models import Comment, Video
+from core.services.engagement_counters import EngagementCounters
+from core.services.interaction_effects import InteractionEffects
+from core.services.rating_engine import RatingEngine
+from core.services.sentiment_service import SentimentService, sentiment_service
+
+logger = logging.getLogger(__name__)
+
+
+def refine_pending_comments(batch_size=None, max_batches=None):
+    """
+    Фоновое уточнение тональности: комментарии с провизорной оценкой
+    (sentiment_pending) выбираются пакетами, оцениваются моделью за один прогон
+    на пакет и записываются через bulk_update. Суммы тональности видео сдвигаются
+    на дельту, рейтинг и карма ставятся в очередь InteractionEffects.
+    Возвращает количество обработанных комментариев.
+    """
+    batch_size = batch_size or getattr(settings, 'SENTIMENT_WORKER_BATCH_SIZE', 64)
+    processed = 0
+    batches = 0
+    last_pk = 0
+
+    while max_batches is None or batches < max_batches:
+        comments = list(
+            Comment.objects.filter(sentiment_pending=True, pk__gt=last_pk)
+            .order_by('pk')
+            .only('id', 'video_id', 'user_id', 'content', 'sentiment', 'created_at')[:batch_size]
+        )
+        if not comments:
+            break
+        last_pk = comments[-1].pk
+
+        scores = sentiment_service.score([comment.content for comment in comments], batched=False, fallback=False)
+        if scores is None:
+            # Модель недоступна: пакет остается ожидающим, следующий проход (beat) повторит его
+            logger.warning(f"[SENTIMENT_WORKER] Model unavailable, {len(comments)} comments left pending")
+            break
+        changes = []
+        for comment, score in zip(comments, scores):
+            changes.append((comment, comment.sentiment))
+            comment.sentiment = score
+            comment.sentiment_pending = False
+
+        with transaction.atomic():
+            Comment.objects.bulk_update(comments, ['sentiment', 'sentiment_pending'])
+            video_ids = EngagementCounters.sentiment_batch_changed(changes)
+
+        for video_id in video_ids:
+            InteractionEffects.enqueue('rating', video_id)
+        for user_id in {comment.user_id for comment, _ in changes}:
+            InteractionEffects.enqueue('karma', user_id)
+
+        processed += len(comments)
+        batches += 1
+
+    if processed:
+        logger.info(f"[SENTIMENT_WORKER] Refined sentiment of {processed} comments in {batches} batches")
+    return processed
+
+
+# Значения, которые давал прежний add_comment (словарь и грубая шкала модели)
+COARSE_SENTIMENTS = (0.0, 0.33, 0.5, 0.66, 1.0)
+
+_worker_service = None
+
+
+def _init_backfill_worker(threads):
+    """Инициализатор процесса пула: своя модель и ограничение потоков torch"""
+    global _worker_service
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _worker_service = SentimentService.from_settings()
+
+
+def _score_texts(texts):
+    service = _worker_service or sentiment_service
+    return service._forward(texts)
+
+
+class SentimentBackfill:
+    """
+    Массовая переоценка тональности исторических комментариев.
+
+    Комментарии читаются потоком (values_list + iterator) кусками по chunk_size
+    в порядке pk, тексты куска делятся на пакеты по batch_size и оцениваются в
+    пуле процессов (модель загружается один раз на процесс). Пока пул считает
+    следующий кусок, предыдущий записывается: bulk_update в короткой транзакции
+    вместе с дельтами сумм тональности видео. После каждой записи последний pk
+    сохраняется в файл контрольной точки, так что прерванный запуск
+    продолжается с места остановки.
+
+    Рейтинг затронутых видео и карма авторов ставятся в очередь
+    InteractionEffects после каждого куска; с bulk_rescore=True вместо
+    поштучной очереди в конце запускается RatingEngine.schedule_bulk_rescore().
+    """
+
+    def __init__(self, checkpoint_path, chunk_size=2000, batch_size=64, workers=1,
+                 coarse_only=False, bulk_rescore=False):
+        self.checkpoint_path = checkpoint_path
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.workers = workers
+        self.coarse_only = coarse_only
+        self.bulk_rescore = bulk_rescore
+
+    # --- контрольная точка --------------------------------------------------
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'last_pk': 0, 'processed': 0, 'changed': 0}
+
+    def save_checkpoint(self, state):
+        tmp_path = f'{self.checkpoint_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def reset(self):
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    # --- обработка ----------------------------------------------------------
+
+    def queryset(self, after_pk):
+        comments = Comment.objects.filter(pk__gt=after_pk)
+        if self.coarse_only:
+            comments = comments.filter(sentiment__in=COARSE_SENTIMENTS)
+        return comments.order_by('pk')
+
+    def _chunks(self, after_pk, limit):
+        rows = self.queryset(after_pk).values_list(
+            'pk', 'video_id', 'user_id', 'content', 'sentiment', 'sentiment_pending', 'created_at',
+        )
+        if limit:
+            rows = rows[:limit]
+        iterator = rows.iterator(chunk_size=self.chunk_size)
+        while True:
+            chunk = list(itertools.islice(iterator, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def _submit(self, pool, chunk):
+        texts = [row[3][:2000] for row in chunk]
+        batches = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        if pool is None:
+            return [_score_texts(batch) for batch in batches]
+        return [pool.submit(_score_texts, batch) for batch in batches]
+
+    @staticmethod
+    def _collect(pending):
+        scores = []
+        for batch in pending:
+            scores.extend(batch.result() if isinstance(batch, Future) else batch)
+        return scores
+
+    def _write(self, chunk, scores):
+        """Записывает изменившиеся оценки куска. Возвращает (число изменений, id видео, id пользователей)"""
+        comments = []
+        changes = []
+        for (pk, video_id, user_id, _, old, pending, created_at), score in zip(chunk, scores):
+            if score == old and not pending:
+                continue
+            comment = Comment(pk=pk, video_id=video_id, user_id=user_id, sentiment=score,
+                              sentiment_pending=False, created_at=created_at)
+            comments.append(comment)
+            changes.append((comment, old))
+
+        if not comments:
+            return 0, [], set()
+        with transaction.atomic():
+            Comment.objects.bulk_update(comments, ['sentiment', 'sentiment_pending'], batch_size=500)
+            video_ids = EngagementCounters.sentiment_batch_changed(changes)
+        user_ids = {comment.user_id for comment in comments}
+        if video_ids:
+            owners = Video.objects.filter(pk__in=video_ids).values_list('uploaded_by_id', flat=True)
+            user_ids.update(owners)
+        return len(comments), video_ids, user_ids
+
+    def _flush(self, state, chunk, pending, progress):
+        changed, video_ids, user_ids = self._write(chunk, self._collect(pending))
+        state['last_pk'] = chunk[-1][0]
+        state['processed'] += len(chunk)
+        state['changed'] += changed
+        self.save_checkpoint(state)
+
+        if not self.bulk_rescore:
+            for video_id in video_ids:
+                InteractionEffects.enqueue('rating', video_id)
+        for user_id in user_ids:
+            InteractionEffects.enqueue('karma', user_id)
+        if progress:
+            progress(state)
+
+    def run(self, limit=None, progress=None):
+        """Обрабатывает комментарии после контрольной точки. Возвращает итоговое состояние"""
+        state = self.load_checkpoint()
+        pool = None
+        if self.workers > 0:
+            # Дочерние процессы не должны унаследовать открытые соединения с БД
+            connections.close_all()
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            pool = ProcessPoolExecutor(self.workers, initializer=_init_backfill_worker, initargs=(threads,))
+
+        started = time.monotonic()
+        previous = None
+        try:
+            for chunk in self._chunks(state['last_pk'], limit):
+                pending = self._submit(pool, chunk)
+                if previous is not None:
+                    self._flush(state, *previous, progress)
+                previous = (chunk, pending)
+            if previous is not None:
+                self._flush(state, *previous, progress)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        if self.bulk_rescore and state['changed']:
+            RatingEngine.schedule_bulk_rescore()
+        logger.info(f"[SENTIMENT_BACKFILL] Processed {state['processed']} comments up to pk {state['last_pk']}, "
+                    f"{state['changed']} changed, {time.monotonic() - started:.0f}s")
+        return state
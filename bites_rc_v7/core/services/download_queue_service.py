@@ -381,7 +381,15 @@ class DownloadQueueService:
                 cache.set(cls.ACTIVE_DOWNLOADS_KEY, active_count - 1)
                 
             logger.info(f"[TASK_MARK_COMPLETED] Successfully marked queue item {queue_item.id} as completed")
-            
+
+            # Запоминаем размер/mtime/inode файла для ETag и условных GET
+            from core.services.video_streaming import store_file_validators
+            store_file_validators(video)
+
+            # Упаковываем скачанное видео в HLS в фоне
+            from core.services.hls_packaging import HlsPackagingService
+            HlsPackagingService.schedule(video)
+
             # Обрабатываем следующий элемент в очереди
             cls.process_next_in_queue()
             return True
@@ -0,0 +1,191 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import Count, F, FloatField, Value
+from django.db.models.functions import Greatest, Power
+from django.utils import timezone
+
+from core.models import Comment, Dislike, Like, Video
+
+logger = logging.getLogger(__name__)
+
+# Точка отсчета для весов комментариев
+ENGAGEMENT_EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+SENTIMENT_HALF_LIFE_DAYS = 30
+
+COUNTER_FIELDS = Video.COUNTER_FIELDS
+# Беззнаковые счетчики: уменьшение не опускается ниже нуля (CHECK >= 0)
+COUNT_FIELDS = ('likes_total', 'dislikes_total', 'comments_total')
+FLOAT_FIELDS = ('sentiment_sum', 'weighted_sentiment', 'sentiment_weight')
+
+
+def days_since_epoch(moment=None):
+    moment = moment or timezone.now()
+    return (moment - ENGAGEMENT_EPOCH).total_seconds() / 86400
+
+
+def comment_weight(created_at, anchor=0.0):
+    """
+    Вес комментария для средневзвешенной тональности: 2 ** ((t - anchor) / 30 дней),
+    где t и anchor - дни от ENGAGEMENT_EPOCH.
+
+    Для экспоненциального затухания множитель "сейчас" одинаков у всех
+    комментариев и сокращается в отношении weighted_sentiment / sentiment_weight,
+    поэтому обе суммы можно хранить в строке видео и менять на дельту.
+    anchor (Video.sentiment_anchor) периодически сдвигается к текущей дате,
+    чтобы суммы не росли неограниченно (RatingEngine.rescale_sentiment_weights).
+    """
+    return 2.0 ** ((days_since_epoch(created_at) - anchor) / SENTIMENT_HALF_LIFE_DAYS)
+
+
+def weight_expression(created_at):
+    """comment_weight относительно sentiment_anchor строки, вычисляемый в UPDATE"""
+    return Power(
+        Value(2.0),
+        (Value(days_since_epoch(created_at)) - F('sentiment_anchor')) / Value(float(SENTIMENT_HALF_LIFE_DAYS)),
+        output_field=FloatField(),
+    )
+
+
+class EngagementCounters:
+    """
+    Денормализованные счетчики реакций в строке Video (likes_total, dislikes_total,
+    comments_total, суммы тональности). Обновляются атомарно через F() из
+    сигналов Like/Dislike/Comment, поэтому страницы и расчет рейтинга не делают
+    COUNT(*) и не загружают комментарии. Расхождения чинит reconcile()
+    (команда reconcile_video_counters).
+    """
+
+    @staticmethod
+    def _apply(video_id, **deltas):
+        # Строка, еще не сверенная reconcile(), может держать 0 при существующих
+        # реакциях; отрицательное значение нарушило бы CHECK и дало 500
+        Video.objects.filter(pk=video_id).update(
+            **{field: Greatest(F(field) + delta, Value(0)) if field in COUNT_FIELDS else F(field) + delta
+               for field, delta in deltas.items()}
+        )
+
+    @classmethod
+    def like_changed(cls, video_id, delta):
+        cls._apply(video_id, likes_total=delta)
+
+    @classmethod
+    def dislike_changed(cls, video_id, delta):
+        cls._apply(video_id, dislikes_total=delta)
+
+    @classmethod
+    def comment_changed(cls, video_id, sentiment, created_at, sign):
+        """sign = 1 для нового комментария, -1 для удаленного"""
+        weight = weight_expression(created_at)
+        cls._apply(
+            video_id,
+            comments_total=sign,
+            sentiment_sum=sign * sentiment,
+            weighted_sentiment=Value(sign * sentiment) * weight,
+            sentiment_weight=Value(float(sign)) * weight,
+        )
+
+    @classmethod
+    def sentiment_changed(cls, comment, old_sentiment):
+        """Переоценка тональности уже сохраненного комментария"""
+        delta = comment.sentiment - old_sentiment
+        if delta:
+            cls._apply(
+                comment.video_id,
+                sentiment_sum=delta,
+                weighted_sentiment=Value(delta) * weight_expression(comment.created_at),
+            )
+
+    @classmethod
+    def sentiment_batch_changed(cls, changes):
+        """
+        Переоценка пакета комментариев: changes - список (comment, old_sentiment).
+        Дельты суммируются по видео, так что на видео приходится один UPDATE.
+        Вес каждого комментария относительно anchor строки равен
+        2 ** (t / H) * 2 ** (-anchor / H), первый множитель считается здесь, второй - в SQL.
+        """
+        per_video = {}
+        for comment, old_sentiment in changes:
+            delta = comment.sentiment - old_sentiment
+            if not delta:
+                continue
+            plain, weighted = per_video.get(comment.video_id, (0.0, 0.0))
+            per_video[comment.video_id] = (plain + delta, weighted + delta * comment_weight(comment.created_at))
+        anchor_factor = Power(
+            Value(2.0),
+            -F('sentiment_anchor') / Value(float(SENTIMENT_HALF_LIFE_DAYS)),
+            output_field=FloatField(),
+        )
+        for video_id, (plain, weighted) in per_video.items():
+            cls._apply(video_id, sentiment_sum=plain, weighted_sentiment=Value(weighted) * anchor_factor)
+        return list(per_video)
+
+    @classmethod
+    def compute(cls, video_ids=None, anchor=0.0):
+        """
+        Считает счетчики по исходным таблицам: {video_id: {поле: значение}}.
+        Веса тональности считаются относительно anchor.
+        """
+        def scoped(qs):
+            return qs.filter(video_id__in=video_ids) if video_ids is not None else qs
+
+        counters = defaultdict(lambda: dict.fromkeys(COUNTER_FIELDS, 0))
+        for row in scoped(Like.objects).values('video_id').annotate(n=Count('id')):
+            counters[row['video_id']]['likes_total'] = row['n']
+        for row in scoped(Dislike.objects).values('video_id').annotate(n=Count('id')):
+            counters[row['video_id']]['dislikes_total'] = row['n']
+        comments = scoped(Comment.objects).values_list('video_id', 'sentiment', 'created_at')
+        for video_id, sentiment, created_at in comments.iterator():
+            weight = comment_weight(created_at, anchor)
+            row = counters[video_id]
+            row['comments_total'] += 1
+            row['sentiment_sum'] += sentiment
+            row['weighted_sentiment'] += sentiment * weight
+            row['sentiment_weight'] += weight
+        return counters
+
+    @staticmethod
+    def _drifted(video, expected):
+        for field in COUNTER_FIELDS:
+            current, value = getattr(video, field), expected[field]
+            if field in FLOAT_FIELDS:
+                if abs(current - value) > 1e-6 * max(1.0, abs(value)):
+                    return True
+            elif current != value:
+                return True
+        return False
+
+    @classmethod
+    def reconcile(cls, video_ids=None, dry_run=False, batch_size=500):
+        """
+        Сверяет счетчики с таблицами Like/Dislike/Comment и исправляет расхождения.
+        Возвращает список id видео, у которых счетчики разошлись.
+        """
+        anchor = days_since_epoch()
+        expected = cls.compute(video_ids, anchor)
+        videos = Video.objects.only('id', 'sentiment_anchor', *COUNTER_FIELDS)
+        if video_ids is not None:
+            videos = videos.filter(pk__in=video_ids)
+
+        drifted = []
+        for video in videos.iterator(chunk_size=batch_size):
+            values = dict(expected.get(video.pk) or dict.fromkeys(COUNTER_FIELDS, 0))
+            # Сравниваем в системе отсчета строки: у каждой свой sentiment_anchor
+            shift = 2.0 ** ((anchor - video.sentiment_anchor) / SENTIMENT_HALF_LIFE_DAYS)
+            in_row_frame = dict(values, weighted_sentiment=values['weighted_sentiment'] * shift,
+                                sentiment_weight=values['sentiment_weight'] * shift)
+            if not cls._drifted(video, in_row_frame):
+                continue
+            for field, value in values.items():
+                setattr(video, field, value)
+            video.sentiment_anchor = anchor
+            drifted.append(video)
+
+        if drifted and not dry_run:
+            with transaction.atomic():
+                Video.objects.bulk_update(drifted, COUNTER_FIELDS + ('sentiment_anchor',), batch_size=batch_size)
+        if drifted:
+            logger.info(f"[COUNTERS_RECONCILE] {'Found' if dry_run else 'Fixed'} drift on {len(drifted)} videos")
+        return [video.pk for video in drifted]
@@ -0,0 +1,185 @@
+import json
+import logging
+import os
+import shutil
+import subprocess
+import time
+import uuid
+
+from django.conf import settings
+
+from core.models import Video
+
+logger = logging.getLogger(__name__)
+
+
+# Лестница качеств: (имя, высота, битрейт видео, битрейт аудио)
+DEFAULT_HLS_LADDER = [
+    ('1080p', 1080, 5000, 192),
+    ('720p', 720, 2800, 128),
+    ('480p', 480, 1400, 128),
+    ('360p', 360, 800, 96),
+]
+
+
+class HlsPackagingService:
+    """
+    Сервис упаковки скачанных/загруженных видео в многобитрейтный HLS.
+
+    Результат складывается в MEDIA_ROOT/hls/<video_id>/<build_id>/:
+    master.m3u8 + v<N>/index.m3u8 + v<N>/seg_XXXXX.ts.
+    build_id меняется при каждой упаковке, поэтому URL сегментов неизменяемы
+    и могут кэшироваться CDN/браузером без ограничения срока.
+    """
+
+    HLS_DIR = 'hls'
+    MASTER_NAME = 'master.m3u8'
+
+    @classmethod
+    def ladder(cls):
+        return getattr(settings, 'HLS_LADDER', DEFAULT_HLS_LADDER)
+
+    @classmethod
+    def schedule(cls, video):
+        """Ставит упаковку видео в очередь Celery (не блокирует запрос)"""
+        if not getattr(settings, 'HLS_PACKAGING_ENABLED', True) or not video.file:
+            return False
+        try:
+            # Отложенный импорт для избежания циклической зависимости
+            from core.tasks import package_video_hls
+            Video.objects.filter(pk=video.pk).update(hls_status='pending')
+            package_video_hls.delay(video.pk)
+            logger.info(f"[HLS_SCHEDULED] Queued HLS packaging for video {video.pk}")
+            return True
+        except Exception as e:
+            logger.error(f"[HLS_SCHEDULE_ERROR] Could not queue HLS packaging for video {video.pk}: {e}")
+            return False
+
+    @classmethod
+    def reset(cls, video):
+        """Сбрасывает готовую упаковку (файл видео заменен) и удаляет ее сборки"""
+        video.hls_status, video.hls_master, video.hls_renditions = '', '', []
+        Video.objects.filter(pk=video.pk).update(hls_status='', hls_master='', hls_renditions=[])
+        cls.remove_stale_builds(video.pk)
+        logger.info(f"[HLS_RESET] Cleared HLS packaging for video {video.pk}")
+
+    @classmethod
+    def probe(cls, source_path):
+        """Возвращает (высота видео, есть ли аудио) через ffprobe"""
+        cmd = [
+            'ffprobe', '-v', 'error', '-show_entries', 'stream=codec_type,height',
+            '-of', 'json', source_path
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60, check=True)
+        streams = json.loads(result.stdout or '{}').get('streams', [])
+        height = max((s.get('height') or 0 for s in streams if s.get('codec_type') == 'video'), default=0)
+        has_audio = any(s.get('codec_type') == 'audio' for s in streams)
+        return height, has_audio
+
+    @classmethod
+    def select_renditions(cls, source_height):
+        """Оставляет только качества не выше исходного (минимум одно)"""
+        ladder = sorted(cls.ladder(), key=lambda r: r[1], reverse=True)
+        selected = [r for r in ladder if not source_height or r[1] <= source_height]
+        return selected or [ladder[-1]]
+
+    @classmethod
+    def build_command(cls, source_path, output_dir, renditions, has_audio):
+        segment_time = str(getattr(settings, 'HLS_SEGMENT_SECONDS', 6))
+        count = len(renditions)
+        split = f"[0:v]split={count}" + ''.join(f"[v{i}]" for i in range(count))
+        scales = ';'.join(f"[v{i}]scale=w=-2:h={r[1]}[v{i}out]" for i, r in enumerate(renditions))
+
+        cmd = ['ffmpeg', '-y', '-i', source_path, '-filter_complex', f"{split};{scales}"]
+        for i, (_, _, v_kbps, a_kbps) in enumerate(renditions):
+            cmd += [
+                '-map', f'[v{i}out]',
+                f'-c:v:{i}', 'libx264', f'-b:v:{i}', f'{v_kbps}k',
+                f'-maxrate:v:{i}', f'{int(v_kbps * 1.07)}k', f'-bufsize:v:{i}', f'{v_kbps * 2}k',
+            ]
+            if has_audio:
+                cmd += ['-map', 'a:0', f'-c:a:{i}', 'aac', f'-b:a:{i}', f'{a_kbps}k', '-ac', '2']
+        cmd += [
+            '-preset', 'veryfast', '-sc_threshold', '0',
+            # Ключевой кадр на границе каждого сегмента
+            '-force_key_frames', f'expr:gte(t,n_forced*{segment_time})',
+            '-f', 'hls', '-hls_time', segment_time, '-hls_playlist_type', 'vod',
+            '-hls_flags', 'independent_segments',
+            '-hls_segment_filename', os.path.join(output_dir, 'v%v', 'seg_%05d.ts'),
+            '-master_pl_name', cls.MASTER_NAME,
+            '-var_stream_map', ' '.join(
+                f'v:{i},a:{i},name:{r[0]}' if has_audio else f'v:{i},name:{r[0]}'
+                for i, r in enumerate(renditions)
+            ),
+            os.path.join(output_dir, 'v%v', 'index.m3u8'),
+        ]
+        return cmd
+
+    @classmethod
+    def package(cls, video):
+        """
+        Синхронная упаковка (вызывается из Celery-задачи).
+        Пишет во временную директорию и атомарно переименовывает ее после успеха,
+        чтобы плеер никогда не увидел наполовину записанный плейлист.
+        """
+        start_time = time.time()
+        source_path = os.path.join(settings.MEDIA_ROOT, str(video.file))
+        if not os.path.isfile(source_path):
+            raise FileNotFoundError(f"Source file not found: {source_path}")
+
+        Video.objects.filter(pk=video.pk).update(hls_status='processing')
+
+        height, has_audio = cls.probe(source_path)
+        renditions = cls.select_renditions(height)
+
+        video_dir = os.path.join(settings.MEDIA_ROOT, cls.HLS_DIR, str(video.pk))
+        build_id = uuid.uuid4().hex[:12]
+        tmp_dir = os.path.join(video_dir, f'.tmp-{build_id}')
+        final_dir = os.path.join(video_dir, build_id)
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        try:
+            cmd = cls.build_command(source_path, tmp_dir, renditions, has_audio)
+            logger.info(f"[HLS_PACKAGE_START] Video {video.pk}: {[r[0] for r in renditions]} (source {height}p)")
+            subprocess.run(
+                cmd, check=True, capture_output=True,
+                timeout=getattr(settings, 'HLS_PACKAGING_TIMEOUT', 3600)
+            )
+            if not os.path.isfile(os.path.join(tmp_dir, cls.MASTER_NAME)):
+                raise RuntimeError("ffmpeg finished without writing master playlist")
+            os.replace(tmp_dir, final_dir)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        master = '/'.join([cls.HLS_DIR, str(video.pk), build_id, cls.MASTER_NAME])
+        # Если файл заменили во время упаковки, сборка относится к старому файлу
+        updated = Video.objects.filter(pk=video.pk, file=video.file.name).update(
+            hls_status='ready',
+            hls_master=master,
+            hls_renditions=[
+                {'name': name, 'height': h, 'video_kbps': v, 'audio_kbps': a if has_audio else 0}
+                for name, h, v, a in renditions
+            ],
+        )
+        if not updated:
+            shutil.rmtree(final_dir, ignore_errors=True)
+            logger.info(f"[HLS_PACKAGE_STALE] Video {video.pk} file was replaced during packaging, build dropped")
+            return None
+        cls.remove_stale_builds(video.pk, keep=build_id)
+
+        logger.info(f"[HLS_PACKAGE_COMPLETE] Video {video.pk} packaged into {master} in {time.time() - start_time:.2f}s")
+        return master
+
+    @classmethod
+    def remove_stale_builds(cls, video_id, keep=None):
+        """Удаляет предыдущие сборки HLS (и все сборки, если keep=None)"""
+        video_dir = os.path.join(settings.MEDIA_ROOT, cls.HLS_DIR, str(video_id))
+        if not os.path.isdir(video_dir):
+            return
+        if keep is None:
+            shutil.rmtree(video_dir, ignore_errors=True)
+            return
+        for entry in os.listdir(video_dir):
+            if entry != keep and not entry.startswith('.tmp-'):
+                shutil.rmtree(os.path.join(video_dir, entry), ignore_errors=True)
@@ -0,0 +1,164 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOWS = {
+    'rating': 5,
+    'karma': 30,
+    'sentiment': 2,
+    'up_next': 60,
+    'embedding': 10,
+}
+
+METRIC_NAMES = ('scheduled', 'coalesced', 'executed', 'failed')
+
+# Виды, которые не выполняются в запросе, если очередь недоступна: 'sentiment'
+# загружает модель и оценивает весь бэклог, его подберет периодический проход
+# refine_comment_sentiment
+NO_INLINE_FALLBACK = {'sentiment'}
+
+
+def _rescore_video(video_id):
+    from core.services.rating_engine import RatingEngine
+    return RatingEngine.rescore_by_id(video_id)
+
+
+def _recompute_karma(user_id):
+    from core.services.karma_service import KarmaService
+    return KarmaService.recompute(user_id)
+
+
+def _refresh_up_next(video_id):
+    from core.services.transition_graph import TransitionGraph
+    return TransitionGraph.refresh(video_id)
+
+
+def _refresh_embedding(video_id):
+    from core.services.video_embeddings import video_embedding_index
+    return video_embedding_index.refresh_videos([video_id])
+
+
+def _refine_sentiment(_key):
+    from core.services.comment_sentiment import refine_pending_comments
+    return refine_pending_comments()
+
+
+# Вид побочного эффекта -> обработчик(ключ). Ключ - id видео или пользователя
+# ('up_next' - id видео, из которого были переходы; 'embedding' - id видео,
+# у которого изменились название или описание);
+# для 'sentiment' ключ один ('pending'): воркер забирает все ожидающие комментарии
+EFFECT_HANDLERS = {
+    'rating': _rescore_video,
+    'karma': _recompute_karma,
+    'sentiment': _refine_sentiment,
+    'up_next': _refresh_up_next,
+    'embedding': _refresh_embedding,
+}
+
+
+class InteractionEffects:
+    """
+    Очередь побочных эффектов взаимодействий (лайк, дизлайк, комментарий,
+    подписка) с объединением по ключу.
+
+    Обработчик запроса делает только минимальную запись (сама реакция и F()-счетчики)
+    и вызывает enqueue(вид, ключ). Первый вызов в окне ставит задачу Celery
+    с задержкой окна и ключ "pending" в кэше; последующие вызовы в окне только
+    увеличивают счетчик coalesced. Задача снимает ключ перед обработкой, поэтому
+    события, пришедшие во время обработки, запланируют еще один запуск.
+
+    Метрики (scheduled / coalesced / executed / failed, backlog, задержка
+    обработки) хранятся в кэше и отдаются через /api/interaction-effects-metrics/.
+    """
+
+    @staticmethod
+    def window(kind):
+        windows = getattr(settings, 'INTERACTION_EFFECT_WINDOWS', DEFAULT_WINDOWS)
+        return windows.get(kind, DEFAULT_WINDOWS.get(kind, 5))
+
+    @staticmethod
+    def pending_key(kind, key):
+        return f'interaction_effect_pending_{kind}_{key}'
+
+    @staticmethod
+    def _metric_key(kind, name):
+        return f'interaction_effects_{kind}_{name}'
+
+    @classmethod
+    def _incr(cls, kind, name, delta=1):
+        metric_key = cls._metric_key(kind, name)
+        try:
+            cache.incr(metric_key, delta)
+        except ValueError:
+            # Счетчика еще нет: add не перезапишет значение, созданное параллельно
+            cache.add(metric_key, 0, None)
+            cache.incr(metric_key, delta)
+
+    @classmethod
+    def enqueue(cls, kind, key):
+        """Планирует эффект kind для key. Возвращает True, если поставлена новая задача"""
+        if not key or kind not in EFFECT_HANDLERS:
+            return False
+        window = cls.window(kind)
+        # Ключ живет дольше окна на случай очереди в Celery
+        if not cache.add(cls.pending_key(kind, key), time.time(), window * 10):
+            cls._incr(kind, 'coalesced')
+            return False
+        cls._incr(kind, 'scheduled')
+        try:
+            # Отложенный импорт для избежания циклической зависимости
+            from core.tasks import process_interaction_effect
+            process_interaction_effect.apply_async((kind, key), countdown=window)
+            return True
+        except Exception as e:
+            # Очередь недоступна - выполняем сразу, чтобы не потерять пересчет
+            logger.error(f"[INTERACTION_EFFECT_SCHEDULE_ERROR] Could not queue {kind} for {key}: {e}")
+            if kind in NO_INLINE_FALLBACK:
+                cache.delete(cls.pending_key(kind, key))
+                return False
+            try:
+                cls.process(kind, key)
+            except Exception:
+                pass  # уже залогировано в process
+            return False
+
+    @classmethod
+    def process(cls, kind, key):
+        """Выполняет эффект (вызывается из задачи Celery)"""
+        enqueued_at = cache.get(cls.pending_key(kind, key))
+        cache.delete(cls.pending_key(kind, key))
+        try:
+            result = EFFECT_HANDLERS[kind](key)
+        except Exception as e:
+            cls._incr(kind, 'failed')
+            logger.error(f"[INTERACTION_EFFECT_ERROR] {kind} for {key} failed: {e}", exc_info=True)
+            raise
+        cls._incr(kind, 'executed')
+        if enqueued_at:
+            lag = round(time.time() - enqueued_at, 3)
+            cache.set(cls._metric_key(kind, 'last_lag'), lag, None)
+        return result
+
+    @classmethod
+    def video_engaged(cls, video_id, user_id=None):
+        """Реакция на видео: пересчет рейтинга видео и кармы пользователя (автора или комментатора)"""
+        cls.enqueue('rating', video_id)
+        if user_id:
+            cls.enqueue('karma', user_id)
+
+    @classmethod
+    def metrics(cls):
+        keys = [cls._metric_key(kind, name) for kind in EFFECT_HANDLERS for name in METRIC_NAMES + ('last_lag',)]
+        values = cache.get_many(keys)
+        result = {}
+        for kind in EFFECT_HANDLERS:
+            stats = {name: values.get(cls._metric_key(kind, name), 0) for name in METRIC_NAMES}
+            stats['backlog'] = max(0, stats['scheduled'] - stats['executed'] - stats['failed'])
+            stats['last_lag'] = values.get(cls._metric_key(kind, 'last_lag'))
+            stats['window'] = cls.window(kind)
+            result[kind] = stats
+        return result
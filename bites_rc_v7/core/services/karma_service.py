@@ -0,0 +1,28 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class KarmaService:
+    """
+    Отложенный пересчет кармы. Лайки, комментарии и подписки не считают карму
+    в запросе, а вызывают schedule(user_id): пересчет идет через очередь
+    InteractionEffects и объединяется в окне INTERACTION_EFFECT_WINDOWS['karma'],
+    так что серия лайков на видео одного автора дает один пересчет.
+    """
+
+    @classmethod
+    def schedule(cls, user_id):
+        """Планирует пересчет кармы пользователя. Возвращает True, если задача поставлена"""
+        from core.services.interaction_effects import InteractionEffects
+        return InteractionEffects.enqueue('karma', user_id)
+
+    @classmethod
+    def recompute(cls, user_id):
+        """Пересчитывает карму сразу (выполняется в задаче Celery)"""
+        from core.models import UserProfile
+
+        profile = UserProfile.objects.filter(user_id=user_id).first()
+        if profile is None:
+            return None
+        return profile.calculate_karma()
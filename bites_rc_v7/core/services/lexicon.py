@@ -0,0 +1,87 @@
+import re
+
+# Словарь быстрой оценки тональности комментариев.
+# WORDS - английские слова (допускаются окончания -s/-es/-d/-ed/-ing),
+# STEMS - русские основы, совпадают с началом слова при любом окончании
+# (хорош -> хороший, хорошо), ROOTS - корни, которые совпадают в любом месте
+# слова, в том числе после приставки (ебал -> заебал, хуев -> охуевший).
+NEGATIVE_WORDS = ['fuck', 'shit', 'hate', 'awful', 'terrible', 'bad', 'worst', 'sucks', 'garbage', 'trash']
+NEGATIVE_STEMS = ['ненавижу', 'отстой', 'хрень', 'дерьм', 'говн']
+NEGATIVE_ROOTS = ['хуй', 'пизд', 'блядь', 'ебал', 'хуев', 'пидор']
+POSITIVE_WORDS = ['good', 'great', 'awesome', 'excellent', 'love', 'best', 'amazing', 'wonderful']
+POSITIVE_STEMS = ['отлично', 'прекрасно', 'круто', 'супер', 'класс', 'обожаю', 'нравится', 'лучш', 'хорош']
+POSITIVE_ROOTS = []
+
+ENGLISH_SUFFIX = r'(?:s|es|d|ed|ing)?'
+
+
+def _trie_pattern(words):
+    """
+    Регулярное выражение-дерево для набора строк: общие префиксы выносятся
+    в одну ветку (fuck|fun -> fu(?:ck|n)), поэтому движок проверяет каждую
+    позицию текста за длину самого длинного слова, а не по всему списку.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        end = '' in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # Слово может закончиться здесь - продолжение необязательно
+        return '(?:' + body + ')?' if end else body
+
+    return build(trie)
+
+
+class LexiconMatcher:
+    """
+    Многошаблонный поиск по словарю за один проход по тексту.
+
+    Все слова обоих языков и обеих полярностей собраны в одно
+    скомпилированное выражение с именованными группами; counts(text)
+    возвращает (позитивных, негативных) совпадений. Выражение строится один
+    раз при импорте модуля. Текст приводится к нижнему регистру заранее:
+    re.IGNORECASE замедляет такое выражение примерно вдвое.
+    """
+
+    POSITIVE_GROUPS = frozenset(('pos', 'pos_root'))
+
+    def __init__(self, positive, negative):
+        roots = []
+        anchored = []
+        for name, (words, stems, root_list) in (('neg', negative), ('pos', positive)):
+            alternatives = []
+            if words:
+                alternatives.append(_trie_pattern(words) + ENGLISH_SUFFIX + r'\b')
+            if stems:
+                alternatives.append(_trie_pattern(stems) + r'\w*')
+            if alternatives:
+                anchored.append(f"(?P<{name}>{'|'.join(alternatives)})")
+            if root_list:
+                # Корни ищутся с любой позиции; остаток слова поглощается, чтобы
+                # слово с корнем считалось одним совпадением
+                roots.append(f"(?P<{name}_root>{_trie_pattern(root_list)}\\w*)")
+        parts = roots + ([r'\b(?=\w)(?:' + '|'.join(anchored) + ')'] if anchored else [])
+        self.pattern = re.compile('|'.join(parts) or r'(?!)')
+
+    def counts(self, text):
+        positive = negative = 0
+        for match in self.pattern.finditer(text.lower()):
+            if match.lastgroup in self.POSITIVE_GROUPS:
+                positive += 1
+            else:
+                negative += 1
+        return positive, negative
+
+
+comment_lexicon = LexiconMatcher(
+    positive=(POSITIVE_WORDS, POSITIVE_STEMS, POSITIVE_ROOTS),
+    negative=(NEGATIVE_WORDS, NEGATIVE_STEMS, NEGATIVE_ROOTS),
+)
@@ -0,0 +1,232 @@
+import logging
+import math
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Power
+
+from core.models import Video
+from core.services.engagement_counters import SENTIMENT_HALF_LIFE_DAYS, days_since_epoch
+
+logger = logging.getLogger(__name__)
+
+HELL_MULTIPLIER = 666
+MIN_RATING = 1.0
+MAX_RATING = 10000.0
+# Доля нового значения при сглаживании (70% старого, 30% нового)
+SMOOTHING = 0.3
+
+# Состояние массового пересчета (для опроса из интерфейса) и блокировка от двойного запуска
+RESCORE_PROGRESS_KEY = 'rating_bulk_rescore_progress'
+RESCORE_LOCK_KEY = 'rating_bulk_rescore_lock'
+RESCORE_LOCK_TIMEOUT = 3600
+
+# Колонки, которых достаточно для расчета рейтинга
+RATING_FIELDS = (
+    'is_youtube', 'views', 'duration', 'youtube_views', 'youtube_likes', 'youtube_dislikes',
+    'likes_total', 'dislikes_total', 'comments_total', 'weighted_sentiment', 'sentiment_weight',
+    'absolute_rating',
+)
+
+
+def compute_rating(likes, dislikes, views, duration, comments_count, sentiment_avg, previous=0.0):
+    """
+    Формула абсолютного рейтинга:
+    - лайки, количество и тональность комментариев, длительность (log1p);
+    - буст от просмотров (log10);
+    - штраф по доле лайков среди лайков и дизлайков;
+    - ограничение [MIN_RATING, MAX_RATING] и сглаживание с предыдущим значением.
+    """
+    views = max(views, 1)  # Avoid division by zero
+    engagement_score = (
+        math.log1p(likes) * 1.5 +  # More weight to likes
+        math.log1p(comments_count) * 1.2 * sentiment_avg +  # Weighted by sentiment
+        math.log1p(duration / 60) * 0.8  # Duration in minutes
+    )
+    view_boost = math.log10(1 + views) * 0.8
+
+    penalty = 1.0
+    if dislikes > 0:
+        penalty = likes / (likes + dislikes)
+
+    rating = HELL_MULTIPLIER * engagement_score * view_boost * penalty
+    rating = max(MIN_RATING, min(MAX_RATING, rating))
+
+    if previous > 0:
+        rating = previous * (1 - SMOOTHING) + rating * SMOOTHING
+    return round(rating, 3)
+
+
+def compute_ratings_array(likes, dislikes, views, duration, comments_count, sentiment_avg, previous):
+    """Та же формула, что compute_rating, над массивами NumPy (по строке на видео)"""
+    import numpy as np
+
+    views = np.maximum(views, 1)
+    engagement_score = (
+        np.log1p(likes) * 1.5 +
+        np.log1p(comments_count) * 1.2 * sentiment_avg +
+        np.log1p(duration / 60) * 0.8
+    )
+    view_boost = np.log10(1 + views) * 0.8
+
+    total = likes + dislikes
+    penalty = np.divide(likes, total, out=np.ones_like(likes), where=dislikes > 0)
+
+    rating = np.clip(HELL_MULTIPLIER * engagement_score * view_boost * penalty, MIN_RATING, MAX_RATING)
+    rating = np.where(previous > 0, previous * (1 - SMOOTHING) + rating * SMOOTHING, rating)
+    return np.round(rating, 3)
+
+
+class RatingEngine:
+    """
+    Инкрементальный пересчет Video.absolute_rating.
+
+    Все входы формулы (счетчики реакций и суммы тональности) поддерживаются
+    в строке видео через F()-дельты (EngagementCounters), поэтому событие
+    (лайк, дизлайк, комментарий) пересчитывает рейтинг за O(1): одно чтение
+    нужных колонок и один UPDATE, без загрузки комментариев и без save().
+    Затухание тональности обрабатывается периодическим сдвигом sentiment_anchor
+    (rescale_sentiment_weights), а массовый пересчет - bulk_rescore.
+    """
+
+    @staticmethod
+    def score(video):
+        """Рейтинг по колонкам видео (без сохранения)"""
+        if video.is_youtube:
+            likes = video.youtube_likes + video.likes_total  # Combine YouTube and local likes
+            views = video.youtube_views
+            dislikes = video.youtube_dislikes
+        else:
+            likes = video.likes_total
+            views = video.views
+            dislikes = video.dislikes_total
+        return compute_rating(
+            likes, dislikes, views, video.duration,
+            video.comments_total, video.sentiment_avg, video.absolute_rating,
+        )
+
+    @classmethod
+    def rescore(cls, video):
+        """
+        Подтягивает в объект актуальные счетчики (их меняют сигналы через F())
+        и записывает новый рейтинг одним UPDATE. Возвращает рейтинг.
+        """
+        video.refresh_from_db(fields=RATING_FIELDS)
+        video.absolute_rating = cls.score(video)
+        Video.objects.filter(pk=video.pk).update(absolute_rating=video.absolute_rating)
+        return video.absolute_rating
+
+    @classmethod
+    def rescore_by_id(cls, video_id):
+        """Пересчет по id (фоновые задачи). Возвращает рейтинг или None, если видео удалено"""
+        video = Video.objects.only('id', *RATING_FIELDS).filter(pk=video_id).first()
+        if video is None:
+            return None
+        video.absolute_rating = cls.score(video)
+        Video.objects.filter(pk=video_id).update(absolute_rating=video.absolute_rating)
+        return video.absolute_rating
+
+    @classmethod
+    def rescale_sentiment_weights(cls, batch_size=5000):
+        """
+        Сдвигает sentiment_anchor всех видео к текущей дате, домножая суммы весов
+        на 2 ** ((старый anchor - новый) / 30). Средневзвешенная тональность не
+        меняется, а суммы остаются в пределах [0, comments_total]. Каждая строка
+        пересчитывается одним UPDATE относительно своего anchor, так что
+        одновременные дельты от новых комментариев не теряются.
+        """
+        anchor = days_since_epoch()
+        factor = Power(
+            Value(2.0),
+            (F('sentiment_anchor') - Value(anchor)) / Value(float(SENTIMENT_HALF_LIFE_DAYS)),
+            output_field=FloatField(),
+        )
+        ids = list(Video.objects.filter(sentiment_anchor__lt=anchor).order_by('pk').values_list('pk', flat=True))
+        updated = 0
+        for start in range(0, len(ids), batch_size):
+            # sentiment_anchor обновляется последним: MySQL вычисляет SET слева направо
+            updated += Video.objects.filter(pk__in=ids[start:start + batch_size]).update(
+                weighted_sentiment=F('weighted_sentiment') * factor,
+                sentiment_weight=F('sentiment_weight') * factor,
+                sentiment_anchor=Value(anchor),
+            )
+        logger.info(f"[SENTIMENT_RESCALE] Rescaled sentiment weights of {updated} videos to anchor {anchor:.2f}")
+        return updated
+
+    @staticmethod
+    def _score_rows(rows):
+        """Векторный расчет рейтингов для строк values_list('pk', *RATING_FIELDS)"""
+        import numpy as np
+
+        data = np.asarray(rows, dtype=np.float64)
+        (_, is_youtube, views, duration, youtube_views, youtube_likes, youtube_dislikes,
+         likes_total, dislikes_total, comments, weighted, weight, previous) = data.T
+        youtube = is_youtube > 0
+
+        likes = np.where(youtube, youtube_likes + likes_total, likes_total)
+        dislikes = np.where(youtube, youtube_dislikes, dislikes_total)
+        views = np.where(youtube, youtube_views, views)
+        sentiment = np.divide(weighted, weight, out=np.full_like(weighted, 0.5), where=(comments > 0) & (weight > 0))
+        return compute_ratings_array(likes, dislikes, views, duration, comments, sentiment, previous)
+
+    @classmethod
+    def bulk_rescore(cls, queryset=None, batch_size=5000, progress=None):
+        """
+        Массовый пересчет рейтингов: входы формулы уже лежат в строке видео, поэтому
+        на пачку из batch_size видео приходится один SELECT только нужных колонок
+        (keyset-пагинация по pk), векторный расчет в NumPy и bulk_update. Каждая
+        пачка пишется в своей короткой транзакции. progress(done, total) вызывается
+        после каждой пачки. Возвращает количество пересчитанных видео.
+        """
+        queryset = queryset if queryset is not None else Video.objects.all()
+        total = queryset.count()
+        columns = ('pk',) + RATING_FIELDS
+        done = 0
+        last_pk = None
+
+        while True:
+            page = queryset.order_by('pk')
+            if last_pk is not None:
+                page = page.filter(pk__gt=last_pk)
+            rows = list(page.values_list(*columns)[:batch_size])
+            if not rows:
+                break
+
+            ratings = cls._score_rows(rows)
+            videos = [Video(pk=row[0], absolute_rating=float(rating)) for row, rating in zip(rows, ratings)]
+            with transaction.atomic():
+                Video.objects.bulk_update(videos, ['absolute_rating'], batch_size=1000)
+
+            done += len(rows)
+            last_pk = rows[-1][0]
+            if progress:
+                progress(done, total)
+
+        logger.info(f"[RATING_BULK_RESCORE] Rescored {done} videos")
+        return done
+
+    @classmethod
+    def schedule_bulk_rescore(cls):
+        """
+        Ставит массовый пересчет в очередь Celery. Возвращает id задачи или None,
+        если пересчет уже идет или очередь недоступна.
+        """
+        if not cache.add(RESCORE_LOCK_KEY, 'queued', RESCORE_LOCK_TIMEOUT):
+            return None
+        try:
+            # Отложенный импорт для избежания циклической зависимости
+            from core.tasks import rescore_all_videos
+            result = rescore_all_videos.delay()
+        except Exception as e:
+            cache.delete(RESCORE_LOCK_KEY)
+            logger.error(f"[RATING_BULK_RESCORE_ERROR] Could not queue bulk rescore: {e}")
+            return None
+        cache.set(RESCORE_PROGRESS_KEY, {'status': 'queued', 'done': 0, 'total': 0, 'task_id': result.id},
+                  RESCORE_LOCK_TIMEOUT)
+        logger.info(f"[RATING_BULK_RESCORE] Queued bulk rescore task {result.id}")
+        return result.id
+
+    @staticmethod
+    def rescore_progress():
+        return cache.get(RESCORE_PROGRESS_KEY) or {'status': 'idle', 'done': 0, 'total': 0}
@@ -0,0 +1,166 @@
+import heapq
+import logging
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core.models import Video
+from core.services.transition_graph import TransitionGraph
+from core.services.video_embeddings import video_embedding_index
+
+logger = logging.getLogger(__name__)
+
+RECOMMENDED_LIMIT = 8
+SIMILAR_LIMIT = 666
+
+# Ключи хранятся без TTL: они восстанавливаются из БД при промахе
+POSTINGS_KEY = 'rec_index_postings_{}'
+VIDEO_TAGS_KEY = 'rec_index_video_tags_{}'
+RESULTS_KEY = 'rec_index_results_{}'
+
+VideoTags = Video.tags.through
+
+
+class RecommendationIndex:
+    """
+    Индекс рекомендаций по пересечению тегов.
+
+    В кэше (Redis) лежат:
+    - инвертированный индекс тег -> отсортированный список id видео (posting list);
+    - разреженный вектор тегов видео (список id тегов);
+    - готовые рекомендации видео: {'recommended': [...], 'similar': [...]}.
+
+    Для видео пересечение со всеми кандидатами считается сложением его
+    posting lists (Counter), без запросов на кандидата. Рекомендации
+    упорядочены по (доля переходов из этого видео, общие теги, семантическая
+    близость, absolute_rating). Похожие видео - сначала ближайшие по смыслу
+    названия и описания (VideoEmbeddingIndex, до EMBEDDING_SIMILAR_LIMIT), затем
+    по (общие теги, absolute_rating). Результат кэшируется
+    на RECOMMENDATION_CACHE_TTL, так что страница видео получает оба списка
+    одним обращением к кэшу.
+
+    Posting lists и векторы читаются из БД при промахе. Изменение тегов видео
+    (m2m_changed) сбрасывает posting lists затронутых тегов и готовые
+    рекомендации всех видео с этими тегами.
+    """
+
+    @staticmethod
+    def _ttl():
+        return getattr(settings, 'RECOMMENDATION_CACHE_TTL', 600)
+
+    # --- индекс -------------------------------------------------------------
+
+    @classmethod
+    def video_tags(cls, video_id):
+        key = VIDEO_TAGS_KEY.format(video_id)
+        tag_ids = cache.get(key)
+        if tag_ids is None:
+            tag_ids = sorted(VideoTags.objects.filter(video_id=video_id).values_list('tag_id', flat=True))
+            cache.set(key, tag_ids, None)
+        return tag_ids
+
+    @classmethod
+    def postings(cls, tag_ids):
+        """{tag_id: [video_id, ...]}; отсутствующие в кэше списки читаются одним запросом"""
+        keys = {tag_id: POSTINGS_KEY.format(tag_id) for tag_id in tag_ids}
+        cached = cache.get_many(list(keys.values()))
+        result = {tag_id: cached[key] for tag_id, key in keys.items() if key in cached}
+
+        missing = [tag_id for tag_id in tag_ids if tag_id not in result]
+        if missing:
+            loaded = defaultdict(list)
+            rows = VideoTags.objects.filter(tag_id__in=missing).order_by('video_id').values_list('tag_id', 'video_id')
+            for tag_id, video_id in rows:
+                loaded[tag_id].append(video_id)
+            fresh = {tag_id: loaded.get(tag_id, []) for tag_id in missing}
+            cache.set_many({keys[tag_id]: video_ids for tag_id, video_ids in fresh.items()}, None)
+            result.update(fresh)
+        return result
+
+    @classmethod
+    def rebuild(cls):
+        """Полностью перестраивает posting lists и векторы тегов. Возвращает число тегов"""
+        postings = defaultdict(list)
+        vectors = defaultdict(list)
+        for video_id, tag_id in VideoTags.objects.order_by('video_id', 'tag_id').values_list('video_id', 'tag_id'):
+            postings[tag_id].append(video_id)
+            vectors[video_id].append(tag_id)
+        cache.set_many({POSTINGS_KEY.format(tag_id): video_ids for tag_id, video_ids in postings.items()}, None)
+        cache.set_many({VIDEO_TAGS_KEY.format(video_id): tag_ids for video_id, tag_ids in vectors.items()}, None)
+        cache.delete_many([RESULTS_KEY.format(video_id) for video_id in vectors])
+        logger.info(f"[RECOMMENDATION_INDEX] Rebuilt {len(postings)} posting lists for {len(vectors)} videos")
+        return len(postings)
+
+    # --- рекомендации -------------------------------------------------------
+
+    @staticmethod
+    def _semantic(video_id):
+        """{video_id: косинус} ближайших по смыслу видео; пусто, если вектора еще нет"""
+        try:
+            neighbors = video_embedding_index.similar(video_id, getattr(settings, 'EMBEDDING_SIMILAR_LIMIT', 48))
+        except Exception as e:
+            logger.error(f"[RECOMMENDATION_INDEX_ERROR] Semantic lookup failed for video {video_id}: {e}")
+            return {}
+        return dict(neighbors or ())
+
+    @classmethod
+    def _compute(cls, video_id, tag_ids):
+        overlap = Counter()
+        for video_ids in cls.postings(tag_ids).values():
+            overlap.update(video_ids)
+        overlap.pop(video_id, None)
+        semantic = cls._semantic(video_id)
+        if not overlap and not semantic:
+            return {'recommended': [], 'similar': []}
+
+        # Доли переходов из этого видео (затухающие, см. TransitionGraph)
+        transitions = {
+            to_id: probability for to_id, probability in TransitionGraph.next_videos(video_id)
+            if to_id in overlap or to_id in semantic
+        }
+        # Рейтинг нужен только кандидатам, которые могут попасть в выдачу
+        pool = set(heapq.nlargest(SIMILAR_LIMIT, overlap, key=overlap.get)) | set(transitions) | set(semantic)
+        ratings = dict(Video.objects.filter(pk__in=pool).values_list('pk', 'absolute_rating'))
+
+        similar = sorted((pk for pk in semantic if pk in ratings), key=semantic.get, reverse=True)
+        seen = set(similar)
+        similar += sorted((pk for pk in ratings if pk not in seen and pk in overlap),
+                          key=lambda pk: (overlap[pk], ratings[pk]), reverse=True)
+        recommended = heapq.nlargest(
+            RECOMMENDED_LIMIT, ratings,
+            key=lambda pk: (transitions.get(pk, 0), overlap[pk], semantic.get(pk, 0), ratings[pk]),
+        )
+        return {'recommended': recommended, 'similar': similar[:SIMILAR_LIMIT]}
+
+    @classmethod
+    def for_video(cls, video_id):
+        """
+        {'recommended': [id, ...], 'similar': [id, ...]} для видео, из кэша или
+        с пересчетом по индексу. Пустые списки, если у видео нет ни тегов, ни вектора.
+        """
+        key = RESULTS_KEY.format(video_id)
+        result = cache.get(key)
+        if result is None:
+            result = cls._compute(video_id, cls.video_tags(video_id))
+            cache.set(key, result, cls._ttl())
+        return result
+
+    # --- инвалидация --------------------------------------------------------
+
+    @classmethod
+    def tags_changed(cls, video_ids, tag_ids):
+        """
+        Связи видео video_ids с тегами tag_ids изменились. Сбрасывает posting
+        lists этих тегов, векторы видео и рекомендации всех видео с этими тегами.
+        """
+        video_ids = set(video_ids)
+        tag_ids = set(tag_ids)
+        affected = set(video_ids)
+        if tag_ids:
+            affected.update(VideoTags.objects.filter(tag_id__in=tag_ids).values_list('video_id', flat=True))
+
+        keys = [POSTINGS_KEY.format(tag_id) for tag_id in tag_ids]
+        keys += [VIDEO_TAGS_KEY.format(video_id) for video_id in video_ids]
+        keys += [RESULTS_KEY.format(video_id) for video_id in affected]
+        cache.delete_many(keys)
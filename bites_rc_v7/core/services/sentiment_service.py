@@ -0,0 +1,305 @@
+import hashlib
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+
+from core.services.lexicon import comment_lexicon
+
+logger = logging.getLogger(__name__)
+
+NEUTRAL = 0.5
+
+CYRILLIC_RE = re.compile('[а-яА-ЯёЁ]')
+
+
+def has_cyrillic(text):
+    return bool(CYRILLIC_RE.search(text))
+
+
+def keyword_sentiment(text):
+    """1.0 / 0.0 при явном позитивном / негативном слове, иначе None (негатив важнее)"""
+    positive, negative = comment_lexicon.counts(text)
+    if negative:
+        return 0.0
+    if positive:
+        return 1.0
+    return None
+
+
+def provisional_comment_sentiment(text):
+    """
+    Мгновенная оценка комментария: (тональность 0..1, нужно ли уточнение моделью).
+    Явные слова из словаря и уже оцененные тексты (кэш) дают окончательную оценку;
+    русский текст без них получает нейтральную и уточняется фоновым воркером
+    (core.services.comment_sentiment), остальной текст остается нейтральным.
+    """
+    score = keyword_sentiment(text)
+    if score is not None:
+        return score, False
+    if not has_cyrillic(text):
+        return NEUTRAL, False
+    cached = sentiment_service.cached_score(text)
+    if cached is not None:
+        return cached, False
+    return NEUTRAL, True
+
+
+class _Request:
+    __slots__ = ('texts', 'done', 'result')
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.done = threading.Event()
+        self.result = None
+
+
+class SentimentService:
+    """
+    Модель тональности, загружаемая один раз на процесс-воркер.
+
+    - score(texts) возвращает оценки 0..1 (P(positive) + 0.5 * P(neutral));
+    - результаты кэшируются в общем кэше по sha1 текста;
+    - промахи кэша из параллельных запросов собираются фоновым потоком в
+      микропакеты (до max_batch текстов или max_wait секунд ожидания) и
+      прогоняются одним forward-проходом под torch.inference_mode();
+    - при ошибке загрузки или инференса возвращается нейтральное 0.5.
+
+    Бэкенды инференса на CPU (SENTIMENT_BACKEND):
+    - 'torch' - исходная модель fp32;
+    - 'int8' - torch.quantization.quantize_dynamic для Linear-слоев;
+    - 'onnx' - ONNX Runtime; модель экспортируется и квантуется в int8 один раз
+      и сохраняется в SENTIMENT_ONNX_DIR (нужен пакет onnxruntime).
+    """
+
+    BACKENDS = ('torch', 'int8', 'onnx')
+
+    def __init__(self, model_name, max_batch=32, max_wait=0.005, cache_ttl=7 * 86400, timeout=10,
+                 backend='int8', onnx_dir=None):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown sentiment backend {backend!r}")
+        self.model_name = model_name
+        self.backend = backend
+        self.onnx_dir = onnx_dir
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.cache_ttl = cache_ttl
+        self.timeout = timeout
+
+        self._model = None
+        self._tokenizer = None
+        self._label_weights = None
+        self._session = None
+        self._load_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            model_name=getattr(settings, 'SENTIMENT_MODEL_NAME', 'seara/rubert-tiny2-russian-sentiment'),
+            max_batch=getattr(settings, 'SENTIMENT_MAX_BATCH', 32),
+            max_wait=getattr(settings, 'SENTIMENT_MAX_WAIT_MS', 5) / 1000,
+            cache_ttl=getattr(settings, 'SENTIMENT_CACHE_TTL', 7 * 86400),
+            backend=getattr(settings, 'SENTIMENT_BACKEND', 'int8'),
+            onnx_dir=getattr(settings, 'SENTIMENT_ONNX_DIR', None),
+        )
+
+    # --- модель -------------------------------------------------------------
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def load(self):
+        """Загружает модель (один раз на процесс)"""
+        if self._model is not None:
+            return
+        with self._load_lock:
+            if self._model is not None:
+                return
+            # transformers/torch тяжелые - импортируем только при первой загрузке
+            import torch
+            from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+            started = time.monotonic()
+            tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
+            model.eval()
+            self._label_weights = self._weights_for_labels(model.config.id2label)
+            if self.backend == 'int8':
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            elif self.backend == 'onnx':
+                self._session = self._onnx_session(model, tokenizer)
+            self._tokenizer = tokenizer
+            self._model = model
+            logger.info(f"[SENTIMENT_MODEL] Loaded {self.model_name} ({self.backend}) "
+                        f"in {time.monotonic() - started:.1f}s")
+
+    def _onnx_session(self, model, tokenizer):
+        """Сессия ONNX Runtime; экспорт и int8-квантование выполняются один раз"""
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImproperlyConfigured(
+                "SENTIMENT_BACKEND='onnx' requires the onnxruntime package (pip install onnxruntime)"
+            )
+        import torch
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        onnx_dir = self.onnx_dir or os.path.join(settings.BASE_DIR, 'models', 'sentiment')
+        os.makedirs(onnx_dir, exist_ok=True)
+        stem = self.model_name.replace('/', '__')
+        quantized_path = os.path.join(onnx_dir, f"{stem}.int8.onnx")
+        if not os.path.exists(quantized_path):
+            export_path = os.path.join(onnx_dir, f"{stem}.onnx")
+            sample = dict(tokenizer(['пример текста'], return_tensors='pt'))
+            names = list(sample)
+            dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in names}
+            dynamic_axes['logits'] = {0: 'batch'}
+            torch.onnx.export(model, (sample,), export_path, input_names=names, output_names=['logits'],
+                              dynamic_axes=dynamic_axes, opset_version=14)
+            tmp_path = quantized_path + '.tmp'
+            quantize_dynamic(export_path, tmp_path, weight_type=QuantType.QInt8)
+            os.replace(tmp_path, quantized_path)
+            logger.info(f"[SENTIMENT_MODEL] Exported int8 ONNX model to {quantized_path}")
+        return onnxruntime.InferenceSession(quantized_path, providers=['CPUExecutionProvider'])
+
+    def _predict_probs(self, batch):
+        """Вероятности классов для пакета текстов (numpy, [len(batch), классы])"""
+        import numpy as np
+
+        if self._session is not None:
+            inputs = self._tokenizer(batch, return_tensors='np', truncation=True, padding=True, max_length=512)
+            feeds = {i.name: inputs[i.name].astype(np.int64) for i in self._session.get_inputs()}
+            logits = self._session.run(['logits'], feeds)[0]
+            exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+            return exp / exp.sum(axis=-1, keepdims=True)
+
+        import torch
+        with torch.inference_mode():
+            inputs = self._tokenizer(batch, return_tensors='pt', truncation=True, padding=True, max_length=512)
+            return self._model(**inputs).logits.softmax(dim=-1).numpy()
+
+    @staticmethod
+    def _weights_for_labels(id2label):
+        """Вклад каждого класса в итоговую оценку 0..1"""
+        values = {'negative': 0.0, 'neutral': NEUTRAL, 'positive': 1.0}
+        labels = [str(id2label[i]).lower() for i in range(len(id2label))]
+        if all(label in values for label in labels):
+            return [values[label] for label in labels]
+        # Безымянные метки: первый класс - негатив, последний - позитив
+        count = len(labels)
+        return [i / (count - 1) if count > 1 else NEUTRAL for i in range(count)]
+
+    def _forward(self, texts, batch_size=None):
+        import numpy as np
+
+        self.load()
+        batch_size = batch_size or self.max_batch
+        weights = np.asarray(self._label_weights)
+        scores = []
+        for start in range(0, len(texts), batch_size):
+            probs = self._predict_probs(texts[start:start + batch_size])
+            scores.extend(round(float(s), 4) for s in probs @ weights)
+        return scores
+
+    # --- микропакеты --------------------------------------------------------
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='sentiment-batcher', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            requests = [self._queue.get()]
+            size = len(requests[0].texts)
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                requests.append(request)
+                size += len(request.texts)
+
+            texts = [text for request in requests for text in request.texts]
+            try:
+                scores = self._forward(texts)
+            except Exception as e:
+                logger.error(f"[SENTIMENT_MODEL_ERROR] Inference failed for {len(texts)} texts: {e}")
+                scores = None
+            offset = 0
+            for request in requests:
+                if scores is not None:
+                    request.result = scores[offset:offset + len(request.texts)]
+                offset += len(request.texts)
+                request.done.set()
+
+    def _infer(self, texts):
+        """Оценки от модели или None, если инференс не удался или не уложился в timeout"""
+        self._ensure_worker()
+        request = _Request(texts)
+        self._queue.put(request)
+        if not request.done.wait(self.timeout):
+            logger.warning(f"[SENTIMENT_MODEL_TIMEOUT] No result for {len(texts)} texts in {self.timeout}s")
+            return None
+        return request.result
+
+    def _infer_direct(self, texts):
+        try:
+            return self._forward(texts)
+        except Exception as e:
+            logger.error(f"[SENTIMENT_MODEL_ERROR] Inference failed for {len(texts)} texts: {e}")
+            return None
+
+    # --- публичный API ------------------------------------------------------
+
+    @staticmethod
+    def cache_key(text):
+        return f"sentiment_{hashlib.sha1(text.encode('utf-8')).hexdigest()}"
+
+    def cached_score(self, text):
+        return cache.get(self.cache_key(text[:2000]))
+
+    def score(self, texts, batched=True, fallback=True):
+        """
+        Оценки тональности 0..1 для списка текстов (в том же порядке).
+        batched=True - через микропакеты (запросы веб-воркера), False - прямой
+        прогон пакетами (фоновые задачи, которые сами собирают пакет).
+        Если модель недоступна, непосчитанные тексты получают NEUTRAL, а при
+        fallback=False возвращается None - вызывающий решает, что делать.
+        """
+        texts = [text[:2000] for text in texts]
+        keys = {text: self.cache_key(text) for text in texts}
+        cached = cache.get_many(list(set(keys.values())))
+        missing = [text for text in dict.fromkeys(texts) if keys[text] not in cached]
+
+        if missing:
+            scores = self._infer(missing) if batched else self._infer_direct(missing)
+            if scores is None:
+                if not fallback:
+                    return None
+                # Нейтральное значение не кэшируем - при следующем вызове модель попробует снова
+                scores = [NEUTRAL] * len(missing)
+            else:
+                cache.set_many({keys[text]: value for text, value in zip(missing, scores)}, self.cache_ttl)
+            cached.update({keys[text]: value for text, value in zip(missing, scores)})
+        return [cached[keys[text]] for text in texts]
+
+
+sentiment_service = SentimentService.from_settings()
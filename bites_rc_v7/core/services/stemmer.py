@@ -0,0 +1,99 @@
+"""
+Стеммер русского языка (алгоритм Snowball/Портера для русского).
+Используется поиском (core.services.video_search): в индекс и в запрос
+попадают основы слов, так что "котики", "котиков" и "котик" совпадают.
+"""
+import re
+
+VOWELS = 'аеиоуыэюя'
+
+# Окончания, которые отсекаются только после "а" или "я"
+PERFECTIVE_GERUND_1 = ('вшись', 'вши', 'в')
+PERFECTIVE_GERUND_2 = ('ившись', 'ывшись', 'ивши', 'ывши', 'ив', 'ыв')
+ADJECTIVE = (
+    'ими', 'ыми', 'его', 'ого', 'ему', 'ому', 'ее', 'ие', 'ые', 'ое', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым',
+    'ом', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею',
+)
+PARTICIPLE_1 = ('ем', 'нн', 'вш', 'ющ', 'щ')
+PARTICIPLE_2 = ('ивш', 'ывш', 'ующ')
+REFLEXIVE = ('ся', 'сь')
+VERB_1 = ('ете', 'йте', 'ешь', 'нно', 'ла', 'на', 'ли', 'ем', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'й', 'л', 'н')
+VERB_2 = (
+    'ейте', 'уйте', 'ила', 'ыла', 'ена', 'ите', 'или', 'ыли', 'ило', 'ыло', 'ено', 'ует', 'уют', 'ены', 'ить', 'ыть',
+    'ишь', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ят', 'ит', 'ыт', 'ую', 'ю',
+)
+NOUN = (
+    'иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ев', 'ов', 'ие', 'ье', 'еи', 'ии', 'ей', 'ой', 'ий', 'ям',
+    'ем', 'ам', 'ом', 'ах', 'ях', 'ию', 'ью', 'ия', 'ья', 'а', 'е', 'и', 'й', 'о', 'у', 'ы', 'ь', 'ю', 'я',
+)
+SUPERLATIVE = ('ейше', 'ейш')
+DERIVATIONAL = ('ость', 'ост')
+
+CYRILLIC_RE = re.compile(r'[а-яё]')
+
+
+def _regions(word):
+    """Начала областей RV и R2 (индексы в слове)"""
+    rv = next((i + 1 for i, char in enumerate(word) if char in VOWELS), len(word))
+    r1 = next((i + 1 for i in range(1, len(word)) if word[i] not in VOWELS and word[i - 1] in VOWELS), len(word))
+    r2 = next((i + 1 for i in range(r1 + 1, len(word)) if word[i] not in VOWELS and word[i - 1] in VOWELS),
+              len(word))
+    return rv, r2
+
+
+def _strip(word, start, endings, after_a=()):
+    """
+    Отсекает самое длинное окончание из endings (или из after_a, если перед ним
+    "а"/"я"), лежащее целиком после start. Возвращает слово или None.
+    """
+    candidates = [(ending, False) for ending in endings] + [(ending, True) for ending in after_a]
+    for ending, needs_a in sorted(candidates, key=lambda item: len(item[0]), reverse=True):
+        if not word.endswith(ending) or len(word) - len(ending) < start:
+            continue
+        if needs_a:
+            cut = len(word) - len(ending)
+            if cut - 1 < start or word[cut - 1] not in 'ая':
+                continue
+        return word[:len(word) - len(ending)]
+    return None
+
+
+def _strip_adjectival(word, start):
+    stripped = _strip(word, start, ADJECTIVE)
+    if stripped is None:
+        return None
+    return _strip(stripped, start, PARTICIPLE_2, PARTICIPLE_1) or stripped
+
+
+def stem_russian(word):
+    """Основа русского слова; слова без кириллицы возвращаются как есть"""
+    word = word.lower().replace('ё', 'е')
+    if not CYRILLIC_RE.search(word):
+        return word
+    rv, r2 = _regions(word)
+
+    # Шаг 1
+    stripped = _strip(word, rv, PERFECTIVE_GERUND_2, PERFECTIVE_GERUND_1)
+    if stripped is None:
+        word = _strip(word, rv, REFLEXIVE) or word
+        stripped = (_strip_adjectival(word, rv) or _strip(word, rv, VERB_2, VERB_1)
+                    or _strip(word, rv, NOUN))
+    if stripped is not None:
+        word = stripped
+
+    # Шаг 2
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    # Шаг 3
+    word = _strip(word, r2, DERIVATIONAL) or word
+
+    # Шаг 4
+    if word.endswith('нн') and len(word) - 1 >= rv:
+        return word[:-1]
+    stripped = _strip(word, rv, SUPERLATIVE)
+    if stripped is not None:
+        return stripped[:-1] if stripped.endswith('нн') else stripped
+    if word.endswith('ь') and len(word) - 1 >= rv:
+        return word[:-1]
+    return word
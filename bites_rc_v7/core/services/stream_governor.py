@@ -0,0 +1,269 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Окно, по которому считается текущая скорость отдачи (bytes/sec)
+THROUGHPUT_WINDOW_SECONDS = 10
+
+
+class TokenBucket:
+    """
+    Классический token bucket: rate байт/сек, не больше burst байт подряд.
+    consume() блокирует вызывающий поток, пока не накопится нужное количество токенов.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(max(burst, 1))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        while amount > 0:
+            # Большой блок списываем частями, не превышающими burst
+            chunk = min(amount, self.burst)
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= chunk:
+                    self._tokens -= chunk
+                    amount -= chunk
+                    continue
+                wait = (chunk - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class _Waiter:
+    __slots__ = ('video_id',)
+
+    def __init__(self, video_id):
+        self.video_id = video_id
+
+
+class StreamTicket:
+    """Занятый слот отдачи; release() идемпотентен"""
+
+    def __init__(self, governor, video_id, queue_wait):
+        self.governor = governor
+        self.video_id = video_id
+        self.queue_wait = queue_wait
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.governor._release(self.video_id)
+
+
+class _GovernedStream:
+    """Тело ответа с ограничением скорости; close() закрывает источник и вызывает on_close"""
+
+    def __init__(self, blocks, on_close):
+        self._blocks = blocks
+        self._on_close = on_close
+
+    def __iter__(self):
+        return iter(self._blocks)
+
+    def close(self):
+        try:
+            close = getattr(self._blocks, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._on_close()
+
+
+class StreamGovernor:
+    """
+    Ограничитель потоковой отдачи видео.
+
+    Все лимиты и метрики действуют в пределах одного процесса-воркера, а не
+    сайта целиком: при N воркерах gunicorn/uwsgi одновременно может идти до
+    N * max_active отдач, а node_rate_limit ограничивает трафик одного воркера.
+
+    - глобальный лимит одновременных отдач и лимит на одно видео;
+    - справедливая очередь: ожидающие допускаются в порядке прихода, но запрос
+      к видео, упершемуся в свой лимит, не задерживает запросы к другим видео;
+    - token bucket на соединение и общий на узел (опционально);
+    - метрики: активные отдачи, очередь, время ожидания, bytes/sec.
+    """
+
+    def __init__(self, max_active, max_per_video, queue_timeout, rate_limit=None, rate_burst=None, node_rate_limit=None):
+        self.max_active = max_active
+        self.max_per_video = max_per_video
+        self.queue_timeout = queue_timeout
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst or (rate_limit or 0) * 2
+        self.node_bucket = TokenBucket(node_rate_limit, node_rate_limit * 2) if node_rate_limit else None
+
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._active = 0
+        self._per_video = {}
+
+        self._metrics_lock = threading.Lock()
+        self._bytes_total = 0
+        self._byte_events = deque()  # (monotonic, bytes)
+        self._admitted = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            max_active=getattr(settings, 'VIDEO_STREAM_MAX_ACTIVE', 64),
+            max_per_video=getattr(settings, 'VIDEO_STREAM_MAX_PER_VIDEO', 16),
+            queue_timeout=getattr(settings, 'VIDEO_STREAM_QUEUE_TIMEOUT', 10),
+            rate_limit=getattr(settings, 'VIDEO_STREAM_RATE_LIMIT', None),
+            rate_burst=getattr(settings, 'VIDEO_STREAM_RATE_BURST', None),
+            node_rate_limit=getattr(settings, 'VIDEO_STREAM_NODE_RATE_LIMIT', None),
+        )
+
+    @property
+    def shaping_enabled(self):
+        return bool(self.rate_limit or self.node_bucket)
+
+    # --- допуск -------------------------------------------------------------
+
+    def _video_has_capacity(self, video_id):
+        return self._per_video.get(video_id, 0) < self.max_per_video
+
+    def _can_admit(self, waiter):
+        if self._active >= self.max_active or not self._video_has_capacity(waiter.video_id):
+            return False
+        # FIFO среди тех, кого сейчас можно допустить
+        for other in self._queue:
+            if other is waiter:
+                return True
+            if self._video_has_capacity(other.video_id):
+                return False
+        return True
+
+    def acquire(self, video_id, timeout=None):
+        """Занимает слот отдачи. Возвращает StreamTicket или None, если очередь не дождалась"""
+        timeout = self.queue_timeout if timeout is None else timeout
+        waiter = _Waiter(video_id)
+        started = time.monotonic()
+        deadline = started + timeout
+        with self._cond:
+            self._queue.append(waiter)
+            try:
+                while not self._can_admit(waiter):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._rejected += 1
+                        return None
+                    self._cond.wait(remaining)
+                self._active += 1
+                self._per_video[video_id] = self._per_video.get(video_id, 0) + 1
+            finally:
+                self._queue.remove(waiter)
+                # Следующий в очереди мог стать первым допустимым
+                self._cond.notify_all()
+
+        waited = time.monotonic() - started
+        with self._metrics_lock:
+            self._admitted += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return StreamTicket(self, video_id, waited)
+
+    def _release(self, video_id):
+        with self._cond:
+            self._active -= 1
+            count = self._per_video.get(video_id, 0) - 1
+            if count > 0:
+                self._per_video[video_id] = count
+            else:
+                self._per_video.pop(video_id, None)
+            self._cond.notify_all()
+
+    # --- учет трафика -------------------------------------------------------
+
+    def record_bytes(self, amount):
+        now = time.monotonic()
+        with self._metrics_lock:
+            self._bytes_total += amount
+            self._byte_events.append((now, amount))
+            self._trim_events(now)
+
+    def _trim_events(self, now):
+        while self._byte_events and self._byte_events[0][0] < now - THROUGHPUT_WINDOW_SECONDS:
+            self._byte_events.popleft()
+
+    def _throttled(self, iterator):
+        bucket = TokenBucket(self.rate_limit, self.rate_burst) if self.rate_limit else None
+        for block in iterator:
+            size = len(block)
+            if bucket is not None:
+                bucket.consume(size)
+            if self.node_bucket is not None:
+                self.node_bucket.consume(size)
+            self.record_bytes(size)
+            yield block
+
+    def govern(self, response, ticket):
+        """
+        Привязывает слот к ответу: слот освобождается при закрытии ответа.
+        При включенном ограничении скорости тело отдается блоками через token bucket
+        (sendfile через wsgi.file_wrapper в этом случае отключается).
+        """
+        if self.shaping_enabled:
+            # Присваивание итератора сбрасывает FileResponse.file_to_stream;
+            # его close() Django вызывает при закрытии ответа
+            response.streaming_content = _GovernedStream(self._throttled(response.streaming_content),
+                                                         ticket.release)
+            return response
+
+        # Байты уходят через sendfile мимо Python - учитываем объем при закрытии.
+        # WSGIHandler передает response.close в wsgi.file_wrapper как close() файла,
+        # поэтому обертка срабатывает и при отдаче через sendfile
+        length = int(response.get('Content-Length') or 0)
+        close = response.close
+
+        def governed_close():
+            try:
+                close()
+            finally:
+                self.record_bytes(length)
+                ticket.release()
+
+        response.close = governed_close
+        return response
+
+    def metrics(self):
+        now = time.monotonic()
+        with self._cond:
+            active = self._active
+            queued = len(self._queue)
+            per_video = dict(self._per_video)
+        with self._metrics_lock:
+            self._trim_events(now)
+            window_bytes = sum(amount for _, amount in self._byte_events)
+            admitted = self._admitted
+            return {
+                'active_streams': active,
+                'queued_streams': queued,
+                'active_per_video': per_video,
+                'max_active': self.max_active,
+                'max_per_video': self.max_per_video,
+                'bytes_total': self._bytes_total,
+                'bytes_per_sec': round(window_bytes / THROUGHPUT_WINDOW_SECONDS, 1),
+                'admitted_total': admitted,
+                'rejected_total': self._rejected,
+                'queue_wait_avg': round(self._wait_total / admitted, 4) if admitted else 0.0,
+                'queue_wait_max': round(self._wait_max, 4),
+                'rate_limit': self.rate_limit,
+            }
+
+
+stream_governor = StreamGovernor.from_settings()
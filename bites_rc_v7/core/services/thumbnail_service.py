@@ -0,0 +1,112 @@
+import io
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_THUMBNAIL_WIDTHS = (320, 640, 1280)
+
+
+class ThumbnailService:
+    """
+    Производные превью видео: WebP фиксированной ширины рядом с оригиналом
+    (thumbnails/<имя>_<ширина>w.webp).
+
+    Варианты генерируются один раз (при импорте/загрузке), список сохраняется
+    в Video.thumbnail_variants, поэтому при рендере карточек файловая система
+    не опрашивается. Увеличение не делается: если оригинал уже ширины варианта,
+    вместо него кладется один WebP в исходном размере.
+    """
+
+    @classmethod
+    def widths(cls):
+        return sorted(getattr(settings, 'THUMBNAIL_VARIANT_WIDTHS', DEFAULT_THUMBNAIL_WIDTHS))
+
+    @classmethod
+    def variant_name(cls, original_name, width):
+        stem, _ = os.path.splitext(original_name)
+        return f"{stem}_{width}w.webp"
+
+    @classmethod
+    def target_widths(cls, source_width):
+        widths = cls.widths()
+        targets = [w for w in widths if w < source_width]
+        if source_width <= widths[-1]:
+            targets.append(source_width)
+        return targets
+
+    @classmethod
+    def generate_variants(cls, video, force=False):
+        """
+        Создает WebP-варианты превью и сохраняет их список в video.thumbnail_variants.
+        Возвращает список вариантов; ошибки логируются и не прерывают импорт.
+        """
+        if not video.thumbnail:
+            return []
+        if video.thumbnail_variants and not force:
+            return video.thumbnail_variants
+
+        # Pillow нужен только здесь - не тянем его при импорте модуля
+        from PIL import Image
+
+        storage = video.thumbnail.storage
+        quality = getattr(settings, 'THUMBNAIL_WEBP_QUALITY', 80)
+        try:
+            with storage.open(video.thumbnail.name, 'rb') as f:
+                source = Image.open(f)
+                source.load()
+        except Exception as e:
+            logger.error(f"[THUMBNAIL_VARIANTS_FAILED] Cannot open thumbnail of video {video.pk}: {e}")
+            return []
+
+        if source.mode not in ('RGB', 'RGBA'):
+            source = source.convert('RGB')
+
+        variants = []
+        try:
+            for width in cls.target_widths(source.width):
+                if width == source.width:
+                    image = source
+                else:
+                    height = max(1, round(source.height * width / source.width))
+                    image = source.resize((width, height), Image.LANCZOS)
+                buffer = io.BytesIO()
+                image.save(buffer, 'WEBP', quality=quality, method=4)
+                name = cls.variant_name(video.thumbnail.name, width)
+                if storage.exists(name):
+                    storage.delete(name)
+                saved_name = storage.save(name, ContentFile(buffer.getvalue()))
+                variants.append({'width': width, 'name': saved_name})
+        except Exception as e:
+            logger.error(f"[THUMBNAIL_VARIANTS_FAILED] Error generating variants for video {video.pk}: {e}")
+            return []
+
+        video.thumbnail_variants = variants
+        video.save(update_fields=['thumbnail_variants'])
+        logger.info(f"[THUMBNAIL_VARIANTS] Generated {len(variants)} WebP variants for video {video.pk}")
+        return variants
+
+    @classmethod
+    def replace_variants(cls, video):
+        """Превью заменено (edit_video): удаляет варианты старого и создает новые"""
+        cls.remove_variants(video)
+        # Если генерация не удастся, srcset не должен ссылаться на удаленные файлы
+        video.thumbnail_variants = []
+        video.save(update_fields=['thumbnail_variants'])
+        return cls.generate_variants(video, force=True)
+
+    @classmethod
+    def remove_variants(cls, video):
+        """Удаляет файлы вариантов превью (например, при удалении видео)"""
+        if not video.thumbnail_variants:
+            return
+        storage = video._meta.get_field('thumbnail').storage
+        for variant in video.thumbnail_variants:
+            try:
+                storage.delete(variant['name'])
+            except Exception as e:
+                logger.warning(f"Не удалось удалить вариант превью {variant.get('name')}: {e}")
@@ -0,0 +1,241 @@
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Value
+
+from core.models import Video, VideoTransition
+from core.services.engagement_counters import days_since_epoch
+from core.services.transition_graph import TransitionGraph, decayed_score_expression
+
+logger = logging.getLogger(__name__)
+
+SHARDS = 16
+METRIC_NAMES = ('flushes', 'flushed', 'dropped', 'failed')
+
+
+class _Shard:
+    __slots__ = ('lock', 'counts', 'since')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = defaultdict(int)
+        self.since = None  # время самого старого неслитого клика
+
+
+class TransitionBuffer:
+    """
+    Буфер кликов по переходам между видео (write-behind).
+
+    register_video_transition только увеличивает счетчик пары (from, to) в
+    памяти процесса: счетчики разбиты на SHARDS шардов со своими блокировками,
+    так что параллельные запросы почти не конкурируют. Фоновый поток раз в
+    TRANSITION_FLUSH_INTERVAL секунд (или сразу, если пар больше
+    TRANSITION_BUFFER_MAX_PAIRS) забирает накопленное и пишет в одной транзакции:
+    - недостающие строки VideoTransition - одним bulk_create(ignore_conflicts);
+    - приращения - одним UPDATE count = count + n (и затухающего score) на
+      каждое встречающееся n, без чтения-изменения-записи в Python.
+    После записи списки "далее" затронутых видео ставятся на пересчет.
+
+    Если запись не удалась, клики возвращаются в буфер и уходят со следующей
+    попыткой; при остановке процесса (atexit) буфер сливается синхронно.
+    Метрики слива (записанные клики, ошибки, задержка от первого клика до
+    записи) общие для всех процессов и хранятся в кэше:
+    /api/transition-buffer-metrics/.
+    """
+
+    def __init__(self, interval=5.0, max_pairs=50000):
+        self.interval = interval
+        self.max_pairs = max_pairs
+        self._shards = [_Shard() for _ in range(SHARDS)]
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._exit_hook = False
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            interval=getattr(settings, 'TRANSITION_FLUSH_INTERVAL', 5.0),
+            max_pairs=getattr(settings, 'TRANSITION_BUFFER_MAX_PAIRS', 50000),
+        )
+
+    # --- прием кликов -------------------------------------------------------
+
+    def add(self, from_id, to_id, amount=1):
+        self._ensure_thread()
+        pair = (from_id, to_id)
+        shard = self._shards[hash(pair) % SHARDS]
+        with shard.lock:
+            if shard.since is None:
+                shard.since = time.time()
+            shard.counts[pair] += amount
+            size = len(shard.counts)
+        if size * SHARDS > self.max_pairs:
+            self._wake.set()
+
+    def pending(self):
+        return sum(len(shard.counts) for shard in self._shards)
+
+    # --- фоновый поток ------------------------------------------------------
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='transition-flusher', daemon=True)
+                self._thread.start()
+                if not self._exit_hook:
+                    atexit.register(self.shutdown)
+                    self._exit_hook = True
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"[TRANSITION_FLUSH_ERROR] {e}", exc_info=True)
+
+    def shutdown(self):
+        """Останавливает поток и сливает остаток буфера (вызывается при выходе процесса)"""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.interval + 5)
+        try:
+            self.flush()
+        except Exception as e:
+            lost = sum(sum(shard.counts.values()) for shard in self._shards)
+            logger.error(f"[TRANSITION_FLUSH_ERROR] Final flush failed, {lost} clicks lost: {e}")
+
+    # --- запись -------------------------------------------------------------
+
+    def _drain(self):
+        """Забирает содержимое всех шардов: ({пара: n}, время самого старого клика)"""
+        batch = defaultdict(int)
+        oldest = None
+        for shard in self._shards:
+            with shard.lock:
+                counts, since = shard.counts, shard.since
+                shard.counts, shard.since = defaultdict(int), None
+            for pair, amount in counts.items():
+                batch[pair] += amount
+            if since is not None and (oldest is None or since < oldest):
+                oldest = since
+        return batch, oldest
+
+    def _restore(self, batch, oldest):
+        for pair, amount in batch.items():
+            shard = self._shards[hash(pair) % SHARDS]
+            with shard.lock:
+                shard.counts[pair] += amount
+                if shard.since is None or (oldest is not None and oldest < shard.since):
+                    shard.since = oldest
+
+    @staticmethod
+    def _apply(batch):
+        """Пишет приращения в БД. Возвращает (id видео-источников, отброшенные клики)"""
+        video_ids = {video_id for pair in batch for video_id in pair}
+        existing = set(Video.objects.filter(pk__in=video_ids).values_list('pk', flat=True))
+        # Клики по удаленным (или несуществующим) видео отбрасываются
+        known = {pair: amount for pair, amount in batch.items() if pair[0] in existing and pair[1] in existing}
+        dropped = sum(batch.values()) - sum(known.values())
+        batch = known
+        if not batch:
+            return set(), dropped
+
+        sources = {from_id for from_id, _ in batch}
+        targets = {to_id for _, to_id in batch}
+        now = days_since_epoch()
+        with transaction.atomic():
+            VideoTransition.objects.bulk_create(
+                [VideoTransition(from_video_id=from_id, to_video_id=to_id) for from_id, to_id in batch],
+                ignore_conflicts=True, batch_size=1000,
+            )
+            rows = VideoTransition.objects.filter(from_video_id__in=sources, to_video_id__in=targets).values_list(
+                'pk', 'from_video_id', 'to_video_id',
+            )
+            by_amount = defaultdict(list)
+            for pk, from_id, to_id in rows:
+                amount = batch.get((from_id, to_id))
+                if amount:
+                    by_amount[amount].append(pk)
+            for amount, pks in by_amount.items():
+                VideoTransition.objects.filter(pk__in=pks).update(
+                    count=F('count') + amount,
+                    score=decayed_score_expression(now) + float(amount),
+                    score_day=Value(now),
+                )
+        return sources, dropped
+
+    def flush(self):
+        """Сливает буфер в БД. Возвращает количество записанных кликов"""
+        with self._flush_lock:
+            batch, oldest = self._drain()
+            if not batch:
+                return 0
+            clicks = sum(batch.values())
+            started = time.time()
+            try:
+                sources, dropped = self._apply(batch)
+            except Exception:
+                self._restore(batch, oldest)
+                _incr('failed')
+                raise
+
+        for video_id in sources:
+            TransitionGraph.schedule_refresh(video_id)
+        finished = time.time()
+        _incr('flushes')
+        _incr('flushed', clicks - dropped)
+        if dropped:
+            _incr('dropped', dropped)
+        cache.set_many({
+            _metric_key('last_lag'): round(finished - oldest, 3),
+            _metric_key('last_flush_ms'): round((finished - started) * 1000, 1),
+            _metric_key('last_flush_at'): finished,
+        }, None)
+        logger.debug(f"[TRANSITION_FLUSH] {clicks} clicks on {len(batch)} pairs in {finished - started:.3f}s")
+        return clicks - dropped
+
+    # --- метрики ------------------------------------------------------------
+
+    def metrics(self):
+        """Общие метрики слива из кэша и размер буфера текущего процесса"""
+        names = METRIC_NAMES + ('last_lag', 'last_flush_ms', 'last_flush_at')
+        values = cache.get_many([_metric_key(name) for name in names])
+        result = {name: values.get(_metric_key(name), 0) for name in METRIC_NAMES}
+        for name in ('last_lag', 'last_flush_ms', 'last_flush_at'):
+            result[name] = values.get(_metric_key(name))
+        result['process_pending_pairs'] = self.pending()
+        result['flush_interval'] = self.interval
+        return result
+
+
+def _metric_key(name):
+    return f'transition_buffer_{name}'
+
+
+def _incr(name, delta=1):
+    key = _metric_key(name)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # Счетчика еще нет: add не перезапишет значение, созданное параллельно
+        cache.add(key, 0, None)
+        cache.incr(key, delta)
+
+
+transition_buffer = TransitionBuffer.from_settings()
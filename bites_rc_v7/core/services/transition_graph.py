@@ -0,0 +1,137 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Cast, Power
+
+from core.models import VideoTransition
+from core.services.engagement_counters import days_since_epoch
+
+logger = logging.getLogger(__name__)
+
+TRANSITION_HALF_LIFE_DAYS = 14
+UP_NEXT_LIMIT = 20
+# Переходы с долей ниже этой в строке не попадают в списки
+MIN_PROBABILITY = 0.01
+
+UP_NEXT_KEY = 'up_next_{}'
+
+
+def _half_life():
+    return float(getattr(settings, 'TRANSITION_HALF_LIFE_DAYS', TRANSITION_HALF_LIFE_DAYS))
+
+
+def _limit():
+    return getattr(settings, 'UP_NEXT_LIMIT', UP_NEXT_LIMIT)
+
+
+def decayed_score_expression(now):
+    """
+    SQL-выражение для score перехода, приведенного к моменту now (дни от
+    ENGAGEMENT_EPOCH): score * 2 ** ((score_day - now) / H). У строк, записанных
+    до появления score (score_day = 0), за основу берется count.
+    """
+    factor = Power(Value(2.0), (F('score_day') - Value(now)) / Value(_half_life()), output_field=FloatField())
+    return Case(
+        When(score_day=0, then=Cast('count', FloatField())),
+        default=F('score') * factor,
+        output_field=FloatField(),
+    )
+
+
+class TransitionGraph:
+    """
+    Граф переходов "видео -> следующее видео" по VideoTransition.
+
+    Каждый переход хранит, кроме счетчика count, затухающий score
+    (период полураспада TRANSITION_HALF_LIFE_DAYS) на дату score_day; клики
+    пишутся пакетами через буфер TransitionBuffer. Из графа материализуются
+    списки "смотреть далее": для видео - до UP_NEXT_LIMIT переходов с
+    наибольшим затухшим score, нормированным на сумму строки (доля
+    переходов P(to | from)). Списки лежат в кэше и читаются за O(1).
+
+    - rebuild() - полный офлайн-проход: все переходы одним запросом, матрица в
+      виде массивов (from, to, score) в NumPy, сортировка по строкам и top-K;
+    - refresh(video_id) - пересчет одной строки (после кликов, через очередь
+      InteractionEffects 'up_next'); при промахе кэша строка считается так же.
+    """
+
+    @staticmethod
+    def _top_k(to_ids, scores, limit):
+        """[(to_id, доля), ...] по убыванию доли для одной строки"""
+        total = sum(scores)
+        if total <= 0:
+            return []
+        ranked = sorted(zip(to_ids, scores), key=lambda item: item[1], reverse=True)
+        return [(to_id, round(score / total, 4)) for to_id, score in ranked[:limit]
+                if score / total >= MIN_PROBABILITY]
+
+    @classmethod
+    def refresh(cls, video_id):
+        """Пересчитывает список "далее" одного видео. Возвращает его"""
+        now = days_since_epoch()
+        rows = list(
+            VideoTransition.objects.filter(from_video_id=video_id)
+            .annotate(decayed=decayed_score_expression(now))
+            .values_list('to_video_id', 'decayed')
+        )
+        neighbors = cls._top_k([row[0] for row in rows], [row[1] for row in rows], _limit())
+        cache.set(UP_NEXT_KEY.format(video_id), neighbors, None)
+        return neighbors
+
+    @classmethod
+    def schedule_refresh(cls, video_id):
+        from core.services.interaction_effects import InteractionEffects
+        return InteractionEffects.enqueue('up_next', video_id)
+
+    @classmethod
+    def rebuild(cls, batch_size=5000):
+        """Полный пересчет всех списков. Возвращает количество видео со списками"""
+        import numpy as np
+
+        started = time.monotonic()
+        now = days_since_epoch()
+        rows = VideoTransition.objects.annotate(decayed=decayed_score_expression(now)).values_list(
+            'from_video_id', 'to_video_id', 'decayed',
+        )
+        data = np.array(list(rows.iterator(chunk_size=batch_size)), dtype=np.float64).reshape(-1, 3)
+        if not len(data):
+            return 0
+        sources, targets, scores = data[:, 0].astype(np.int64), data[:, 1].astype(np.int64), data[:, 2]
+
+        # Строки матрицы подряд, внутри строки - по убыванию score
+        order = np.lexsort((-scores, sources))
+        sources, targets, scores = sources[order], targets[order], scores[order]
+        starts = np.flatnonzero(np.r_[True, sources[1:] != sources[:-1]])
+        totals = np.add.reduceat(scores, starts)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            probabilities = scores / np.repeat(totals, np.diff(np.r_[starts, len(scores)]))
+
+        limit = _limit()
+        lists = {}
+        for start, end in zip(starts, np.r_[starts[1:], len(scores)]):
+            end = min(end, start + limit)
+            keep = probabilities[start:end] >= MIN_PROBABILITY
+            lists[UP_NEXT_KEY.format(int(sources[start]))] = [
+                (int(to_id), round(float(p), 4))
+                for to_id, p in zip(targets[start:end][keep], probabilities[start:end][keep])
+            ]
+            if len(lists) >= batch_size:
+                cache.set_many(lists, None)
+                lists = {}
+        if lists:
+            cache.set_many(lists, None)
+
+        logger.info(f"[TRANSITION_GRAPH] Rebuilt up-next lists for {len(starts)} videos from "
+                    f"{len(scores)} transitions in {time.monotonic() - started:.1f}s")
+        return len(starts)
+
+    @classmethod
+    def next_videos(cls, video_id):
+        """[(to_id, доля), ...] - список "далее" из кэша или с пересчетом строки"""
+        neighbors = cache.get(UP_NEXT_KEY.format(video_id))
+        if neighbors is None:
+            neighbors = cls.refresh(video_id)
+        return neighbors
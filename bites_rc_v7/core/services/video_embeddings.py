@@ -0,0 +1,380 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Ниже этого числа векторов поиск идет полным перебором (он и так быстрый)
+IVF_MIN_ROWS = 5000
+# Сколько ближайших кластеров просматривается при поиске
+IVF_NPROBE = 16
+SIMILAR_LIMIT = 48
+INITIAL_CAPACITY = 1024
+# Длина описания, которая идет в модель вместе с названием
+DESCRIPTION_CHARS = 1000
+
+
+def video_text(title, description):
+    return f"{title}\n{(description or '')[:DESCRIPTION_CHARS]}".strip()
+
+
+class VideoEmbedder:
+    """
+    Небольшая многоязычная модель эмбеддингов (по умолчанию cointegrated/rubert-tiny2,
+    312 измерений), загружается один раз на процесс и работает на CPU.
+    Вектор - нормированный CLS-токен, так что скалярное произведение равно косинусу.
+    """
+
+    def __init__(self, model_name, max_length=256):
+        self.model_name = model_name
+        self.max_length = max_length
+        self._model = None
+        self._tokenizer = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._model is not None:
+            return
+        with self._lock:
+            if self._model is not None:
+                return
+            # transformers/torch тяжелые - импортируем только при первой загрузке
+            from transformers import AutoModel, AutoTokenizer
+
+            started = time.monotonic()
+            self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            model = AutoModel.from_pretrained(self.model_name)
+            model.eval()
+            self._model = model
+            logger.info(f"[VIDEO_EMBEDDINGS] Loaded {self.model_name} in {time.monotonic() - started:.1f}s")
+
+    @property
+    def dim(self):
+        self.load()
+        return self._model.config.hidden_size
+
+    def encode(self, texts, batch_size=32):
+        """Нормированные векторы float32 [len(texts), dim]"""
+        import numpy as np
+        import torch
+
+        self.load()
+        vectors = []
+        with torch.inference_mode():
+            for start in range(0, len(texts), batch_size):
+                inputs = self._tokenizer(texts[start:start + batch_size], return_tensors='pt', padding=True,
+                                         truncation=True, max_length=self.max_length)
+                cls = self._model(**inputs).last_hidden_state[:, 0]
+                vectors.append(torch.nn.functional.normalize(cls, dim=-1).numpy())
+        return np.concatenate(vectors).astype(np.float32) if vectors else np.zeros((0, self.dim), np.float32)
+
+
+class VideoEmbeddingIndex:
+    """
+    Семантический индекс "похожих видео" по названию и описанию.
+
+    Файлы в EMBEDDING_INDEX_DIR:
+    - vectors.f16 - матрица float16 [capacity, dim], открывается через np.memmap;
+    - ids.i64 - id видео для каждой строки (-1 - удаленная строка);
+    - lists.i32 - номер кластера IVF для строки (-1 - еще не назначен);
+    - centroids.npy - центроиды IVF (k-means по векторам);
+    - meta.json - размерность, число занятых строк, емкость, модель.
+
+    Вставка (upsert) дописывает строку или перезаписывает строку того же видео
+    под файловой блокировкой и назначает ей ближайший центроид; meta.json
+    пишется последним, поэтому читатели видят только полностью записанные строки.
+    Когда строк стало вдвое больше, чем при обучении, train() пересчитывает
+    центроиды (ежедневная задача).
+
+    Поиск similar(video_id): вектор видео берется из матрицы (модель в запросе не
+    нужна), затем скалярные произведения считаются только по строкам IVF_NPROBE
+    ближайших кластеров; до IVF_MIN_ROWS строк - полным перебором.
+    Читатели в веб-процессах переоткрывают memmap при изменении meta.json.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._state = None
+        self._state_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        directory = getattr(settings, 'EMBEDDING_INDEX_DIR', None) or os.path.join(
+            settings.BASE_DIR, 'models', 'embeddings')
+        return cls(directory)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    # --- хранение -----------------------------------------------------------
+
+    def _read_meta(self):
+        try:
+            with open(self._path('meta.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_meta(self, meta):
+        tmp_path = self._path('meta.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._path('meta.json'))
+
+    def _open(self, meta, mode):
+        import numpy as np
+
+        shape = (meta['capacity'],)
+        arrays = {
+            'vectors': np.memmap(self._path('vectors.f16'), np.float16, mode, shape=(meta['capacity'], meta['dim'])),
+            'ids': np.memmap(self._path('ids.i64'), np.int64, mode, shape=shape),
+            'lists': np.memmap(self._path('lists.i32'), np.int32, mode, shape=shape),
+        }
+        centroids_path = self._path('centroids.npy')
+        arrays['centroids'] = np.load(centroids_path) if os.path.exists(centroids_path) else None
+        return arrays
+
+    @staticmethod
+    def _layout(dim):
+        """(файл, байт на строку, заполнитель): новые строки id/lists заполняются -1"""
+        return (('vectors.f16', 2 * dim, b'\0'), ('ids.i64', 8, b'\xff'), ('lists.i32', 4, b'\xff'))
+
+    def _create(self, dim, capacity):
+        """
+        Создает пустые файлы. Они пишутся под временными именами и подменяются
+        через os.replace: memmap читателей остаются на старых файлах, а не на
+        обрезанных (обращение к обрезанной странице - SIGBUS). meta.json удаляется
+        первым, чтобы до записи новой meta читатели видели "индекса нет".
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        for name in ('meta.json', 'centroids.npy'):
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+        for name, itemsize, fill in self._layout(dim):
+            tmp_path = self._path(f'{name}.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(fill * (capacity * itemsize))
+            os.replace(tmp_path, self._path(name))
+
+    def _grow(self, dim, capacity):
+        """Дописывает файлы до capacity строк (данные и открытые memmap сохраняются)"""
+        for name, itemsize, fill in self._layout(dim):
+            path = self._path(name)
+            with open(path, 'ab') as f:
+                f.write(fill * (capacity * itemsize - os.path.getsize(path)))
+
+    @contextmanager
+    def _write_lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path('.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # --- запись -------------------------------------------------------------
+
+    def upsert(self, items, model_name=None):
+        """items - [(video_id, вектор float32)]. Вставляет или перезаписывает строки"""
+        import numpy as np
+
+        if not items:
+            return 0
+        dim = len(items[0][1])
+        with self._write_lock():
+            meta = self._read_meta()
+            if meta is None or meta['dim'] != dim:
+                meta = {'dim': dim, 'rows': 0, 'capacity': INITIAL_CAPACITY, 'trained_rows': 0,
+                        'model': model_name, 'generation': time.time_ns()}
+                self._create(dim, meta['capacity'])
+            needed = meta['rows'] + len(items)
+            if needed > meta['capacity']:
+                capacity = meta['capacity']
+                while capacity < needed:
+                    capacity *= 2
+                self._grow(dim, capacity)
+                meta['capacity'] = capacity
+
+            arrays = self._open(meta, 'r+')
+            ids = arrays['ids']
+            wanted = np.fromiter((video_id for video_id, _ in items), np.int64, len(items))
+            rows = np.flatnonzero(np.isin(ids[:meta['rows']], wanted))
+            existing = {int(ids[row]): int(row) for row in rows}
+            centroids = arrays['centroids']
+            for video_id, vector in items:
+                row = existing.get(video_id)
+                if row is None:
+                    row = meta['rows']
+                    meta['rows'] += 1
+                    existing[video_id] = row
+                arrays['vectors'][row] = vector.astype(np.float16)
+                ids[row] = video_id
+                arrays['lists'][row] = int(np.argmax(centroids @ vector)) if centroids is not None else -1
+            for name in ('vectors', 'ids', 'lists'):
+                arrays[name].flush()
+            meta['model'] = model_name or meta.get('model')
+            self._write_meta(meta)
+        return len(items)
+
+    def remove(self, video_ids):
+        """Помечает строки видео удаленными"""
+        import numpy as np
+
+        with self._write_lock():
+            meta = self._read_meta()
+            if meta is None:
+                return 0
+            arrays = self._open(meta, 'r+')
+            ids = arrays['ids']
+            rows = np.flatnonzero(np.isin(ids[:meta['rows']], list(video_ids)))
+            ids[rows] = -1
+            removed = len(rows)
+            ids.flush()
+            meta['removed'] = meta.get('removed', 0) + removed
+            self._write_meta(meta)
+        return removed
+
+    def train(self, iterations=10, sample_size=50000, seed=0):
+        """
+        Обучает центроиды IVF (k-means на сферических векторах, nlist ~ sqrt(N))
+        и переназначает кластеры всем строкам. Возвращает число кластеров.
+        """
+        import numpy as np
+
+        with self._write_lock():
+            meta = self._read_meta()
+            if meta is None or meta['rows'] < IVF_MIN_ROWS:
+                return 0
+            arrays = self._open(meta, 'r+')
+            rows = meta['rows']
+            live = np.flatnonzero(arrays['ids'][:rows] >= 0)
+            nlist = max(1, int(np.sqrt(len(live))))
+            rng = np.random.default_rng(seed)
+            sample = arrays['vectors'][rng.choice(live, min(sample_size, len(live)), replace=False)].astype(np.float32)
+            centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+            for _ in range(iterations):
+                assignment = np.argmax(sample @ centroids.T, axis=1)
+                for cluster in range(nlist):
+                    members = sample[assignment == cluster]
+                    if len(members):
+                        centroid = members.sum(axis=0)
+                        centroids[cluster] = centroid / (np.linalg.norm(centroid) or 1.0)
+
+            lists = arrays['lists']
+            for start in range(0, rows, 10000):
+                block = arrays['vectors'][start:min(rows, start + 10000)].astype(np.float32)
+                lists[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+            lists.flush()
+            tmp_path = self._path('centroids.tmp.npy')
+            np.save(tmp_path, centroids)
+            os.replace(tmp_path, self._path('centroids.npy'))
+            meta['trained_rows'] = rows
+            meta['nlist'] = nlist
+            self._write_meta(meta)
+        logger.info(f"[VIDEO_EMBEDDINGS] Trained {nlist} IVF lists on {len(live)} vectors")
+        return nlist
+
+    def needs_training(self):
+        meta = self._read_meta()
+        return bool(meta) and meta['rows'] >= IVF_MIN_ROWS and meta['rows'] >= 2 * meta.get('trained_rows', 0)
+
+    # --- поиск --------------------------------------------------------------
+
+    def _reader(self):
+        """Состояние для чтения; переоткрывается, если meta.json изменился"""
+        try:
+            stamp = os.stat(self._path('meta.json')).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        state = self._state
+        if state is not None and state['stamp'] == stamp:
+            return state
+        with self._state_lock:
+            state = self._state
+            if state is not None and state['stamp'] == stamp:
+                return state
+            meta = self._read_meta()
+            if meta is None:
+                return None  # индекс пересоздается
+            arrays = self._open(meta, 'r')
+            rows = meta['rows']
+            # Карта id -> строка достраивается только для новых строк тех же файлов;
+            # после пересоздания (другое поколение, строк стало меньше) - строится заново
+            previous = state['meta'] if state is not None else None
+            if (previous is not None and previous.get('generation') == meta.get('generation')
+                    and previous['capacity'] == meta['capacity'] and previous['rows'] <= rows):
+                id_rows = state['id_rows']
+                start = state['meta']['rows']
+            else:
+                id_rows, start = {}, 0
+            for row, video_id in enumerate(arrays['ids'][start:rows], start):
+                if video_id >= 0:
+                    id_rows[int(video_id)] = row
+            state = dict(arrays, meta=meta, stamp=stamp, id_rows=id_rows)
+            self._state = state
+            return state
+
+    def similar(self, video_id, limit=SIMILAR_LIMIT):
+        """[(video_id, косинус), ...] ближайших видео или None, если вектора еще нет"""
+        import numpy as np
+
+        state = self._reader()
+        if state is None:
+            return None
+        row = state['id_rows'].get(video_id)
+        ids = state['ids']
+        if row is None or ids[row] != video_id:
+            return None
+        rows = state['meta']['rows']
+        vectors = state['vectors']
+        query = vectors[row].astype(np.float32)
+
+        centroids = state['centroids']
+        if centroids is not None and rows >= IVF_MIN_ROWS:
+            probes = np.argpartition(centroids @ query, -min(IVF_NPROBE, len(centroids)))[-IVF_NPROBE:]
+            lists = state['lists'][:rows]
+            candidates = np.flatnonzero(np.isin(lists, probes) | (lists < 0))
+        else:
+            candidates = np.arange(rows)
+        candidates = candidates[(ids[candidates] >= 0) & (candidates != row)]
+        if not len(candidates):
+            return []
+
+        scores = vectors[candidates].astype(np.float32) @ query
+        top = np.argpartition(scores, -min(limit, len(scores)))[-limit:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(int(ids[candidates[i]]), round(float(scores[i]), 4)) for i in top]
+
+    # --- видео --------------------------------------------------------------
+
+    def refresh_videos(self, video_ids, batch_size=32):
+        """Пересчитывает векторы видео (после импорта или правки названия/описания)"""
+        from core.models import Video
+
+        videos = list(Video.objects.filter(pk__in=video_ids).values_list('pk', 'title', 'description'))
+        missing = set(video_ids) - {pk for pk, _, _ in videos}
+        if missing:
+            self.remove(missing)
+        if not videos:
+            return 0
+        vectors = video_embedder.encode([video_text(title, description) for _, title, description in videos],
+                                        batch_size=batch_size)
+        return self.upsert([(pk, vector) for (pk, _, _), vector in zip(videos, vectors)],
+                           model_name=video_embedder.model_name)
+
+    def schedule(self, video_id):
+        from core.services.interaction_effects import InteractionEffects
+        return InteractionEffects.enqueue('embedding', video_id)
+
+
+video_embedder = VideoEmbedder(getattr(settings, 'EMBEDDING_MODEL_NAME', 'cointegrated/rubert-tiny2'))
+video_embedding_index = VideoEmbeddingIndex.from_settings()
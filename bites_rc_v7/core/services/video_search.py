@@ -0,0 +1,368 @@
+import difflib
+import hashlib
+import logging
+import re
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q
+
+from core.models import Video
+from core.services.stemmer import stem_russian
+
+logger = logging.getLogger(__name__)
+
+SEARCH_MAX_RESULTS = 1000
+SEARCH_RATING_WEIGHT = 0.3
+SEARCH_CACHE_TTL = 60
+# Слов запроса сверх этого числа не учитываются
+MAX_TERMS = 8
+# Вес совпадения в названии относительно описания (BM25)
+TITLE_WEIGHT = 10.0
+# Сколько близких слов словаря подставляется вместо слова с опечаткой
+TYPO_CANDIDATES = 3
+TYPO_CUTOFF = 0.75
+
+FTS_TABLE = 'core_video_fts'
+VOCAB_TABLE = 'core_video_fts_vocab'
+PG_INDEX = 'core_video_search_gin'
+RESULTS_KEY = 'video_search_{}'
+PG_VOCAB_KEY = 'video_search_pg_vocab'
+
+WORD_RE = re.compile(r'\w+')
+
+# word - слово запроса, stem - основа (форма в индексе SQLite), prefix - искать по префиксу
+Term = namedtuple('Term', 'word stem prefix')
+
+
+def normalize_text(text):
+    """Текст для индекса FTS5: русские слова заменены основами, английские стеммит porter"""
+    return ' '.join(stem_russian(word) for word in WORD_RE.findall((text or '').lower()))
+
+
+def parse_query(query):
+    """
+    Слова запроса -> [Term]. Последнее слово ищется по префиксу, если после
+    него нет пробела (пользователь, возможно, еще не дописал его).
+    """
+    words = WORD_RE.findall((query or '').lower().replace('ё', 'е'))[:MAX_TERMS]
+    typing = bool(words) and not query[-1:].isspace()
+    return [
+        Term(word, stem_russian(word), typing and i == len(words) - 1)
+        for i, word in enumerate(words)
+    ]
+
+
+def _chunks(items, size=500):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class _SqliteFts:
+    """SQLite FTS5: виртуальная таблица (rowid = id видео) и словарь fts5vocab"""
+
+    def __init__(self):
+        self._exists = False
+
+    def exists(self):
+        """Создан ли индекс (положительный ответ запоминается на процесс)"""
+        if not self._exists:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+                self._exists = cursor.fetchone() is not None
+        return self._exists
+
+    def create(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"title, description, tokenize='porter unicode61 remove_diacritics 2')"
+            )
+            # ORDER BY rank использует BM25 с весом названия
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', 'bm25({TITLE_WEIGHT}, 1.0)')")
+            cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {VOCAB_TABLE} USING fts5vocab({FTS_TABLE}, 'row')")
+        self._exists = True
+
+    def index(self, rows):
+        """rows - [(id, title, description)]; строки видео заменяются"""
+        rows = list(rows)
+        with connection.cursor() as cursor:
+            for chunk in _chunks(row[0] for row in rows):
+                cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({', '.join(['%s'] * len(chunk))})", chunk)
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE}(rowid, title, description) VALUES (%s, %s, %s)",
+                [(pk, normalize_text(title), normalize_text(description)) for pk, title, description in rows],
+            )
+
+    def remove(self, video_ids):
+        with connection.cursor() as cursor:
+            for chunk in _chunks(video_ids):
+                cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({', '.join(['%s'] * len(chunk))})", chunk)
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+
+    def optimize(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+    @staticmethod
+    def _expression(groups, any_term=False):
+        """[[Term, ...], ...] -> запрос MATCH: варианты слова через OR, слова через AND"""
+        parts = []
+        for group in groups:
+            variants = [f'"{term.stem}"' + ('*' if term.prefix else '') for term in group]
+            parts.append(variants[0] if len(variants) == 1 else f"({' OR '.join(variants)})")
+        return (' OR ' if any_term else ' ').join(parts)
+
+    def match(self, groups, limit, any_term=False):
+        """[(id, релевантность)] по убыванию релевантности"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, -rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rank LIMIT %s",
+                [self._expression(groups, any_term), limit],
+            )
+            return cursor.fetchall()
+
+    def has_term(self, term):
+        return bool(self.match([[term]], 1))
+
+    def near_terms(self, term):
+        """Слова словаря индекса, похожие на слово с опечаткой"""
+        stem = term.stem
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT term FROM {VOCAB_TABLE} WHERE term >= %s AND term < %s",
+                           [stem[0], chr(ord(stem[0]) + 1)])
+            vocabulary = [row[0] for row in cursor.fetchall() if abs(len(row[0]) - len(stem)) <= 2]
+        return difflib.get_close_matches(stem, vocabulary, TYPO_CANDIDATES, TYPO_CUTOFF)
+
+
+class _PostgresFts:
+    """
+    Postgres: tsvector по названию и описанию с GIN-индексом по выражению.
+    Индекс поддерживает сама СУБД, поэтому index/remove ничего не делают.
+    """
+
+    def __init__(self):
+        self._exists = False
+
+    @staticmethod
+    def _config():
+        return getattr(settings, 'SEARCH_PG_CONFIG', 'russian')
+
+    def _vector(self):
+        return f"to_tsvector('{self._config()}', coalesce(title, '') || ' ' || coalesce(description, ''))"
+
+    def exists(self):
+        if not self._exists:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = %s", [PG_INDEX])
+                self._exists = cursor.fetchone() is not None
+        return self._exists
+
+    def create(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {PG_INDEX} ON {Video._meta.db_table} USING GIN ({self._vector()})"
+            )
+        self._exists = True
+
+    def index(self, rows):
+        pass
+
+    def remove(self, video_ids):
+        pass
+
+    def clear(self):
+        cache.delete(PG_VOCAB_KEY)
+
+    def optimize(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"REINDEX INDEX {PG_INDEX}")
+
+    @staticmethod
+    def _tsquery(groups, any_term=False):
+        parts = []
+        for group in groups:
+            variants = [f"'{term.word}'" + (':*' if term.prefix else '') for term in group]
+            parts.append(f"({' | '.join(variants)})")
+        return (' | ' if any_term else ' & ').join(parts)
+
+    def match(self, groups, limit, any_term=False):
+        config = self._config()
+        weighted = (f"setweight(to_tsvector('{config}', coalesce(title, '')), 'A') || "
+                    f"setweight(to_tsvector('{config}', coalesce(description, '')), 'D')")
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT id, ts_rank_cd({weighted}, query) AS relevance "
+                f"FROM {Video._meta.db_table}, to_tsquery('{config}', %s) query "
+                f"WHERE {self._vector()} @@ query ORDER BY relevance DESC LIMIT %s",
+                [self._tsquery(groups, any_term), limit],
+            )
+            return cursor.fetchall()
+
+    def has_term(self, term):
+        return bool(self.match([[term]], 1))
+
+    def near_terms(self, term):
+        vocabulary = cache.get(PG_VOCAB_KEY)
+        if vocabulary is None:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT word FROM ts_stat(%s)",
+                               [f"SELECT {self._vector()} FROM {Video._meta.db_table}"])
+                vocabulary = sorted(row[0] for row in cursor.fetchall())
+            cache.set(PG_VOCAB_KEY, vocabulary, 3600)
+        stem = term.stem
+        candidates = [word for word in vocabulary if word[:1] == stem[:1] and abs(len(word) - len(stem)) <= 2]
+        return difflib.get_close_matches(stem, candidates, TYPO_CANDIDATES, TYPO_CUTOFF)
+
+
+class VideoSearch:
+    """
+    Полнотекстовый поиск видео по названию и описанию.
+
+    На SQLite - виртуальная таблица FTS5 (создается при первом обращении и
+    заполняется из Video), на Postgres - tsvector с GIN-индексом по выражению.
+    Русские слова приводятся к основе стеммером Snowball (core.services.stemmer),
+    английские - стеммером porter (FTS5) или конфигурацией SEARCH_PG_CONFIG.
+
+    Разбор запроса: все слова обязательны, последнее ищется по префиксу.
+    Если ничего не найдено, слова, которых нет в индексе, заменяются на близкие
+    слова словаря индекса (опечатки), а затем достаточно любого слова.
+
+    Ранжирование: BM25 (название весит TITLE_WEIGHT) нормируется на лучший
+    результат и смешивается с absolute_rating с весом SEARCH_RATING_WEIGHT.
+    Результат - список id до SEARCH_MAX_RESULTS, кэшируется на SEARCH_CACHE_TTL.
+
+    Индекс создается и перестраивается целиком только командой
+    rebuild_search_index (rebuild()); запросы его лишь читают, а пока индекса
+    нет, поиск работает через icontains. Индекс SQLite обновляется сигналами
+    сохранения и удаления Video после коммита.
+    """
+
+    _backends = {}
+
+    @classmethod
+    def backend(cls):
+        """Движок для текущей БД или None, если СУБД без полнотекстового поиска"""
+        vendor = connection.vendor
+        if vendor not in cls._backends:
+            backend_class = {'sqlite': _SqliteFts, 'postgresql': _PostgresFts}.get(vendor)
+            cls._backends[vendor] = backend_class() if backend_class else None
+        return cls._backends[vendor]
+
+    @classmethod
+    def _indexed_backend(cls):
+        """Движок, если его индекс уже построен, иначе None"""
+        backend = cls.backend()
+        return backend if backend is not None and backend.exists() else None
+
+    # --- индекс -------------------------------------------------------------
+
+    @classmethod
+    def rebuild(cls, chunk_size=1000):
+        """Перестраивает индекс по всем видео. Возвращает количество видео"""
+        backend = cls.backend()
+        if backend is None:
+            return 0
+        backend.create()
+        done = 0
+        with transaction.atomic():
+            backend.clear()
+            chunk = []
+            rows = Video.objects.order_by('pk').values_list('pk', 'title', 'description')
+            for row in rows.iterator(chunk_size=chunk_size):
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    backend.index(chunk)
+                    done += len(chunk)
+                    chunk = []
+            backend.index(chunk)
+            done += len(chunk)
+        backend.optimize()
+        logger.info(f"[VIDEO_SEARCH] Rebuilt search index for {done} videos")
+        return done
+
+    @classmethod
+    def index_videos(cls, video_ids):
+        backend = cls._indexed_backend()
+        if backend is not None:
+            backend.index(Video.objects.filter(pk__in=video_ids).values_list('pk', 'title', 'description'))
+
+    @classmethod
+    def remove_videos(cls, video_ids):
+        backend = cls._indexed_backend()
+        if backend is not None:
+            backend.remove(video_ids)
+
+    # --- поиск --------------------------------------------------------------
+
+    @classmethod
+    def _correct(cls, backend, terms):
+        """Группы вариантов: слово и близкие слова словаря, если самого слова в индексе нет"""
+        groups = []
+        for term in terms:
+            group = [term]
+            if not backend.has_term(term):
+                group += [Term(word, word, False) for word in backend.near_terms(term)]
+            groups.append(group)
+        return groups
+
+    @classmethod
+    def _match(cls, backend, terms, limit):
+        groups = [[term] for term in terms]
+        matches = backend.match(groups, limit)
+        if not matches:
+            corrected = cls._correct(backend, terms)
+            if corrected != groups:
+                groups = corrected
+                matches = backend.match(groups, limit)
+        if not matches and len(groups) > 1:
+            matches = backend.match(groups, limit, any_term=True)
+        return matches
+
+    @staticmethod
+    def _rank(matches):
+        """Смешивает релевантность с absolute_rating. Возвращает id по убыванию"""
+        relevance = dict(matches)
+        ratings = dict(Video.objects.filter(pk__in=relevance).values_list('pk', 'absolute_rating'))
+        best = max(relevance.values()) or 1.0
+        top_rating = max((rating for rating in ratings.values()), default=0)
+        weight = getattr(settings, 'SEARCH_RATING_WEIGHT', SEARCH_RATING_WEIGHT)
+
+        def score(pk):
+            rating = max(ratings[pk], 0) / top_rating if top_rating > 0 else 0
+            return (1 - weight) * relevance[pk] / best + weight * rating, ratings[pk]
+
+        return sorted(ratings, key=score, reverse=True)
+
+    @classmethod
+    def search(cls, query):
+        """Id найденных видео по убыванию итоговой оценки"""
+        terms = parse_query(query)
+        if not terms:
+            return []
+        normalized = ' '.join(term.word for term in terms) + ('*' if terms[-1].prefix else '')
+        key = RESULTS_KEY.format(hashlib.md5(normalized.encode()).hexdigest())
+        ids = cache.get(key)
+        if ids is not None:
+            return ids
+
+        limit = getattr(settings, 'SEARCH_MAX_RESULTS', SEARCH_MAX_RESULTS)
+        backend = cls._indexed_backend()
+        if backend is None:
+            # СУБД без полнотекстового поиска или индекс еще не построен
+            condition = Q()
+            for term in terms:
+                condition &= Q(title__icontains=term.word) | Q(description__icontains=term.word)
+            ids = list(Video.objects.filter(condition).order_by('-absolute_rating')
+                       .values_list('pk', flat=True)[:limit])
+        else:
+            matches = cls._match(backend, terms, limit)
+            ids = cls._rank(matches) if matches else []
+        cache.set(key, ids, getattr(settings, 'SEARCH_CACHE_TTL', SEARCH_CACHE_TTL))
+        return ids
@@ -0,0 +1,400 @@
+import mimetypes
+import os
+import re
+import stat
+import uuid
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+logger = logging.getLogger(__name__)
+
+# Размер блока при чтении файла через Python (когда sendfile недоступен)
+STREAM_BLOCK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+class RangeNotSatisfiable(Exception):
+    """Заголовок Range синтаксически корректен, но ни один диапазон не попадает в файл"""
+
+
+class MediaFileInfo:
+    """
+    Снимок метаданных файла, полученный одним вызовом os.stat().
+    Используется для Content-Length, ETag и Last-Modified без повторных обращений к диску.
+    """
+
+    def __init__(self, path, size, mtime, inode=0):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.inode = inode
+
+    @classmethod
+    def from_path(cls, path):
+        """Возвращает MediaFileInfo или None, если файла нет либо он пустой"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if st.st_size <= 0 or not stat.S_ISREG(st.st_mode):
+            return None
+        return cls(path, st.st_size, st.st_mtime, st.st_ino)
+
+    @property
+    def etag(self):
+        # Сильный валидатор: If-Range допускает только сильные ETag
+        return f'"{self.inode:x}-{self.size:x}-{int(self.mtime):x}"'
+
+    @property
+    def last_modified(self):
+        return http_date(int(self.mtime))
+
+    @property
+    def content_type(self):
+        return mimetypes.guess_type(self.path)[0] or 'video/mp4'
+
+    @classmethod
+    def from_video(cls, video):
+        """
+        MediaFileInfo из сохраненных на модели валидаторов, без обращения к диску.
+        None, если валидаторов нет или они сняты с другого файла (файл заменили).
+        """
+        if not video.file or video.file_size is None or video.file_mtime is None:
+            return None
+        if video.file_validated_name != video.file.name:
+            return None
+        return cls(video_file_path(video), video.file_size, video.file_mtime, video.file_inode or 0)
+
+
+def video_file_path(video):
+    """Абсолютный путь к файлу видео; единственное место, где путь собирается из MEDIA_ROOT"""
+    return os.path.join(settings.MEDIA_ROOT, str(video.file))
+
+
+# Кэш валидаторов (ETag/Last-Modified) в Redis: условный GET с теплым кэшем
+# отвечает 304 без запроса к БД и без stat()
+VALIDATOR_CACHE_PREFIX = 'media_validators'
+
+
+def _validator_cache_key(video_id):
+    return f'{VALIDATOR_CACHE_PREFIX}_video_{video_id}'
+
+
+def cache_validators(video_id, info):
+    timeout = getattr(settings, 'MEDIA_VALIDATOR_CACHE_TTL', 3600)
+    cache.set(_validator_cache_key(video_id), {'etag': info.etag, 'mtime': int(info.mtime)}, timeout=timeout)
+
+
+def invalidate_validators(video_id):
+    cache.delete(_validator_cache_key(video_id))
+
+
+def store_file_validators(video, info=None):
+    """
+    Сохраняет размер, mtime, inode и имя файла видео на модели и прогревает кэш валидаторов.
+    Вызывается при завершении скачивания/загрузки, при замене файла в edit_video,
+    а также из stream_video, если файл на диске изменился. Возвращает MediaFileInfo или None.
+    """
+    if info is None:
+        if not video.file:
+            return None
+        info = MediaFileInfo.from_path(video_file_path(video))
+        if info is None:
+            return None
+    name = video.file.name if video.file else ''
+    current = (video.file_size, video.file_mtime, video.file_inode, video.file_validated_name)
+    if current != (info.size, info.mtime, info.inode, name):
+        video.file_size = info.size
+        video.file_mtime = info.mtime
+        video.file_inode = info.inode
+        video.file_validated_name = name
+        type(video).objects.filter(pk=video.pk).update(
+            file_size=info.size, file_mtime=info.mtime, file_inode=info.inode, file_validated_name=name
+        )
+    cache_validators(video.pk, info)
+    return info
+
+
+def forget_file_validators(video):
+    """Сбрасывает сохраненные валидаторы, если файла по ним больше нет"""
+    video.file_size = video.file_mtime = video.file_inode = None
+    video.file_validated_name = ''
+    type(video).objects.filter(pk=video.pk).update(
+        file_size=None, file_mtime=None, file_inode=None, file_validated_name=''
+    )
+    invalidate_validators(video.pk)
+
+
+def not_modified_response(request, etag, mtime):
+    """
+    Обработка If-None-Match / If-Modified-Since (и If-Match / If-Unmodified-Since).
+    Возвращает 304/412 с валидаторами или None, если нужно отдавать тело.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    response = get_conditional_response(request, etag=etag, last_modified=int(mtime))
+    if response is not None:
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(int(mtime))
+        response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def cached_not_modified_response(request, video_id):
+    """Быстрый путь: 304 по теплому кэшу валидаторов, до обращения к БД"""
+    if not (request.META.get('HTTP_IF_NONE_MATCH') or request.META.get('HTTP_IF_MODIFIED_SINCE')):
+        return None
+    validators = cache.get(_validator_cache_key(video_id))
+    if not validators:
+        return None
+    response = not_modified_response(request, validators['etag'], validators['mtime'])
+    # 412 по устаревшему кэшу не отдаем - пусть решит полный путь
+    if response is not None and response.status_code == 304:
+        return response
+    return None
+
+
+def parse_range_header(header, size):
+    """
+    Разбирает заголовок Range по RFC 7233.
+
+    Returns:
+        list[tuple[int, int]] | None: список диапазонов (start, end) включительно,
+        либо None, если заголовок отсутствует/некорректен и нужно отдать файл целиком.
+
+    Raises:
+        RangeNotSatisfiable: если ни один диапазон не пересекается с файлом.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        m = RANGE_RE.match(part)
+        if not m:
+            return None
+        first, last = m.groups()
+        if first == '' and last == '':
+            return None
+        if first == '':
+            # Суффиксный диапазон: последние N байт
+            suffix = int(last)
+            if suffix == 0:
+                continue
+            start = max(size - suffix, 0)
+            end = size - 1
+        else:
+            start = int(first)
+            end = int(last) if last != '' else size - 1
+            if end < start:
+                return None
+            if start >= size:
+                continue
+            end = min(end, size - 1)
+        ranges.append((start, end))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+    return _coalesce_ranges(ranges)
+
+
+def _coalesce_ranges(ranges):
+    """Сливает пересекающиеся и соседние диапазоны, чтобы не отдавать одни и те же байты дважды"""
+    if len(ranges) == 1:
+        return ranges
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_matches(request, info):
+    """
+    Проверка If-Range: при несовпадении валидатора Range игнорируется и отдается весь файл.
+    """
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # Слабые ETag в If-Range не допускаются
+        return if_range == info.etag
+    timestamp = parse_http_date_safe(if_range)
+    return timestamp is not None and timestamp == int(info.mtime)
+
+
+class RangedFile:
+    """
+    Файлоподобная обертка, ограничивающая чтение диапазоном [start, start + length).
+
+    fileno() пробрасывается наружу, поэтому wsgi.file_wrapper сервера (gunicorn, uWSGI)
+    может отдать диапазон через os.sendfile() со смещения, выставленного seek(),
+    ограничившись Content-Length. Если file_wrapper нет, Django читает блоками через read().
+    """
+
+    def __init__(self, fh, start, length):
+        self._fh = fh
+        self._remaining = length
+        self._fh.seek(start)
+        self.name = getattr(fh, 'name', None)
+
+    def read(self, size=-1):
+        if self._remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._fh.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self._fh.fileno()
+
+    # seek()/tell() намеренно не реализованы: иначе FileResponse сам пересчитает
+    # Content-Length до конца файла и сдвинет позицию
+
+    def close(self):
+        self._fh.close()
+
+
+def _iter_multipart(info, ranges, boundary):
+    """Генератор тела multipart/byteranges для нескольких диапазонов"""
+    with open(info.path, 'rb') as fh:
+        for start, end in ranges:
+            yield (
+                f'\r\n--{boundary}\r\n'
+                f'Content-Type: {info.content_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{info.size}\r\n\r\n'
+            ).encode('ascii')
+            fh.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                block = fh.read(min(STREAM_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                yield block
+        yield f'\r\n--{boundary}--\r\n'.encode('ascii')
+
+
+def _multipart_length(info, ranges, boundary):
+    length = 0
+    for start, end in ranges:
+        length += len((
+            f'\r\n--{boundary}\r\n'
+            f'Content-Type: {info.content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{info.size}\r\n\r\n'
+        ).encode('ascii'))
+        length += end - start + 1
+    length += len(f'\r\n--{boundary}--\r\n'.encode('ascii'))
+    return length
+
+
+def _offload_response(info, mode):
+    """
+    Передает отдачу файла фронтенд-серверу (nginx X-Accel-Redirect / Apache, lighttpd X-Sendfile).
+    Range, If-Range и sendfile в этом случае обрабатывает сам фронтенд.
+    """
+    response = HttpResponse(content_type=info.content_type)
+    if mode == 'x-accel':
+        relative = os.path.relpath(info.path, settings.MEDIA_ROOT).replace(os.sep, '/')
+        prefix = getattr(settings, 'VIDEO_STREAM_ACCEL_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + relative
+        response['X-Accel-Buffering'] = 'no'
+    else:
+        response['X-Sendfile'] = info.path
+    rate_limit = getattr(settings, 'VIDEO_STREAM_RATE_LIMIT', None)
+    if rate_limit and mode == 'x-accel':
+        # Ограничение скорости соединения выполняет сам nginx
+        response['X-Accel-Limit-Rate'] = str(int(rate_limit))
+    return response
+
+
+def _apply_common_headers(response, info):
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = info.etag
+    response['Last-Modified'] = info.last_modified
+    response['Content-Disposition'] = f'inline; filename="{os.path.basename(info.path)}"'
+    return response
+
+
+def build_file_response(request, info):
+    """
+    Строит ответ для отдачи медиафайла с поддержкой Range:
+    200 (весь файл), 206 (один диапазон или multipart/byteranges), 416 (диапазон вне файла),
+    304/412 по условным заголовкам.
+
+    Режим VIDEO_STREAM_OFFLOAD ('x-accel' | 'x-sendfile') полностью снимает
+    передачу байтов с воркеров Django.
+    """
+    not_modified = not_modified_response(request, info.etag, info.mtime)
+    if not_modified is not None:
+        return not_modified
+
+    offload = getattr(settings, 'VIDEO_STREAM_OFFLOAD', None)
+    if offload in ('x-accel', 'x-sendfile'):
+        return _apply_common_headers(_offload_response(info, offload), info)
+
+    ranges = None
+    if request.method in ('GET', 'HEAD') and if_range_matches(request, info):
+        try:
+            ranges = parse_range_header(request.META.get('HTTP_RANGE'), info.size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{info.size}'
+            response['Accept-Ranges'] = 'bytes'
+            return response
+
+    max_ranges = getattr(settings, 'VIDEO_STREAM_MAX_RANGES', 16)
+    if ranges and len(ranges) > max_ranges:
+        # Слишком много диапазонов - защищаемся от амплификации, отдаем файл целиком
+        ranges = None
+
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=info.content_type, status=206 if ranges and len(ranges) == 1 else 200)
+        if ranges and len(ranges) == 1:
+            start, end = ranges[0]
+            response['Content-Range'] = f'bytes {start}-{end}/{info.size}'
+            response['Content-Length'] = str(end - start + 1)
+        else:
+            response['Content-Length'] = str(info.size)
+        return _apply_common_headers(response, info)
+
+    if not ranges:
+        response = FileResponse(open(info.path, 'rb'), content_type=info.content_type)
+        response['Content-Length'] = str(info.size)
+        return _apply_common_headers(response, info)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        length = end - start + 1
+        ranged = RangedFile(open(info.path, 'rb'), start, length)
+        response = FileResponse(ranged, status=206, content_type=info.content_type)
+        response.block_size = STREAM_BLOCK_SIZE
+        response['Content-Range'] = f'bytes {start}-{end}/{info.size}'
+        response['Content-Length'] = str(length)
+        return _apply_common_headers(response, info)
+
+    boundary = uuid.uuid4().hex
+    response = StreamingHttpResponse(
+        _iter_multipart(info, ranges, boundary),
+        status=206,
+        content_type=f'multipart/byteranges; boundary={boundary}',
+    )
+    response['Content-Length'] = str(_multipart_length(info, ranges, boundary))
+    _apply_common_headers(response, info)
+    # Content-Disposition для multipart не нужен
+    del response['Content-Disposition']
+    return response
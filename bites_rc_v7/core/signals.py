@@ -1,6 +1,11 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete, m2m_changed
 from django.dispatch import receiver
-from core.models import Video, Tag
+from core.models import Video, Tag, Like, Dislike, Comment
+from core.services.engagement_counters import EngagementCounters
+from core.services.recommendation_index import RecommendationIndex
+from core.services.video_embeddings import video_embedding_index
+from core.services.video_search import VideoSearch
 from django.utils.text import slugify
 import logging
 
@@ -40,3 +45,127 @@ def generate_tags_on_video_save(sender, instance, created, **kwargs):
             
         except Exception as e:
             logger.error(f"Error in generate_tags_on_video_save for video {instance.id}: {str(e)}")
+
+
+@receiver(post_save, sender=Like)
+def count_like_added(sender, instance, created, **kwargs):
+    if created:
+        EngagementCounters.like_changed(instance.video_id, 1)
+
+
+@receiver(post_delete, sender=Like)
+def count_like_removed(sender, instance, **kwargs):
+    EngagementCounters.like_changed(instance.video_id, -1)
+
+
+@receiver(post_save, sender=Dislike)
+def count_dislike_added(sender, instance, created, **kwargs):
+    if created:
+        EngagementCounters.dislike_changed(instance.video_id, 1)
+
+
+@receiver(post_delete, sender=Dislike)
+def count_dislike_removed(sender, instance, **kwargs):
+    EngagementCounters.dislike_changed(instance.video_id, -1)
+
+
+@receiver(pre_save, sender=Comment)
+def remember_comment_sentiment(sender, instance, **kwargs):
+    """Запоминаем прежнюю тональность, чтобы переоценка сдвинула суммы на дельту"""
+    if not instance._state.adding and instance.pk:
+        instance._previous_sentiment = (
+            Comment.objects.filter(pk=instance.pk).values_list('sentiment', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Comment)
+def count_comment_saved(sender, instance, created, **kwargs):
+    if created:
+        EngagementCounters.comment_changed(instance.video_id, instance.sentiment, instance.created_at, 1)
+        return
+    previous = getattr(instance, '_previous_sentiment', None)
+    if previous is not None:
+        EngagementCounters.sentiment_changed(instance, previous)
+        instance._previous_sentiment = instance.sentiment
+
+
+@receiver(post_delete, sender=Comment)
+def count_comment_removed(sender, instance, **kwargs):
+    EngagementCounters.comment_changed(instance.video_id, instance.sentiment, instance.created_at, -1)
+
+
+# Поля, от которых зависят вектор видео и полнотекстовый индекс
+TEXT_FIELDS = ('title', 'description')
+
+
+@receiver(pre_save, sender=Video)
+def remember_video_text(sender, instance, update_fields=None, **kwargs):
+    """Вектор и поисковый индекс видео обновляются только при изменении названия или описания"""
+    if update_fields is not None and not set(update_fields) & set(TEXT_FIELDS):
+        instance._text_changed = False
+        return
+    if instance._state.adding or not instance.pk:
+        instance._text_changed = True
+        return
+    previous = Video.objects.filter(pk=instance.pk).values_list(*TEXT_FIELDS).first()
+    instance._text_changed = previous != (instance.title, instance.description)
+
+
+def _index_text(video_id, deleted=False):
+    """Полнотекстовый индекс обновляется после коммита: ошибка индекса не откатывает сохранение"""
+    def index():
+        try:
+            if deleted:
+                VideoSearch.remove_videos([video_id])
+            else:
+                VideoSearch.index_videos([video_id])
+        except Exception as e:
+            logger.error(f"[VIDEO_SEARCH_ERROR] Indexing failed for video {video_id}: {e}")
+    transaction.on_commit(index)
+
+
+@receiver(post_save, sender=Video)
+def index_saved_video_text(sender, instance, created, **kwargs):
+    if created or getattr(instance, '_text_changed', False):
+        instance._text_changed = False
+        video_id = instance.pk
+        transaction.on_commit(lambda: video_embedding_index.schedule(video_id))
+        _index_text(video_id)
+
+
+def _reindex_tags(video_ids, tag_ids):
+    """Сброс индекса рекомендаций после коммита, чтобы не закэшировать старые связи"""
+    def reindex():
+        try:
+            RecommendationIndex.tags_changed(video_ids, tag_ids)
+        except Exception as e:
+            logger.error(f"[RECOMMENDATION_INDEX_ERROR] Invalidation failed for videos {video_ids}: {e}")
+    transaction.on_commit(reindex)
+
+
+@receiver(m2m_changed, sender=Video.tags.through)
+def reindex_video_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # После очистки связи уже не прочитать
+        related = instance.videos if reverse else instance.tags
+        instance._cleared_related_ids = list(related.values_list('pk', flat=True))
+        return
+    if action == 'post_clear':
+        related_ids = getattr(instance, '_cleared_related_ids', [])
+    elif action in ('post_add', 'post_remove'):
+        related_ids = list(pk_set or ())
+    else:
+        return
+    if reverse:
+        _reindex_tags(related_ids, [instance.pk])
+    else:
+        _reindex_tags([instance.pk], related_ids)
+
+
+@receiver(pre_delete, sender=Video)
+def reindex_deleted_video(sender, instance, **kwargs):
+    _reindex_tags([instance.pk], list(instance.tags.values_list('pk', flat=True)))
+    # Обработчик увидит, что видео больше нет, и удалит его вектор
+    video_id = instance.pk
+    transaction.on_commit(lambda: video_embedding_index.schedule(video_id))
+    _index_text(video_id, deleted=True)
@@ -0,0 +1,114 @@
+import logging
+from celery import shared_task
+from core.models import Video
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True, max_retries=2, soft_time_limit=3300, time_limit=3600)
+def package_video_hls(self, video_id):
+    """
+    Задача Celery для упаковки видео в многобитрейтный HLS
+
+    Args:
+        video_id: ID видео в нашей системе
+    """
+    from core.services.hls_packaging import HlsPackagingService
+
+    video = Video.objects.filter(pk=video_id).first()
+    if not video or not video.file:
+        logger.warning(f"[HLS_TASK_SKIP] Video {video_id} not found or has no file")
+        return {'success': False, 'error': 'Video has no file'}
+
+    try:
+        master = HlsPackagingService.package(video)
+        return {'success': True, 'video_id': video_id, 'master': master}
+    except Exception as e:
+        logger.error(f"[HLS_TASK_ERROR] Packaging failed for video {video_id}: {e}", exc_info=True)
+        Video.objects.filter(pk=video_id).update(hls_status='failed')
+        if self.request.retries < self.max_retries:
+            raise self.retry(countdown=120 * (2 ** self.request.retries), exc=e)
+        return {'success': False, 'video_id': video_id, 'error': str(e)}
+
+
+@shared_task
+def cleanup_stale_uploads():
+    """Удаляет незавершенные возобновляемые загрузки и их временные файлы"""
+    from core.services.chunked_upload import ChunkedUploadService
+
+    removed = ChunkedUploadService.cleanup_stale()
+    return {'success': True, 'removed': removed}
+
+
+@shared_task
+def rescale_sentiment_weights():
+    """Сдвигает точку отсчета весов тональности комментариев к текущей дате"""
+    from core.services.rating_engine import RatingEngine
+
+    updated = RatingEngine.rescale_sentiment_weights()
+    return {'success': True, 'updated': updated}
+
+
+@shared_task(bind=True, soft_time_limit=3300, time_limit=3600)
+def rescore_all_videos(self):
+    """Массовый векторный пересчет абсолютного рейтинга всех видео с отчетом о прогрессе"""
+    from django.core.cache import cache
+    from core.services.rating_engine import (
+        RatingEngine, RESCORE_LOCK_KEY, RESCORE_LOCK_TIMEOUT, RESCORE_PROGRESS_KEY
+    )
+
+    def report(done, total, status='running'):
+        state = {'status': status, 'done': done, 'total': total, 'task_id': self.request.id}
+        cache.set(RESCORE_PROGRESS_KEY, state, RESCORE_LOCK_TIMEOUT)
+        self.update_state(state='PROGRESS', meta=state)
+
+    try:
+        report(0, 0)
+        count = RatingEngine.bulk_rescore(progress=report)
+        cache.set(RESCORE_PROGRESS_KEY, {'status': 'complete', 'done': count, 'total': count,
+                                         'task_id': self.request.id}, RESCORE_LOCK_TIMEOUT)
+        return {'success': True, 'rescored': count}
+    except Exception as e:
+        logger.error(f"[RATING_BULK_RESCORE_ERROR] Bulk rescore failed: {e}", exc_info=True)
+        cache.set(RESCORE_PROGRESS_KEY, {'status': 'failed', 'error': str(e), 'task_id': self.request.id},
+                  RESCORE_LOCK_TIMEOUT)
+        return {'success': False, 'error': str(e)}
+    finally:
+        cache.delete(RESCORE_LOCK_KEY)
+
+
+@shared_task
+def process_interaction_effect(kind, key):
+    """Объединенный побочный эффект взаимодействия: пересчет рейтинга видео или кармы"""
+    from core.services.interaction_effects import InteractionEffects
+
+    result = InteractionEffects.process(kind, key)
+    return {'success': result is not None, 'kind': kind, 'key': key, 'result': result}
+
+
+@shared_task(soft_time_limit=1800, time_limit=1900)
+def rebuild_transition_graph():
+    """Полный пересчет списков "смотреть далее" по графу переходов с затуханием"""
+    from core.services.transition_graph import TransitionGraph
+
+    videos = TransitionGraph.rebuild()
+    return {'success': True, 'videos': videos}
+
+
+@shared_task(soft_time_limit=1800, time_limit=1860)
+def train_video_embedding_index():
+    """Переобучение центроидов IVF семантического индекса, если он заметно вырос"""
+    from core.services.video_embeddings import video_embedding_index
+
+    if not video_embedding_index.needs_training():
+        return {'success': True, 'lists': 0}
+    return {'success': True, 'lists': video_embedding_index.train()}
+
+
+@shared_task(soft_time_limit=600, time_limit=660)
+def refine_comment_sentiment():
+    """Страховочный проход воркера тональности по комментариям с провизорной оценкой"""
+    from core.services.comment_sentiment import refine_pending_comments
+
+    processed = refine_pending_comments()
+    return {'success': True, 'processed': processed}
@@ -20,6 +20,9 @@ urlpatterns = [
     path('video/<int:pk>/edit/', views.edit_video, name='edit_video'),
     path('video/<int:pk>/delete/', views.delete_video, name='delete_video'),
     path('upload/', views.upload_video, name='upload_video'),
+    path('api/uploads/', views.chunked_upload_init, name='chunked_upload_init'),
+    path('api/uploads/<uuid:upload_id>/', views.chunked_upload_chunk, name='chunked_upload_chunk'),
+    path('api/uploads/<uuid:upload_id>/finalize/', views.chunked_upload_finalize, name='chunked_upload_finalize'),
     path('random-video/', views.random_video, name='random_video'),
     path('recalculate-ratings/', views.recalculate_all_ratings, name='recalculate_all_ratings'),
     path('regenerate-all-tags/', views.regenerate_all_tags, name='regenerate_all_tags'),
@@ -60,6 +63,11 @@ urlpatterns = [
     path('api/video/<str:video_id>/download-status/', views.get_video_download_status, name='video_download_status'),
     path('api/video/<str:video_id>/download/', views.add_to_download_queue, name='add_to_download_queue'),
     path('api/random-ad/', views.api_random_ad, name='api_random_ad'),
+    path('api/video/<int:pk>/up-next/', views.up_next, name='up_next'),
+    path('api/stream-metrics/', views.stream_metrics, name='stream_metrics'),
+    path('api/rating-rescore-status/', views.rating_rescore_status, name='rating_rescore_status'),
+    path('api/interaction-effects-metrics/', views.interaction_effects_metrics, name='interaction_effects_metrics'),
+    path('api/transition-buffer-metrics/', views.transition_buffer_metrics, name='transition_buffer_metrics'),
     path('video/<int:video_id>/generate-tags/', views.generate_tags, name='generate_tags'),
     path('register-transition/', views.register_video_transition, name='register_video_transition'),
 ] 
\ No newline at end of file
@@ -2,35 +2,50 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.http import StreamingHttpResponse, HttpResponse, HttpResponseServerError, FileResponse, JsonResponse
+from django.http import StreamingHttpResponse, HttpResponse, HttpResponseServerError, JsonResponse
 from django.conf import settings
 from django.core.cache import cache
-from django.views.decorators.http import condition, require_POST, require_GET
+from django.views.decorators.http import require_POST, require_GET
 from django.utils import timezone
 from django.views.decorators.gzip import gzip_page
-from django.db.models import Count, Avg, F, Q, Subquery, OuterRef
+from django.db import transaction
+from django.db.models import Count, Avg, Sum, F
 from django.contrib import messages
 from wsgiref.util import FileWrapper
 import os
-import re
-import mimetypes
 import time
 import json
 import random
 import math
 import logging
-from datetime import datetime, timedelta
-from supabase import create_client, Client
-from .models import Video, Like, Dislike, Comment, Channel, UserProfile, Subscription, Ad, VideoTransition
+from functools import lru_cache
+from .models import Video, Like, Dislike, Comment, Channel, UserProfile, Subscription, Ad, ChunkedUpload
 from .forms import VideoUploadForm, CommentForm, UserProfileForm, ChannelForm, AdForm, YouTubeImportSettingsForm
 from django.urls import reverse
-from django.core.exceptions import ValidationError, FieldError
+from django.core.exceptions import ValidationError
 from .services.tag_service import generate_tags_for_video
+from .services.video_streaming import (
+    MediaFileInfo, build_file_response, cached_not_modified_response,
+    not_modified_response, store_file_validators, cache_validators, invalidate_validators,
+    forget_file_validators, video_file_path
+)
+from .services.hls_packaging import HlsPackagingService
+from .services.thumbnail_service import ThumbnailService
+from .services.stream_governor import stream_governor
+from .services.chunked_upload import (
+    ChunkedUploadService, ChunkedUploadError, run_file_replaced_pipeline, run_upload_pipeline
+)
+from .services.rating_engine import RatingEngine
+from .services.karma_service import KarmaService
+from .services.interaction_effects import InteractionEffects
+from .services.recommendation_index import RecommendationIndex
+from .services.transition_graph import TransitionGraph
+from .services.transition_buffer import transition_buffer
+from .services.video_search import VideoSearch
+from .services.sentiment_service import provisional_comment_sentiment
 from decimal import Decimal
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.views.static import serve
-from youtube_api.services import YouTubeService
 
 # Инициализация логгера
 logger = logging.getLogger(__name__)
@@ -50,15 +65,13 @@ def register_video_transition(request):
     if not (from_id and to_id):
         return JsonResponse({'success': False, 'status': 400})
     try:
-        from_video = Video.objects.get(pk=from_id)
-        to_video = Video.objects.get(pk=to_id)
-        transition, created = VideoTransition.objects.get_or_create(from_video=from_video, to_video=to_video)
-        transition.count += 1
-        transition.save()
-        logger.info(f"Transition from video {from_video.pk} to {to_video.pk} {'created' if created else 'updated'}. New count: {transition.count}")
-        return JsonResponse({'success': True, 'count': transition.count})
-    except Video.DoesNotExist:
-        return JsonResponse({'success': False, 'error': f'Video with id {from_id} or {to_id} not found.'}, status=404)
+        from_id, to_id = int(from_id), int(to_id)
+    except ValueError:
+        return JsonResponse({'success': False, 'status': 400})
+    # Клик копится в буфере процесса и пишется пакетом (TransitionBuffer);
+    # переходы между несуществующими видео отбрасываются при записи
+    transition_buffer.add(from_id, to_id)
+    return JsonResponse({'success': True, 'queued': True}, status=202)
 
 
 @login_required
@@ -146,8 +159,25 @@ def direct_seek_log(request):
         logger.error(f"Error tracking seek: {e}")
         return JsonResponse({'error': str(e)}, status=500)
 
-# Initialize Supabase client
-supabase: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_ANON_KEY)
+@lru_cache(maxsize=None)
+def get_supabase():
+    """Supabase client, created on first use (the SDK is slow to import)"""
+    from supabase import create_client
+    return create_client(settings.SUPABASE_URL, settings.SUPABASE_ANON_KEY)
+
+def _search_page(query, page, per_page):
+    """Страница результатов полнотекстового поиска: пагинация по id, видео одним запросом"""
+    paginator = Paginator(VideoSearch.search(query), per_page)
+    try:
+        videos = paginator.page(page)
+    except PageNotAnInteger:
+        videos = paginator.page(1)
+    except EmptyPage:
+        videos = paginator.page(paginator.num_pages)
+    page_ids = list(videos.object_list)
+    videos_by_id = Video.objects.select_related('channel', 'uploaded_by').in_bulk(page_ids)
+    videos.object_list = [videos_by_id[pk] for pk in page_ids if pk in videos_by_id]
+    return paginator, videos
 
 def home(request):
     search_query = request.GET.get('q', '')
@@ -155,17 +185,16 @@ def home(request):
     page = request.GET.get('page', 1)
     
     if search_query:
-        video_list = Video.objects.filter(title__icontains=search_query).order_by('-absolute_rating', '-upload_date')
+        paginator, videos = _search_page(search_query, page, 12)
     else:
         video_list = Video.objects.all().order_by('-absolute_rating', '-upload_date')
-    
-    paginator = Paginator(video_list, 12)
-    try:
-        videos = paginator.page(page)
-    except PageNotAnInteger:
-        videos = paginator.page(1)
-    except EmptyPage:
-        videos = paginator.page(paginator.num_pages)
+        paginator = Paginator(video_list, 12)
+        try:
+            videos = paginator.page(page)
+        except PageNotAnInteger:
+            videos = paginator.page(1)
+        except EmptyPage:
+            videos = paginator.page(paginator.num_pages)
     
     # Преобразуем в список для вставки рекламы
     video_items = list(videos.object_list)
@@ -240,7 +269,7 @@ def register(request):
                 return render(request, 'core/register.html', {'error': 'Username already taken'})
             
             # Register user with Supabase
-            response = supabase.auth.sign_up({
+            response = get_supabase().auth.sign_up({
                 'email': email,
                 'password': password,
                 'options': {
@@ -287,7 +316,7 @@ def login_view(request):
             
             # Try to authenticate with Supabase using user's email
             try:
-                response = supabase.auth.sign_in_with_password({
+                response = get_supabase().auth.sign_in_with_password({
                     'email': user.email,
                     'password': password
                 })
@@ -311,7 +340,7 @@ def login_view(request):
 def logout_view(request):
     # First sign out from Supabase
     try:
-        supabase.auth.sign_out()
+        get_supabase().auth.sign_out()
     except Exception as e:
         # Log the error but continue with Django logout
         print(f"Error signing out from Supabase: {e}")
@@ -459,17 +488,14 @@ def upload_video(request):
                     video.channel = user_channel
                 
                 video.save()
-                
-                # Обработка тегов
-                if form.cleaned_data.get('tags'):
-                    tags_list = [tag.strip() for tag in form.cleaned_data['tags'].split(',') if tag.strip()]
-                    for tag_name in tags_list:
-                        video.add_tag(tag_name)
-                
-                # Автоматическая генерация тегов, если отмечено
-                if form.cleaned_data.get('auto_generate_tags'):
-                    generate_tags_for_video(video)
-                
+
+                # Валидаторы файла, превью, теги и фоновая упаковка в HLS
+                run_upload_pipeline(
+                    video,
+                    tags=form.cleaned_data.get('tags'),
+                    auto_generate_tags=form.cleaned_data.get('auto_generate_tags')
+                )
+
                 messages.success(request, 'Видео успешно загружено')
                 return redirect('core:video_detail', pk=video.pk)
     else:
@@ -484,26 +510,107 @@ def upload_video(request):
         'youtube_error': youtube_error
     })
 
+def _chunked_upload_state(upload):
+    return {
+        'upload_id': str(upload.pk),
+        'offset': upload.offset,
+        'size': upload.total_size,
+        'status': upload.status,
+        'chunk_size': ChunkedUploadService.max_chunk_size(),
+        'video_id': upload.video_id,
+    }
+
+
+@login_required
+@require_POST
+def chunked_upload_init(request):
+    """Создает сессию возобновляемой загрузки"""
+    try:
+        data = json.loads(request.body)
+        upload = ChunkedUploadService.init_upload(request.user, data)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except ChunkedUploadError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+    return JsonResponse(_chunked_upload_state(upload), status=201)
+
+
+@login_required
+def chunked_upload_chunk(request, upload_id):
+    """
+    GET - текущее состояние (offset для продолжения после обрыва),
+    PUT ?offset=N - очередной чанк в теле запроса с заголовком X-Chunk-Sha256
+    """
+    upload = get_object_or_404(ChunkedUpload, pk=upload_id, user=request.user)
+    if request.method == 'GET':
+        return JsonResponse(_chunked_upload_state(upload))
+    if request.method != 'PUT':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    try:
+        offset = int(request.GET.get('offset', upload.offset))
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid offset'}, status=400)
+    try:
+        # Тело читается потоком (request.read), request.body не трогаем
+        ChunkedUploadService.append_chunk(upload, offset, request, length, request.META.get('HTTP_X_CHUNK_SHA256'))
+    except ChunkedUploadError as e:
+        state = _chunked_upload_state(upload)
+        state['error'] = str(e)
+        return JsonResponse(state, status=e.status)
+    return JsonResponse(_chunked_upload_state(upload))
+
+
+@login_required
+@require_POST
+def chunked_upload_finalize(request, upload_id):
+    """Собирает видео из принятых чанков и запускает обработку"""
+    upload = get_object_or_404(ChunkedUpload, pk=upload_id, user=request.user)
+    try:
+        video = ChunkedUploadService.finalize(upload)
+    except ChunkedUploadError as e:
+        state = _chunked_upload_state(upload)
+        state['error'] = str(e)
+        return JsonResponse(state, status=e.status)
+    state = _chunked_upload_state(upload)
+    state['video_url'] = reverse('core:video_detail', kwargs={'pk': video.pk})
+    return JsonResponse(state)
+
 def close_file(self):
     """Helper function to close file handle after streaming"""
     if hasattr(self, '_file'):
         self._file.close()
 
 def stream_video(request, pk):
+    # Теплый кэш валидаторов: повторная валидация CDN/браузером обходится без БД и stat()
+    not_modified = cached_not_modified_response(request, pk)
+    if not_modified is not None:
+        return not_modified
+
     video = get_object_or_404(Video, pk=pk)
     logger = logging.getLogger(__name__)
-    
-    # Проверяем, есть ли файл в базе данных и доступен ли он физически
-    physical_file_exists = False
-    if video.file:
-        file_path = os.path.join(settings.MEDIA_ROOT, str(video.file))
-        physical_file_exists = os.path.isfile(file_path) and os.path.getsize(file_path) > 0
-        logger.info(f"[STREAM_VIDEO] Video {pk} physical file exists: {physical_file_exists}, path: {file_path}")
-    
+
+    # Валидаторы, сохраненные при завершении скачивания, позволяют ответить 304 без stat()
+    stored_info = MediaFileInfo.from_video(video) if video.is_downloaded else None
+    if stored_info is not None:
+        not_modified = not_modified_response(request, stored_info.etag, stored_info.mtime)
+        if not_modified is not None and not_modified.status_code == 304:
+            cache_validators(video.pk, stored_info)
+            return not_modified
+
+    # Проверяем, есть ли файл: сохраненные валидаторы избавляют от stat(),
+    # иначе файл проверяется одним stat на запрос
+    file_info = stored_info
+    if file_info is None and video.file:
+        file_path = video_file_path(video)
+        file_info = MediaFileInfo.from_path(file_path)
+        logger.info(f"[STREAM_VIDEO] Video {pk} physical file exists: {file_info is not None}, path: {file_path}")
+    physical_file_exists = file_info is not None
+
     # Если файл существует и доступен, устанавливаем is_downloaded = True если ещё не установлено
     if physical_file_exists and not video.is_downloaded:
-        video.is_downloaded = True
-        video.save(update_fields=['is_downloaded'])
+        Video.objects.filter(pk=video.pk, is_downloaded=False).update(is_downloaded=True)
         logger.info(f"[STREAM_VIDEO] Updated video {pk} is_downloaded status to True")
     
     # Если файла нет в модели или он недоступен физически
@@ -557,28 +664,43 @@ def stream_video(request, pk):
                 'youtube_id': video.youtube_id,
                 'youtube_url': f'https://www.youtube.com/watch?v={video.youtube_id}'
             })
-            
+
+        return JsonResponse({'status': 'error', 'message': 'Видеофайл не найден'}, status=404)
+
     # Если файл существует физически, отдаем его
     try:
-        file_path = video.file.path
-        logger.info(f"[STREAM_VIDEO] Serving video file: {file_path}")
-        
-        # Проверяем запрос Range для поддержки перемотки
-        content_type = mimetypes.guess_type(file_path)[0] or 'video/mp4'
-        response = FileResponse(open(file_path, 'rb'), content_type=content_type)
-        
-        # Добавляем заголовки для поддержки перемотки
-        response['Accept-Ranges'] = 'bytes'
-        response['Content-Disposition'] = f'inline; filename="{os.path.basename(file_path)}"'
-        return response
+        logger.info(f"[STREAM_VIDEO] Serving video file: {file_info.path}")
+        store_file_validators(video, file_info)
+
+        # Range/If-Range, 206/416 и отдача через sendfile или X-Accel-Redirect
+        response = build_file_response(request, file_info)
+        if not response.streaming:
+            # 304/416/HEAD и X-Accel-Redirect не занимают воркер передачей байтов
+            return response
+
+        # Лимиты одновременных отдач и справедливая очередь
+        ticket = stream_governor.acquire(video.pk)
+        if ticket is None:
+            response.close()
+            logger.warning(f"[STREAM_VIDEO] Stream slot for video {pk} not acquired, returning 503")
+            busy = JsonResponse({'status': 'busy', 'message': 'Сервер перегружен, повторите позже'}, status=503)
+            busy['Retry-After'] = str(getattr(settings, 'VIDEO_STREAM_RETRY_AFTER', 5))
+            return busy
+        return stream_governor.govern(response, ticket)
+    except FileNotFoundError:
+        # Файл удален мимо приложения - валидаторы устарели, следующий запрос проверит диск
+        logger.warning(f"[STREAM_VIDEO] File for video {pk} disappeared: {file_info.path}")
+        forget_file_validators(video)
+        return JsonResponse({'status': 'error', 'message': 'Видеофайл не найден'}, status=404)
     except Exception as e:
         logger.error(f"[STREAM_VIDEO] Error serving video file for video {pk}: {e}")
         return JsonResponse({'status': 'error', 'message': 'Ошибка при отдаче видеофайла'}, status=500)
 
 def video_detail(request, pk):
     video = get_object_or_404(Video, pk=pk)
+    # Атомарный инкремент: save() перезаписал бы счетчики, обновленные параллельно
+    Video.objects.filter(pk=pk).update(views=F('views') + 1)
     video.views += 1
-    video.save()
     
     # Track analytics for authenticated users
     if request.user.is_authenticated:
@@ -643,82 +765,39 @@ def video_detail(request, pk):
     if not getattr(video, 'is_ad', False):
         video.time_elapsed = calculate_time_elapsed(video.upload_date)
     
-    # Get recommended videos (by tags) - видео похожие по тегам, максимум 8 видео
+    # Рекомендации и похожие видео - одним обращением к индексу по тегам
     RECOMMENDED_VIDEOS_LIMIT = 8
-    
-    if video.tags.exists():
-        video_tags = video.tags.all()
-        
-        # Аннотируем количество переходов
-        transitions = VideoTransition.objects.filter(
-            from_video=video,
-            to_video=OuterRef('pk')
-        ).values('count')
-        
-        recommended_videos_queryset = Video.objects.filter(
-            tags__in=video_tags
-        ).exclude(pk=video.pk).distinct().annotate(
-            transition_count=Subquery(transitions)
-        )
-        
-        # Получаем все подходящие видео
-        all_recommended_videos = list(recommended_videos_queryset)
-
-        video_info_before_sort = [(v.pk, v.transition_count) for v in all_recommended_videos]
-        logger.info(f"Recommended videos for video {pk} before sorting (pk, transition_count): {video_info_before_sort}")
-
-        # Сортируем по количеству совпадающих тегов (наиболее релевантные сначала)
-        recommended_videos = sorted(
-            all_recommended_videos,
-            key=lambda v: (v.transition_count or 0, sum(1 for tag in video_tags if tag in v.tags.all()), v.absolute_rating),
-            reverse=True
-        )[:RECOMMENDED_VIDEOS_LIMIT]  # Ограничиваем количество видео
+    items_per_page = 12  # Количество похожих видео на страницу
+    recommendations = RecommendationIndex.for_video(video.pk)
 
-        video_info_after_sort = [(v.pk, v.transition_count) for v in recommended_videos]
-        logger.info(f"Recommended videos for video {pk} after sorting (pk, transition_count): {video_info_after_sort}")
-
-        # Добавляем time_elapsed для каждого видео
-        for rec_video in recommended_videos:
-            rec_video.time_elapsed = calculate_time_elapsed(rec_video.upload_date)
-    else:
-        # Если у видео нет тегов, показываем популярные видео
-        recommended_videos = Video.objects.exclude(pk=video.pk).order_by('-absolute_rating', '-upload_date')[:RECOMMENDED_VIDEOS_LIMIT]
-        for rec_video in recommended_videos:
-            rec_video.time_elapsed = calculate_time_elapsed(rec_video.upload_date)
-    
-    # Get similar videos by tags with pagination
     similar_videos = []
-    similar_videos_page = request.GET.get('similar_page', 1)
-    items_per_page = 12  # Количество видео на страницу
-    
-    if video.tags.exists():
-        video_tags = video.tags.all()
-        similar_videos_queryset = Video.objects.filter(tags__in=video_tags).exclude(pk=video.pk).distinct()
-        
-        # Получаем все подходящие видео (до 666)
-        all_similar_videos = list(similar_videos_queryset)
-        
-        # Сортируем по количеству совпадающих тегов (наиболее релевантные сначала)
-        all_similar_videos = sorted(
-            all_similar_videos,
-            key=lambda v: sum(1 for tag in video_tags if tag in v.tags.all()),
-            reverse=True
-        )[:666]
-        
-        # Добавляем time_elapsed для каждого видео
-        for sim_video in all_similar_videos:
-            sim_video.time_elapsed = calculate_time_elapsed(sim_video.upload_date)
-        
-        # Создаем пагинатор
-        paginator = Paginator(all_similar_videos, items_per_page)
-        
+    similar_page_ids = []
+    if recommendations['similar']:
+        paginator = Paginator(recommendations['similar'], items_per_page)
         try:
-            similar_videos = paginator.page(similar_videos_page)
+            similar_videos = paginator.page(request.GET.get('similar_page', 1))
         except PageNotAnInteger:
             similar_videos = paginator.page(1)
         except EmptyPage:
             similar_videos = paginator.page(paginator.num_pages)
-    
+        similar_page_ids = list(similar_videos.object_list)
+
+    recommended_ids = recommendations['recommended'][:RECOMMENDED_VIDEOS_LIMIT]
+    videos_by_id = Video.objects.select_related('channel', 'uploaded_by').in_bulk(recommended_ids + similar_page_ids)
+    for listed_video in videos_by_id.values():
+        listed_video.time_elapsed = calculate_time_elapsed(listed_video.upload_date)
+
+    if recommended_ids:
+        recommended_videos = [videos_by_id[pk] for pk in recommended_ids if pk in videos_by_id]
+    else:
+        # Если у видео нет тегов, показываем популярные видео
+        recommended_videos = Video.objects.select_related('channel', 'uploaded_by').exclude(
+            pk=video.pk).order_by('-absolute_rating', '-upload_date')[:RECOMMENDED_VIDEOS_LIMIT]
+        for rec_video in recommended_videos:
+            rec_video.time_elapsed = calculate_time_elapsed(rec_video.upload_date)
+    if similar_page_ids:
+        similar_videos.object_list = [videos_by_id[pk] for pk in similar_page_ids if pk in videos_by_id]
+
     comment_form = CommentForm()
     return render(request, 'core/video_detail.html', {
         'video': video, 
@@ -835,10 +914,13 @@ def profile(request, username):
     # Get user's videos
     videos = Video.objects.filter(uploaded_by=user).order_by('-upload_date')
     
-    # Get stats
-    total_views = sum(video.views for video in videos)
-    total_likes = sum(video.likes.count() for video in videos)
-    total_dislikes = sum(video.dislikes.count() for video in videos)
+    # Get stats from the counter columns in a single query
+    totals = videos.aggregate(
+        total_views=Sum('views'), total_likes=Sum('likes_total'), total_dislikes=Sum('dislikes_total')
+    )
+    total_views = totals['total_views'] or 0
+    total_likes = totals['total_likes'] or 0
+    total_dislikes = totals['total_dislikes'] or 0
     
     # Check if user has a channel
     try:
@@ -935,7 +1017,7 @@ def channel_detail(request, channel_id):
     videos = Video.objects.filter(channel=channel).order_by('-upload_date')
     
     # Get stats
-    total_views = sum(video.views for video in videos)
+    total_views = videos.aggregate(total=Sum('views'))['total'] or 0
     subscriber_count = channel.subscribers.count()
     
     # Check if user is subscribed and if they own the channel
@@ -989,7 +1071,12 @@ def delete_video(request, pk):
         # Delete thumbnail if exists
         if video.thumbnail and os.path.exists(video.thumbnail.path):
             os.remove(video.thumbnail.path)
-        
+        ThumbnailService.remove_variants(video)
+        invalidate_validators(video.pk)
+
+        # Delete HLS renditions
+        HlsPackagingService.remove_stale_builds(video.pk)
+
         video.delete()
         messages.success(request, "Видео успешно удалено")
         
@@ -1013,6 +1100,11 @@ def edit_video(request, pk):
         form = VideoUploadForm(request.POST, request.FILES, instance=video)
         if form.is_valid():
             form.save()
+            if 'file' in form.changed_data:
+                run_file_replaced_pipeline(video)
+            if 'thumbnail' in form.changed_data:
+                # <picture> в карточках берет srcset вариантов, а не сам thumbnail
+                ThumbnailService.replace_variants(video)
             messages.success(request, "Видео успешно обновлено")
             return redirect('core:video_detail', pk=video.pk)
     else:
@@ -1035,12 +1127,8 @@ def subscribe(request, channel_id):
     # Log subscription
     Subscription.objects.get_or_create(user=request.user, channel=channel)
     
-    # Recalculate channel owner's karma
-    try:
-        profile = UserProfile.objects.get(user=channel.owner)
-        profile.calculate_karma()
-    except:
-        pass
+    # Recalculate channel owner's karma (debounced, in background)
+    KarmaService.schedule(channel.owner_id)
     
     return redirect('core:channel_detail', channel_id=channel_id)
 
@@ -1054,102 +1142,48 @@ def unsubscribe(request, channel_id):
     # Remove subscription record
     Subscription.objects.filter(user=request.user, channel=channel).delete()
     
-    # Recalculate channel owner's karma
-    try:
-        profile = UserProfile.objects.get(user=channel.owner)
-        profile.calculate_karma()
-    except:
-        pass
+    # Recalculate channel owner's karma (debounced, in background)
+    KarmaService.schedule(channel.owner_id)
     
     return redirect('core:channel_detail', channel_id=channel_id)
 
-@login_required
-def like_video(request, pk):
-    if not request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        return redirect('core:video_detail', pk=pk)
-        
-    video = get_object_or_404(Video, pk=pk)
-    print(f"Processing like for video {pk} by user {request.user.username}")
-    
-    # Remove dislike if exists
-    dislike_deleted = Dislike.objects.filter(video=video, user=request.user).delete()
-    print(f"Removed dislike: {dislike_deleted}")
-    
-    # Toggle like
-    like, created = Like.objects.get_or_create(video=video, user=request.user)
-    print(f"Like created: {created}")
-    if not created:
-        like.delete()
-        print("Existing like removed")
+def _toggle_reaction(request, pk, model, opposite, flag):
+    """
+    Ставит или снимает реакцию (Like/Dislike) и снимает противоположную.
+    В запросе только запись реакции и F()-счетчики (сигналы); рейтинг видео и
+    карма автора пересчитываются в фоне через объединяющую очередь.
+    """
+    video = get_object_or_404(Video.objects.only('id', 'uploaded_by', 'is_youtube', 'youtube_likes'), pk=pk)
     
-    # Update video rating
-    video.calculate_absolute_rating()
+    with transaction.atomic():
+        opposite.objects.filter(video=video, user=request.user).delete()
+        reaction, created = model.objects.get_or_create(video=video, user=request.user)
+        if not created:
+            reaction.delete()
     
-    # Calculate karma for video uploader
-    try:
-        profile = UserProfile.objects.get(user=video.uploaded_by)
-        profile.calculate_karma()
-    except Exception as e:
-        print(f"Error calculating karma: {e}")
+    InteractionEffects.video_engaged(video.pk, video.uploaded_by_id)
     
-    # Get updated counts
-    likes_count = video.likes_count
-    dislikes_count = video.get_dislikes_count()
-    print(f"Updated counts - likes: {likes_count}, dislikes: {dislikes_count}")
-    
-    response_data = {
+    # Updated counts come from the counter columns
+    video.refresh_from_db(fields=['likes_total', 'dislikes_total', 'absolute_rating'])
+    return JsonResponse({
         'success': True,
-        'likes': likes_count,
-        'dislikes': dislikes_count,
+        'likes': video.likes_count,
+        'dislikes': video.get_dislikes_count(),
         'absolute_rating': video.absolute_rating,
-        'liked': created
-    }
-    print(f"Sending response: {response_data}")
-    return JsonResponse(response_data)
+        flag: created
+    })
+
+@login_required
+def like_video(request, pk):
+    if not request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return redirect('core:video_detail', pk=pk)
+    return _toggle_reaction(request, pk, Like, Dislike, 'liked')
 
 @login_required
 def dislike_video(request, pk):
     if not request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return redirect('core:video_detail', pk=pk)
-        
-    video = get_object_or_404(Video, pk=pk)
-    print(f"Processing dislike for video {pk} by user {request.user.username}")
-    
-    # Remove like if exists
-    like_deleted = Like.objects.filter(video=video, user=request.user).delete()
-    print(f"Removed like: {like_deleted}")
-    
-    # Toggle dislike
-    dislike, created = Dislike.objects.get_or_create(video=video, user=request.user)
-    print(f"Dislike created: {created}")
-    if not created:
-        dislike.delete()
-        print("Existing dislike removed")
-    
-    # Update video rating
-    video.calculate_absolute_rating()
-    
-    # Calculate karma for video uploader
-    try:
-        profile = UserProfile.objects.get(user=video.uploaded_by)
-        profile.calculate_karma()
-    except Exception as e:
-        print(f"Error calculating karma: {e}")
-    
-    # Get updated counts
-    likes_count = video.likes_count
-    dislikes_count = video.get_dislikes_count()
-    print(f"Updated counts - likes: {likes_count}, dislikes: {dislikes_count}")
-    
-    response_data = {
-        'success': True,
-        'likes': likes_count,
-        'dislikes': dislikes_count,
-        'absolute_rating': video.absolute_rating,
-        'disliked': created
-    }
-    print(f"Sending response: {response_data}")
-    return JsonResponse(response_data)
+    return _toggle_reaction(request, pk, Dislike, Like, 'disliked')
 
 @login_required
 def add_comment(request, pk):
@@ -1161,80 +1195,22 @@ def add_comment(request, pk):
             comment.video = video
             comment.user = request.user
             
-            # Автоматическое определение тональности с помощью transformers
+            # Мгновенная оценка по словарю/кэшу; русский текст без явных слов
+            # уточняется моделью в фоне пакетами
             try:
-                # Простая проверка на негативные слова - для английского и русского
-                eng_negative_words = ['fuck', 'shit', 'hate', 'awful', 'terrible', 'bad', 'worst', 'sucks', 'garbage', 'trash']
-                rus_negative_words = ['хуй', 'пизд', 'блядь', 'ебал', 'хуев', 'пидор', 'говн', 'дерьм', 'ненавижу', 'отстой', 'хрень']
-                
-                # Позитивные слова для проверки
-                eng_positive_words = ['good', 'great', 'awesome', 'excellent', 'love', 'best', 'amazing', 'wonderful']
-                rus_positive_words = ['отлично', 'прекрасно', 'круто', 'супер', 'класс', 'обожаю', 'нравится', 'лучший', 'хорош']
-                
-                content_lower = comment.content.lower()
-                
-                # Определяем язык на основе наличия кириллицы
-                has_cyrillic = bool(re.search('[а-яА-Я]', content_lower))
-                
-                # Проверка наличия негативных слов
-                has_negative_words = any(word in content_lower for word in eng_negative_words)
-                if has_cyrillic:
-                    has_negative_words = has_negative_words or any(word in content_lower for word in rus_negative_words)
-                
-                # Проверка наличия позитивных слов
-                has_positive_words = any(word in content_lower for word in eng_positive_words)
-                if has_cyrillic:
-                    has_positive_words = has_positive_words or any(word in content_lower for word in rus_positive_words)
-                
-                if has_negative_words:
-                    comment.sentiment = 0.0  # Явно негативный комментарий
-                elif has_positive_words:
-                    comment.sentiment = 1.0  # Явно позитивный комментарий
-                else:
-                    try:
-                        # Для русского текста используем rubert-sentiment
-                        if has_cyrillic:
-                            try:
-                                tokenizer = AutoTokenizer.from_pretrained("cointegrated/rubert-sentiment")
-                                model = AutoModelForSequenceClassification.from_pretrained("cointegrated/rubert-sentiment")
-                                inputs = tokenizer(content, return_tensors="pt", truncation=True, padding=True)
-                                outputs = model(**inputs)
-                                scores = outputs.logits.softmax(dim=1)
-                                result = scores.tolist()[0]
-                                
-                                # Преобразование результата в значение от 0 до 1
-                                if result[0] > result[1]:  # Негативный сентимент
-                                    sentiment_score = 0.33
-                                else:  # Позитивный сентимент
-                                    sentiment_score = 0.66
-                            except Exception as e:
-                                print(f"Ошибка при анализе сентимента (rubert-sentiment): {str(e)}")
-                                sentiment_score = 0.5
-                    except Exception as inner_e:
-                        print(f"Общая ошибка модели сентимент-анализа: {inner_e}")
-                        # В случае ошибки используем простой анализ текста
-                        if any(word in content_lower for word in (eng_negative_words + rus_negative_words if has_cyrillic else eng_negative_words)):
-                            comment.sentiment = 0.0  # Негативный
-                        elif any(word in content_lower for word in (eng_positive_words + rus_positive_words if has_cyrillic else eng_positive_words)):
-                            comment.sentiment = 1.0  # Позитивный
-                        else:
-                            comment.sentiment = 0.5  # Нейтральный
+                comment.sentiment, comment.sentiment_pending = provisional_comment_sentiment(comment.content)
             except Exception as e:
                 # В случае любой ошибки, обеспечиваем значение по умолчанию
-                print(f"Ошибка сентимент-анализа: {e}")
+                logger.error(f"Ошибка сентимент-анализа: {e}")
                 comment.sentiment = 0.5
             
             comment.save()
+            if comment.sentiment_pending:
+                InteractionEffects.enqueue('sentiment', 'pending')
             
-            # Recalculate video rating
-            video.calculate_absolute_rating()
-            
-            # Calculate karma for comment author
-            try:
-                profile = UserProfile.objects.get(user=request.user)
-                profile.calculate_karma()
-            except:
-                pass
+            # Rating and commenter karma are recalculated in background
+            # (counters were updated by the Comment signal)
+            InteractionEffects.video_engaged(video.pk, request.user.pk)
             
             return redirect('core:video_detail', pk=pk)
     return redirect('core:video_detail', pk=pk)
@@ -1248,12 +1224,11 @@ def delete_comment(request, comment_id):
         messages.error(request, "Вы не можете удалить этот комментарий")
         return redirect('core:video_detail', pk=comment.video.pk)
     
-    video_pk = comment.video.pk
+    video_pk = comment.video_id
     comment.delete()
     
-    # Recalculate video rating
-    video = Video.objects.get(pk=video_pk)
-    video.calculate_absolute_rating()
+    # Rating and comment author's karma are recalculated in background
+    InteractionEffects.video_engaged(video_pk, comment.user_id)
     
     return redirect('core:video_detail', pk=video_pk)
 
@@ -1270,31 +1245,38 @@ def user_karma(request):
     imported_videos = Video.objects.filter(imported_by=request.user)
     
     # Статистика загруженных видео
-    video_count = videos.count()
-    total_views = sum(video.views for video in videos)
-    total_likes = sum(video.likes.count() for video in videos)
-    total_dislikes = sum(video.dislikes.count() for video in videos)
+    totals = videos.aggregate(
+        video_count=Count('id'),
+        total_views=Sum('views'),
+        total_likes=Sum('likes_total'),
+        total_dislikes=Sum('dislikes_total'),
+        comments_received=Sum('comments_total'),
+        sentiment_sum=Sum('sentiment_sum'),
+    )
+    video_count = totals['video_count']
+    total_views = totals['total_views'] or 0
+    total_likes = totals['total_likes'] or 0
+    total_dislikes = totals['total_dislikes'] or 0
     
     # Статистика импортированных видео
     imported_count = imported_videos.count()
     
     # Общая статистика комментариев
     comments_made = Comment.objects.filter(user=request.user).count()
-    comments_received = Comment.objects.filter(video__in=videos).count()
+    comments_received = totals['comments_received'] or 0
     
     # Get karma breakdown
     try:
         likes_given = Like.objects.filter(user=request.user).count()
         dislikes_given = Dislike.objects.filter(user=request.user).count()
-        comments = Comment.objects.filter(user=request.user)
-        comment_sentiment_avg = 0.5
-        if comments.exists():
-            comment_sentiment_avg = sum(c.sentiment for c in comments) / comments.count()
+        comment_sentiment_avg = Comment.objects.filter(user=request.user).aggregate(
+            avg=Avg('sentiment'))['avg']
+        if comment_sentiment_avg is None:
+            comment_sentiment_avg = 0.5
         
-        video_comments = Comment.objects.filter(video__in=videos)
         video_sentiment_avg = 0.5
-        if video_comments.exists():
-            video_sentiment_avg = sum(c.sentiment for c in video_comments) / video_comments.count()
+        if comments_received:
+            video_sentiment_avg = (totals['sentiment_sum'] or 0) / comments_received
         
         # Get subscriber count
         try:
@@ -1359,31 +1341,12 @@ def recalculate_karma(request):
 
 @login_required
 def recalculate_all_ratings(request):
-    """Recalculate ratings for all videos"""
-    from django.db import transaction
-    import logging
-    import time
-    logger = logging.getLogger(__name__)
-    
-    start_time = time.time()
-    try:
-        with transaction.atomic():
-            videos = Video.objects.select_related().prefetch_related('comments', 'likes').all()
-            count = 0
-            
-            for video in videos:
-                try:
-                    video.calculate_absolute_rating()
-                    count += 1
-                except Exception as e:
-                    logger.error(f"Failed to calculate rating for video {video.id}: {str(e)}")
-                    raise
-            
-            execution_time = time.time() - start_time
-            messages.success(request, f"Рейтинги пересчитаны для {count} видео за {execution_time:.2f} секунд")
-    except Exception as e:
-        logger.error(f"Error during rating recalculation: {str(e)}")
-        messages.error(request, f"Ошибка при пересчете рейтингов: {str(e)}")
+    """Queue a background recalculation of ratings for all videos"""
+    task_id = RatingEngine.schedule_bulk_rescore()
+    if task_id:
+        messages.success(request, "Пересчет рейтингов запущен в фоне")
+    else:
+        messages.warning(request, "Пересчет рейтингов уже выполняется или очередь задач недоступна")
     
     return redirect('core:home')
 
@@ -1433,17 +1396,6 @@ def random_video(request):
         return redirect('core:video_detail', pk=random_video.pk)
     return redirect('core:home')
 
-def get_etag(request, pk):
-    """Generate ETag for video caching"""
-    video = get_object_or_404(Video, pk=pk)
-    return f'video-{pk}-{os.path.getmtime(video.file.path)}'
-
-def get_last_modified(request, pk):
-    """Get last modified time for video"""
-    video = get_object_or_404(Video, pk=pk)
-    timestamp = os.path.getmtime(video.file.path)
-    return timezone.make_aware(datetime.fromtimestamp(timestamp))
-
 @login_required
 def ratings(request):
     # Get page numbers for each block
@@ -1519,34 +1471,31 @@ def ratings(request):
     })
 
 def search(request):
-    """Search videos by title, description, or channel name"""
+    """Search videos by title and description (full-text index, see VideoSearch)"""
     query = request.GET.get('q', '')
-    results = Video.objects.none()  # Default to an empty queryset
+    results = []
+    paginator = None
     # channels_results = Channel.objects.none() # If we want to add channel search back
 
     if query:
         try:
             # Search for videos by title or description
-            results = Video.objects.filter(
-                Q(title__icontains=query) | 
-                Q(description__icontains=query)
-            ).distinct()
+            paginator, results = _search_page(
+                query, request.GET.get('page', 1), getattr(settings, 'SEARCH_RESULTS_PER_PAGE', 24),
+            )
             
             # Example: Search for channels by name (optional, can be added to context if template handles it)
             # channels_results = Channel.objects.filter(name__icontains=query).distinct()
 
-        except FieldError as e:
-            logger.error(f"Search query for videos failed: {e} for query: '{query}'")
-            messages.error(request, f"Произошла ошибка при поиске видео. Пожалуйста, попробуйте другой запрос.")
-            # results will remain Video.objects.none()
         except Exception as e: # Catch any other unexpected errors
             logger.error(f"Unexpected error during video search: {e} for query: '{query}'")
             messages.error(request, "Произошла непредвиденная ошибка при поиске.")
-            # results will remain Video.objects.none()
+            # results will remain empty
             
     context = {
         'query': query,
         'results': results,
+        'paginator': paginator,
         # 'channels': channels_results, # If you want to pass channels to the template
     }
     return render(request, 'core/search_results.html', context)
@@ -1605,6 +1554,71 @@ def ad_detail(request, ad_id):
     ad = get_object_or_404(Ad, pk=ad_id)
     return render(request, 'core/ad_detail.html', {'ad': ad})
 
+@login_required
+@require_GET
+def stream_metrics(request):
+    """Метрики отдачи видео текущего воркера (только для персонала)"""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    return JsonResponse(stream_governor.metrics())
+
+@login_required
+@require_GET
+def rating_rescore_status(request):
+    """Прогресс фонового пересчета рейтингов (только для персонала)"""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    return JsonResponse(RatingEngine.rescore_progress())
+
+@login_required
+@require_GET
+def interaction_effects_metrics(request):
+    """Метрики очереди фоновых пересчетов рейтинга и кармы (только для персонала)"""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    return JsonResponse(InteractionEffects.metrics())
+
+@login_required
+@require_GET
+def transition_buffer_metrics(request):
+    """Метрики буфера кликов по переходам: записи, ошибки, задержка слива (только для персонала)"""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    return JsonResponse(transition_buffer.metrics())
+
+@require_GET
+def up_next(request, pk):
+    """
+    Очередь автовоспроизведения: видео, на которые чаще всего переходят с этого
+    (TransitionGraph), затем рекомендации по тегам
+    """
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 10)), 50))
+    except ValueError:
+        limit = 10
+    neighbors = TransitionGraph.next_videos(pk)
+    probabilities = dict(neighbors)
+    ids = [to_id for to_id, _ in neighbors if to_id != pk]
+    if len(ids) < limit:
+        ids += [video_id for video_id in RecommendationIndex.for_video(pk)['recommended'] if video_id not in probabilities]
+    ids = ids[:limit]
+
+    videos = Video.objects.only('id', 'title', 'thumbnail', 'duration').in_bulk(ids)
+    items = []
+    for video_id in ids:
+        video = videos.get(video_id)
+        if video is None:
+            continue
+        items.append({
+            'id': video.pk,
+            'title': video.title,
+            'url': reverse('core:video_detail', kwargs={'pk': video.pk}),
+            'thumbnail_url': video.thumbnail.url if video.thumbnail else None,
+            'duration': video.duration,
+            'probability': probabilities.get(video.pk),
+        })
+    return JsonResponse({'video_id': pk, 'items': items})
+
 @require_GET
 def api_random_ad(request):
     from .models import Ad
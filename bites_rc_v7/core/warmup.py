@@ -0,0 +1,63 @@
+import logging
+import os
+import sys
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Процессы, которые обслуживают HTTP-запросы
+WEB_SERVERS = ('gunicorn', 'uwsgi', 'daphne', 'uvicorn', 'hypercorn')
+
+
+def is_web_worker():
+    """True для процесса веб-сервера; manage.py-команды и Celery сюда не попадают"""
+    role = os.environ.get('CORE_WARMUP_ROLE')
+    if role:
+        return role == 'web'
+    program = os.path.basename(sys.argv[0]) if sys.argv else ''
+    if any(server in program for server in WEB_SERVERS):
+        return True
+    if 'runserver' in sys.argv[1:2]:
+        # Процесс-наблюдатель автоперезагрузки не обслуживает запросы
+        return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv
+    return 'mod_wsgi' in sys.modules or 'uwsgi' in sys.modules
+
+
+def _load_sentiment_model():
+    from core.services.sentiment_service import sentiment_service
+    sentiment_service.load()
+
+
+# Что прогревается: имя -> функция загрузки
+WARMUP_STEPS = (
+    ('sentiment_model', _load_sentiment_model),
+)
+
+
+def _run():
+    for name, step in WARMUP_STEPS:
+        started = time.monotonic()
+        try:
+            step()
+        except Exception as e:
+            logger.error(f"[WARMUP_ERROR] {name} failed: {e}")
+            continue
+        logger.info(f"[WARMUP] {name} ready in {time.monotonic() - started:.1f}s")
+
+
+def start_warmup():
+    """
+    Запускает прогрев в фоновом потоке, если он включен (CORE_WARMUP_ENABLED)
+    и процесс - веб-воркер. Возвращает поток или None.
+
+    С gunicorn --preload ready() выполняется в мастере до fork, поэтому там
+    прогрев стоит отключить и вызывать start_warmup() из хука post_fork.
+    """
+    if not getattr(settings, 'CORE_WARMUP_ENABLED', False) or not is_web_worker():
+        return None
+    thread = threading.Thread(target=_run, name='core-warmup', daemon=True)
+    thread.start()
+    return thread
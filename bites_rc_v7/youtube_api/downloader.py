@@ -1,4 +1,3 @@
-import yt_dlp
 import os
 import tempfile
 import requests
@@ -9,6 +8,13 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+
+def _youtube_dl(options):
+    """yt_dlp is heavy to import, so it is loaded on the first download only"""
+    from yt_dlp import YoutubeDL
+    return YoutubeDL(options)
+
+
 class YouTubeDownloader:
     def __init__(self, video_id=None, output_path=None, progress_hook=None):
         self.video_id = video_id
@@ -78,7 +84,7 @@ class YouTubeDownloader:
                         f.write(f"Download started at {os.path.getctime(lock_file)}")
                     
                     # Download the video
-                    with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
+                    with _youtube_dl(self.ydl_opts) as ydl:
                         logger.info(f"Downloading {url} to {video_dir}")
                         info = ydl.extract_info(url, download=True)
                         
@@ -128,7 +134,7 @@ class YouTubeDownloader:
             self.ydl_opts['outtmpl'] = outtmpl_template
             
             # Download the video
-            with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
+            with _youtube_dl(self.ydl_opts) as ydl:
                 logger.info(f"Downloading {url} to {video_path}")
                 info = ydl.extract_info(url, download=True)
                 
@@ -148,7 +154,7 @@ class YouTubeDownloader:
                 
                 # Mark as downloaded and save
                 video_obj.is_downloaded = True
-                video_obj.save()
+                video_obj.save(update_fields=['file', 'is_downloaded'])
                 
                 # Download thumbnail if not already present
                 if not video_obj.thumbnail and video_obj.youtube_thumbnail_url:
@@ -172,7 +178,7 @@ class YouTubeDownloader:
                             # Attach thumbnail to model - using relative path
                             relative_thumb_path = os.path.join('thumbnails', thumbnail_filename)
                             video_obj.thumbnail.name = relative_thumb_path
-                            video_obj.save()
+                            video_obj.save(update_fields=['thumbnail'])
                     except Exception as thumb_error:
                         logger.error(f"Error downloading thumbnail: {str(thumb_error)}")
                 
@@ -185,7 +191,7 @@ class YouTubeDownloader:
     def get_video_info(self, url):
         """Get video information without downloading"""
         try:
-            with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
+            with _youtube_dl(self.ydl_opts) as ydl:
                 info = ydl.extract_info(url, download=False)
                 return info
         except Exception as e:
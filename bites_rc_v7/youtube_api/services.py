@@ -1,11 +1,11 @@
 import requests
-import aiohttp
 import asyncio
 from datetime import datetime, timedelta, timezone as dt_timezone
 from urllib.parse import urlparse, parse_qs
 from .api_key import YOUTUBE_API_KEY
 from core.models import Video, Channel
 from core.services.download_queue_service import DownloadQueueService
+from core.services.thumbnail_service import ThumbnailService
 from functools import lru_cache
 import os
 from django.conf import settings
@@ -14,7 +14,6 @@ from django.core.files.temp import NamedTemporaryFile
 from django.utils import timezone
 from django.core.files import File
 from tempfile import NamedTemporaryFile
-import yt_dlp
 import tempfile
 from django.contrib.auth.models import User
 import logging
@@ -22,6 +21,13 @@ import time
 
 logger = logging.getLogger(__name__)
 
+
+def _client_session():
+    """aiohttp импортируется только при первом асинхронном запросе"""
+    import aiohttp
+    return aiohttp.ClientSession()
+
+
 class YouTubeService:
     BASE_URL = 'https://www.googleapis.com/youtube/v3'
     
@@ -276,7 +282,7 @@ class YouTubeService:
         
         url = f'{self.base_url}/videos?id={video_id}&key={self.api_key}&part=snippet,contentDetails,statistics'
         
-        async with aiohttp.ClientSession() as session:
+        async with _client_session() as session:
             async with session.get(url) as response:
                 data = await response.json()
                 
@@ -285,7 +291,7 @@ class YouTubeService:
         """Асинхронный вариант получения данных видео"""
         url = f'{self.base_url}/videos?id={video_id}&key={self.api_key}&part=snippet,contentDetails,statistics'
         
-        async with aiohttp.ClientSession() as session:
+        async with _client_session() as session:
             async with session.get(url) as response:
                 data = await response.json()
                 
@@ -301,7 +307,7 @@ class YouTubeService:
         
         url = f'{self.base_url}/channels?id={channel_id}&key={self.api_key}&part=snippet,statistics,brandingSettings'
         
-        async with aiohttp.ClientSession() as session:
+        async with _client_session() as session:
             async with session.get(url) as response:
                 data = await response.json()
                 
@@ -844,6 +850,7 @@ class YouTubeService:
                     img_temp.flush()
                     video.thumbnail.save(f'{video_id}_thumb.jpg', File(img_temp), save=True)
                     logger.info(f"[VIDEO_IMPORT_STEP] Thumbnail downloaded for video {video_id}")
+                    ThumbnailService.generate_variants(video)
             except Exception as e:
                 logger.error(f"[VIDEO_IMPORT_WARNING] Error downloading thumbnail for {video_id}: {e}")
         
@@ -909,7 +916,7 @@ class YouTubeService:
         if video_data['thumbnail_url']:
             try:
                 logger.info(f"[ASYNC_VIDEO_IMPORT_STEP] Downloading thumbnail for video {video_id}")
-                async with aiohttp.ClientSession() as session:
+                async with _client_session() as session:
                     async with session.get(video_data['thumbnail_url']) as response:
                         if response.status == 200:
                             content = await response.read()
@@ -918,6 +925,7 @@ class YouTubeService:
                             img_temp.flush()
                             video.thumbnail.save(f'{video_id}_thumb.jpg', File(img_temp), save=True)
                             logger.info(f"[ASYNC_VIDEO_IMPORT_STEP] Thumbnail downloaded for video {video_id}")
+                            ThumbnailService.generate_variants(video)
             except Exception as e:
                 logger.error(f"[ASYNC_VIDEO_IMPORT_WARNING] Error downloading thumbnail for {video_id}: {e}")
         
@@ -973,7 +981,7 @@ class YouTubeService:
         # Download thumbnail асинхронно
         if video_data['thumbnail_url']:
             try:
-                async with aiohttp.ClientSession() as session:
+                async with _client_session() as session:
                     async with session.get(video_data['thumbnail_url']) as response:
                         if response.status == 200:
                             img_content = await response.read()
@@ -981,6 +989,7 @@ class YouTubeService:
                             img_temp.write(img_content)
                             img_temp.flush()
                             video.thumbnail.save(f'{video_id}_thumb.jpg', File(img_temp), save=True)
+                            ThumbnailService.generate_variants(video)
             except Exception as e:
                 logger.error(f"Error downloading thumbnail: {e}")
 
@@ -1,3 +1,15 @@
-from django.test import TestCase
+import asyncio
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from youtube_api.services import _client_session
+
+
+class ClientSessionTests(SimpleTestCase):
+    def test_opens_and_closes_session(self):
+        async def open_session():
+            async with _client_session() as session:
+                return session
+
+        session = asyncio.run(open_session())
+        self.assertTrue(session.closed)
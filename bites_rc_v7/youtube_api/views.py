@@ -9,6 +9,7 @@ from core.models import Video, Channel
 from .services import YouTubeService
 from core.services.video_analysis import analyze_video
 from core.services.tag_service import generate_tags_for_video
+from core.services.rating_engine import RatingEngine
 import logging
 
 logger = logging.getLogger(__name__)
@@ -157,22 +158,12 @@ def recalculate_all_ratings(request):
         messages.error(request, 'Only staff members can recalculate ratings.')
         return redirect('video_list')
     
-    print("\n[RECALC] Пользователь авторизован, начинаем пересчет...")    
-    try:
-        videos = Video.objects.all()
-        total = videos.count()
-        print(f"[RECALC] Найдено {total} видео для пересчета")
-        
-        for i, video in enumerate(videos, 1):
-            print(f"\n[RECALC] [{i}/{total}] Обработка видео {video.id}: {video.title}")
-            rating = video.recalculate_ratings()
-            print(f"[RECALC] Результат: Рейтинг = {rating:.3f}")
-        
-        print("\n[RECALC] Пересчет рейтингов успешно завершен\n")
-        messages.success(request, f'Successfully recalculated ratings for {total} videos.')
-    except Exception as e:
-        print(f"\n[RECALC] ОШИБКА при пересчете рейтингов: {str(e)}\n")
-        messages.error(request, f'Error recalculating ratings: {str(e)}')
+    task_id = RatingEngine.schedule_bulk_rescore()
+    if task_id:
+        logger.info(f"[RECALC] Bulk rating recalculation queued as task {task_id}")
+        messages.success(request, 'Rating recalculation started in the background.')
+    else:
+        messages.warning(request, 'Rating recalculation is already running or the task queue is unavailable.')
     
     return redirect('video_list')
 
@@ -0,0 +1,272 @@
+import os
+import json
+import shutil
+import struct
+import hashlib
+import logging
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class SegmentCache:
+    """
+    Контентно-адресуемый дисковый кэш сегментов с LRU-вытеснением по суммарному размеру.
+    Блоб хранится как blobs/<sha256[:2]>/<sha256>.webm, одинаковые сегменты не дублируются.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.blobs_dir = os.path.join(root, 'blobs')
+        self.max_bytes = max_bytes
+        self._lru = OrderedDict()  # {digest: size}, от самого старого к самому свежему
+        self._total = 0
+        self._lock = threading.RLock()
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Восстанавливает индекс LRU с диска после рестарта (порядок по времени доступа)"""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.blobs_dir):
+            for name in filenames:
+                if not name.endswith('.webm'):
+                    continue
+                try:
+                    st = os.stat(os.path.join(dirpath, name))
+                except OSError:
+                    continue
+                entries.append((max(st.st_atime, st.st_mtime), name[:-len('.webm')], st.st_size))
+        for _, digest, size in sorted(entries):
+            self._lru[digest] = size
+            self._total += size
+        logger.info(f"Segment cache loaded: {len(self._lru)} blobs, {self._total / 1024 / 1024:.1f} MB")
+        self._evict()
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blobs_dir, digest[:2], f"{digest}.webm")
+
+    @property
+    def total_bytes(self):
+        return self._total
+
+    def put(self, data):
+        """Сохраняет сегмент и возвращает его sha256"""
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if digest in self._lru:
+                self._lru.move_to_end(digest)
+                return digest
+        path = self._blob_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if digest not in self._lru:
+                self._total += len(data)
+            self._lru[digest] = len(data)
+            self._lru.move_to_end(digest)
+            self._evict()
+        return digest
+
+    def get(self, digest):
+        """Возвращает содержимое сегмента или None, если он был вытеснен"""
+        with self._lock:
+            if digest not in self._lru:
+                return None
+            self._lru.move_to_end(digest)
+        try:
+            with open(self._blob_path(digest), 'rb') as f:
+                return f.read()
+        except OSError:
+            with self._lock:
+                size = self._lru.pop(digest, 0)
+                self._total -= size
+            return None
+
+    def _evict(self):
+        with self._lock:
+            while self._total > self.max_bytes and self._lru:
+                digest, size = self._lru.popitem(last=False)
+                self._total -= size
+                try:
+                    os.remove(self._blob_path(digest))
+                except OSError:
+                    pass
+                logger.debug(f"Evicted segment {digest} ({size} bytes)")
+
+
+class ChunkStore:
+    """
+    Хранилище WebRTC-чанков: видео один раз нарезается и транскодируется в VP9/Opus
+    сегменты длительностью CHUNK_SIZE/1e6 секунд (та же сетка, что и раньше у /api/chunk),
+    после чего каждый чанк отдается одним чтением с диска.
+
+    Манифест видео (manifests/<video_id>.json) хранит подпись исходника (size, mtime)
+    и список sha256 сегментов; при изменении исходника или вытеснении сегмента
+    нарезка запускается заново в фоне.
+    """
+
+    def __init__(self, root, max_bytes, segment_seconds, workers=2):
+        self.root = root
+        self.manifests_dir = os.path.join(root, 'manifests')
+        self.segment_seconds = segment_seconds
+        self.cache = SegmentCache(root, max_bytes)
+        self._manifests = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='chunk-segmenter')
+        os.makedirs(self.manifests_dir, exist_ok=True)
+
+    @staticmethod
+    def parse_chunk_id(chunk_id):
+        """'chunk_12' -> 12, некорректный id -> None"""
+        try:
+            return int(str(chunk_id).split('_')[1])
+        except (IndexError, ValueError):
+            return None
+
+    @staticmethod
+    def _source_signature(video_path):
+        st = os.stat(video_path)
+        return [st.st_size, int(st.st_mtime)]
+
+    def _manifest_path(self, video_id):
+        return os.path.join(self.manifests_dir, f"{video_id}.json")
+
+    def manifest(self, video_id, video_path, signature=None):
+        """
+        Возвращает список digest'ов сегментов, если нарезка актуальна, иначе None.
+        signature ([size, mtime]) можно передать из индекса хранилища, чтобы не делать stat().
+        """
+        if signature is None:
+            signature = self._source_signature(video_path)
+        manifest = self._manifests.get(video_id)
+        if manifest is None:
+            try:
+                with open(self._manifest_path(video_id)) as f:
+                    manifest = json.load(f)
+                self._manifests[video_id] = manifest
+            except (OSError, ValueError):
+                return None
+        if manifest.get('source') != signature:
+            return None
+        return manifest['segments']
+
+    def is_segmenting(self, video_id):
+        with self._lock:
+            return video_id in self._in_flight
+
+    def ensure_segmented(self, video_id, video_path):
+        """
+        Запускает разовую нарезку видео в фоне (single-flight на видео).
+        Возвращает True, если сегменты уже готовы.
+        """
+        if self.manifest(video_id, video_path) is not None:
+            return True
+        with self._lock:
+            if video_id not in self._in_flight:
+                future = self._executor.submit(self._segment, video_id, video_path)
+                self._in_flight[video_id] = future
+                future.add_done_callback(lambda _f: self._finish(video_id))
+                logger.info(f"Scheduled pre-segmentation for video {video_id}")
+        return False
+
+    def _finish(self, video_id):
+        with self._lock:
+            self._in_flight.pop(video_id, None)
+
+    def _segment(self, video_id, video_path):
+        signature = self._source_signature(video_path)
+        work_dir = tempfile.mkdtemp(prefix=f"chunks_{video_id}_")
+        try:
+            cmd = [
+                'ffmpeg', '-i', video_path,
+                '-c:v', 'libvpx-vp9', '-c:a', 'libopus',
+                '-threads', '2', '-cpu-used', '4', '-speed', '4',
+                # Ключевой кадр на каждой границе чанка, чтобы сегменты декодировались независимо
+                '-force_key_frames', f'expr:gte(t,n_forced*{self.segment_seconds})',
+                '-f', 'segment', '-segment_time', str(self.segment_seconds),
+                '-segment_format', 'webm', '-reset_timestamps', '1',
+                os.path.join(work_dir, 'chunk_%06d.webm')
+            ]
+            subprocess.run(cmd, check=True, capture_output=True)
+            segments = []
+            for name in sorted(os.listdir(work_dir)):
+                with open(os.path.join(work_dir, name), 'rb') as f:
+                    segments.append(self.cache.put(f.read()))
+            manifest = {'source': signature, 'segments': segments}
+            fd, tmp_path = tempfile.mkstemp(dir=self.manifests_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, self._manifest_path(video_id))
+            self._manifests[video_id] = manifest
+            logger.info(f"Pre-segmented video {video_id} into {len(segments)} chunks")
+        except subprocess.CalledProcessError as e:
+            logger.error(f"FFmpeg pre-segmentation failed for video {video_id}: {e.stderr.decode(errors='ignore')}")
+        except Exception as e:
+            logger.error(f"Pre-segmentation failed for video {video_id}: {e}")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def invalidate(self, video_id):
+        self._manifests.pop(video_id, None)
+        try:
+            os.remove(self._manifest_path(video_id))
+        except OSError:
+            pass
+
+    def get_chunks(self, video_id, video_path, chunk_ids, signature=None):
+        """
+        Возвращает (ready, {chunk_id: (digest, bytes) | None}).
+        ready=False означает, что видео еще нарезается и чанки нужно запросить позже.
+        """
+        segments = self.manifest(video_id, video_path, signature)
+        if segments is None:
+            self.ensure_segmented(video_id, video_path)
+            return False, {}
+        results = {}
+        evicted = False
+        for chunk_id in chunk_ids:
+            index = self.parse_chunk_id(chunk_id)
+            if index is None or index >= len(segments):
+                results[chunk_id] = None
+                continue
+            digest = segments[index]
+            data = self.cache.get(digest)
+            if data is None:
+                evicted = True
+                results[chunk_id] = None
+            else:
+                results[chunk_id] = (digest, data)
+        if evicted:
+            # Часть сегментов вытеснена из кэша - нарезаем видео заново
+            self.invalidate(video_id)
+            self.ensure_segmented(video_id, video_path)
+        return True, results
+
+
+def encode_chunk_batch(results):
+    """
+    Бинарный формат пакета чанков (без hex/JSON):
+        для каждого чанка: u16 длина id | id (utf-8) | u32 длина данных | данные
+    Отсутствующий чанк кодируется длиной 0xFFFFFFFF без данных. Все числа big-endian.
+    """
+    parts = []
+    for chunk_id, item in results.items():
+        encoded_id = str(chunk_id).encode('utf-8')
+        parts.append(struct.pack('>H', len(encoded_id)))
+        parts.append(encoded_id)
+        if item is None:
+            parts.append(struct.pack('>I', 0xFFFFFFFF))
+        else:
+            data = item[1]
+            parts.append(struct.pack('>I', len(data)))
+            parts.append(data)
+    return b''.join(parts)
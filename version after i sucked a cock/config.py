@@ -35,6 +35,27 @@ class Config:
     SERVICE_ACCOUNT_FILE = os.getenv('SERVICE_ACCOUNT_FILE', '/home/impostorboy/prjcts/Leather_outfit_v2_backup/service_account.json')
     AVG_VIDEO_SIZE_MB = 100
     AVG_DOWNLOAD_SPEED_MBPS = 10
+    # Потоковая отдача Range-запросов (см. range_streaming.py)
+    STREAM_BLOCK_SIZE = int(os.getenv('STREAM_BLOCK_SIZE', 64 * 1024))
+    STREAM_MAX_RANGE_BYTES = int(os.getenv('STREAM_MAX_RANGE_BYTES', 8 * 1024 * 1024))
+    # Кэш нарезанных WebRTC-чанков (см. chunk_store.py)
+    CHUNK_CACHE_DIR = os.getenv('CHUNK_CACHE_DIR', os.path.join(SUPABASE_CONFIG['storage_path'], 'chunk_cache'))
+    CHUNK_CACHE_MAX_BYTES = int(os.getenv('CHUNK_CACHE_MAX_BYTES', 20 * 1024 ** 3))
+    CHUNK_SEGMENT_WORKERS = int(os.getenv('CHUNK_SEGMENT_WORKERS', 2))
+    # Фоновая генерация HLS (см. hls_worker.py)
+    HLS_WORKERS = int(os.getenv('HLS_WORKERS', 1))
+    HLS_RETRY_AFTER = int(os.getenv('HLS_RETRY_AFTER', 5))
+    HLS_FAILURE_BACKOFF = int(os.getenv('HLS_FAILURE_BACKOFF', 60))
+    HLS_FAILURE_BACKOFF_MAX = int(os.getenv('HLS_FAILURE_BACKOFF_MAX', 3600))
+    # Уровни хранения медиа (см. media_storage.py): hot - storage_path, cold - вторичный диск
+    STORAGE_COLD_PATH = os.getenv('STORAGE_COLD_PATH', '/run/media/impostorboy/server/videos')
+    STORAGE_PROMOTE_AFTER = int(os.getenv('STORAGE_PROMOTE_AFTER', 2))
+    STORAGE_PROMOTE_WINDOW = int(os.getenv('STORAGE_PROMOTE_WINDOW', 3600))
+    STORAGE_HOT_MAX_BYTES = int(os.getenv('STORAGE_HOT_MAX_BYTES', 0))
+    # Фоновая оценка тональности комментариев (см. sentiment_analyzer.py)
+    SENTIMENT_BATCH_SIZE = int(os.getenv('SENTIMENT_BATCH_SIZE', 32))
+    SENTIMENT_QUANTIZE = os.getenv('SENTIMENT_QUANTIZE', '1') == '1'
+    SENTIMENT_WORKER_INTERVAL = int(os.getenv('SENTIMENT_WORKER_INTERVAL', 30))
 
 CONFIG = Config()
 
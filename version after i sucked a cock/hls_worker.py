@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class HlsGenerator:
+    """
+    Фоновая генерация HLS с объединением одновременных запросов.
+
+    - на одно видео одновременно работает не больше одного ffmpeg: внутри процесса
+      это обеспечивает словарь активных задач, между воркерами - lock-файл (O_EXCL);
+    - пока идет упаковка, плейлист имеет тип EVENT и растет по мере появления сегментов
+      (ffmpeg пишет и плейлист, и сегменты через временные файлы с переименованием);
+    - после успешного завершения рядом пишется маркер .complete с sha256 плейлиста
+      и размером/mtime исходника; из кэша отдается только плейлист с валидным
+      маркером, #EXT-X-ENDLIST и неизменившимся исходником;
+    - в именах сегментов есть версия исходника (размер и mtime), поэтому после
+      замены файла сегменты получают новые URL и их можно кэшировать как immutable;
+    - после неудачной генерации пишется .failed, и повтор для того же исходника
+      откладывается с экспоненциальной задержкой (failure_backoff .. failure_backoff_max).
+    """
+
+    LOCK_NAME = '.lock'
+    MARKER_NAME = '.complete'
+    FAILURE_NAME = '.failed'
+
+    def __init__(self, root, workers=1, segment_seconds=10, lock_timeout=3600, failure_backoff=60,
+                 failure_backoff_max=3600):
+        self.root = root
+        self.segment_seconds = segment_seconds
+        self.lock_timeout = lock_timeout
+        self.failure_backoff = failure_backoff
+        self.failure_backoff_max = failure_backoff_max
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hls-generator')
+
+    def video_dir(self, video_id):
+        return os.path.join(self.root, video_id)
+
+    def playlist_path(self, video_id):
+        return os.path.join(self.video_dir(video_id), f"{video_id}.m3u8")
+
+    def _marker_path(self, video_id):
+        return os.path.join(self.video_dir(video_id), self.MARKER_NAME)
+
+    def _lock_path(self, video_id):
+        return os.path.join(self.video_dir(video_id), self.LOCK_NAME)
+
+    def _failure_path(self, video_id):
+        return os.path.join(self.video_dir(video_id), self.FAILURE_NAME)
+
+    @staticmethod
+    def source_version(video_path):
+        """Версия исходника для маркера и имен сегментов: размер и mtime"""
+        st = os.stat(video_path)
+        return f"{st.st_size:x}-{int(st.st_mtime):x}"
+
+    @staticmethod
+    def _sha256(path):
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(64 * 1024), b''):
+                h.update(block)
+        return h.hexdigest()
+
+    def is_complete(self, video_id, video_path):
+        """Плейлист полностью записан, совпадает с маркером и собран из текущего исходника"""
+        playlist = self.playlist_path(video_id)
+        try:
+            with open(self._marker_path(video_id)) as f:
+                marker = json.load(f)
+            with open(playlist, 'rb') as f:
+                content = f.read()
+            source = os.stat(video_path)
+        except (OSError, ValueError):
+            return False
+        if b'#EXT-X-ENDLIST' not in content:
+            return False
+        if marker.get('source_size') != source.st_size or marker.get('source_mtime') != int(source.st_mtime):
+            return False
+        return hashlib.sha256(content).hexdigest() == marker.get('sha256')
+
+    def _read_failure(self, video_id):
+        try:
+            with open(self._failure_path(video_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def retry_after(self, video_id, video_path):
+        """Сколько секунд ждать до следующей попытки после неудачи (0 - можно пробовать)"""
+        failure = self._read_failure(video_id)
+        try:
+            if not failure or failure.get('source') != self.source_version(video_path):
+                return 0
+        except OSError:
+            return 0
+        delay = min(self.failure_backoff * 2 ** (failure.get('attempts', 1) - 1), self.failure_backoff_max)
+        return max(0, int(failure.get('failed_at', 0) + delay - time.time()))
+
+    def is_generating(self, video_id):
+        with self._lock:
+            if video_id in self._in_flight:
+                return True
+        return self._lock_is_fresh(video_id)
+
+    def _lock_is_fresh(self, video_id):
+        try:
+            age = time.time() - os.path.getmtime(self._lock_path(video_id))
+        except OSError:
+            return False
+        return age < self.lock_timeout
+
+    def _acquire_file_lock(self, video_id):
+        """Межпроцессная блокировка: создаем lock-файл атомарно, устаревший удаляем"""
+        os.makedirs(self.video_dir(video_id), exist_ok=True)
+        lock_path = self._lock_path(video_id)
+        for _ in range(2):
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if self._lock_is_fresh(video_id):
+                    return False
+                logger.warning(f"Удаляем устаревшую блокировку HLS для видео {video_id}")
+                try:
+                    os.remove(lock_path)
+                except OSError:
+                    pass
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(f"{os.getpid()} {time.time()}")
+            return True
+        return False
+
+    def request(self, video_id, video_path):
+        """
+        Запрашивает HLS для видео. Возвращает 'ready', если плейлист готов,
+        'failed', если последняя генерация упала и задержка до повтора не истекла
+        (см. retry_after), иначе запускает (или присоединяется к уже идущей)
+        генерацию и возвращает 'processing'.
+        """
+        if self.is_complete(video_id, video_path):
+            return 'ready'
+        with self._lock:
+            if video_id in self._in_flight:
+                return 'processing'
+            if self.retry_after(video_id, video_path) > 0:
+                return 'failed'
+            if not self._acquire_file_lock(video_id):
+                # Генерацию уже ведет другой воркер
+                return 'processing'
+            future = self._executor.submit(self._generate, video_id, video_path)
+            self._in_flight[video_id] = future
+        future.add_done_callback(lambda _f: self._finish(video_id))
+        logger.info(f"Запущена фоновая генерация HLS для видео {video_id}")
+        return 'processing'
+
+    def _finish(self, video_id):
+        with self._lock:
+            self._in_flight.pop(video_id, None)
+        try:
+            os.remove(self._lock_path(video_id))
+        except OSError:
+            pass
+
+    def _clear_partial(self, video_id):
+        """Удаляет остатки прерванной генерации, сохраняя lock-файл"""
+        video_dir = self.video_dir(video_id)
+        for name in os.listdir(video_dir):
+            if name == self.LOCK_NAME:
+                continue
+            path = os.path.join(video_dir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+
+    def _record_failure(self, video_id, version, previous):
+        attempts = previous.get('attempts', 0) + 1 if previous and previous.get('source') == version else 1
+        failure_tmp = self._failure_path(video_id) + '.tmp'
+        try:
+            with open(failure_tmp, 'w') as f:
+                json.dump({'source': version, 'attempts': attempts, 'failed_at': time.time()}, f)
+            os.replace(failure_tmp, self._failure_path(video_id))
+        except OSError as e:
+            logger.error(f"Не удалось записать статус ошибки HLS для видео {video_id}: {e}")
+
+    def _generate(self, video_id, video_path):
+        start_time = time.time()
+        previous_failure = self._read_failure(video_id)
+        version = None
+        try:
+            version = self.source_version(video_path)
+            self._clear_partial(video_id)
+            playlist = self.playlist_path(video_id)
+            cmd = [
+                'ffmpeg', '-i', video_path, '-c:v', 'copy', '-c:a', 'copy',
+                '-hls_time', str(self.segment_seconds), '-hls_list_size', '0',
+                # EVENT: плеер может начать воспроизведение, пока плейлист дописывается
+                '-hls_playlist_type', 'event',
+                '-hls_flags', 'temp_file',
+                '-hls_base_url', f"/hls/{video_id}/",
+                '-hls_segment_filename', os.path.join(self.video_dir(video_id), f'seg_{version}_%05d.ts'),
+                '-f', 'hls', playlist
+            ]
+            subprocess.run(cmd, check=True, capture_output=True)
+            size, mtime = (int(part, 16) for part in version.split('-'))
+            marker = {
+                'sha256': self._sha256(playlist),
+                'generated_at': time.time(),
+                'source_size': size,
+                'source_mtime': mtime,
+            }
+            marker_tmp = self._marker_path(video_id) + '.tmp'
+            with open(marker_tmp, 'w') as f:
+                json.dump(marker, f)
+            os.replace(marker_tmp, self._marker_path(video_id))
+            logger.info(f"Сгенерирован плейлист HLS для видео {video_id} за {time.time() - start_time:.1f}s")
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Ошибка FFmpeg для HLS {video_id}: {e.stderr.decode(errors='ignore')}")
+            self._record_failure(video_id, version, previous_failure)
+        except Exception as e:
+            logger.error(f"Ошибка генерации HLS для видео {video_id}: {e}")
+            self._record_failure(video_id, version, previous_failure)
+
+    def progressive_playlist(self, video_id):
+        """Текущее содержимое растущего плейлиста, если в нем уже есть хотя бы один сегмент"""
+        try:
+            with open(self.playlist_path(video_id), 'rb') as f:
+                content = f.read()
+        except OSError:
+            return None
+        return content if b'#EXTINF' in content else None
@@ -0,0 +1,279 @@
+import os
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = ('.mp4', '.webm', '.mkv')
+
+HOT = 'hot'
+COLD = 'cold'
+
+
+class Location(namedtuple('Location', ['tier', 'path', 'size', 'ext', 'mtime'])):
+    """Где лежит файл: уровень хранилища, путь, размер, расширение, mtime"""
+
+    @property
+    def signature(self):
+        # Тот же формат, что и подпись исходника в ChunkStore
+        return [self.size, int(self.mtime)]
+
+
+class MediaStorage:
+    """
+    Единая точка разрешения путей к медиафайлам с двумя уровнями хранения:
+    hot (основной диск) и cold (вторичный/медленный диск).
+
+    Индекс в памяти (video_id -> Location) строится одним проходом os.scandir
+    при старте, пополняется при записи (register) и чистится, когда маршрут
+    отдачи обнаруживает, что файл удален с диска мимо приложения (invalidate),
+    поэтому обычный запрос не обращается к диску вовсе, а промах стоит
+    не больше одного stat() на кандидата и кэшируется как отрицательный.
+
+    Политика уровней: видео из cold, которое посмотрели promote_after раз за
+    promote_window секунд, копируется в hot в фоне. Если задан hot_max_bytes,
+    давно не просматривавшиеся видео вытесняются из hot обратно в cold.
+    """
+
+    def __init__(self, hot_root, cold_root=None, promote_after=2, promote_window=3600,
+                 hot_max_bytes=0, negative_ttl=60, workers=1):
+        self.roots = {HOT: hot_root}
+        if cold_root:
+            self.roots[COLD] = cold_root
+        self.thumbnail_roots = {HOT: os.path.join(hot_root, 'thumbnails')}
+        if cold_root:
+            self.thumbnail_roots[COLD] = cold_root
+        self.promote_after = promote_after
+        self.promote_window = promote_window
+        self.hot_max_bytes = hot_max_bytes
+        self.negative_ttl = negative_ttl
+
+        self._videos = {}
+        self._thumbnails = {}
+        self._missing = {}  # {(вид, ключ): время промаха}
+        self._accesses = {}  # {video_id: deque[monotonic]}
+        self._last_access = {}
+        self._moving = set()
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='media-tiering')
+        self.scan()
+
+    # --- индекс -------------------------------------------------------------
+
+    @staticmethod
+    def _entries(root):
+        try:
+            with os.scandir(root) as it:
+                for entry in it:
+                    if entry.is_file():
+                        yield entry
+        except OSError as e:
+            logger.warning(f"Storage root {root} is not available: {e}")
+
+    def scan(self):
+        """Полное построение индекса: по одному os.scandir на каталог"""
+        videos, thumbnails = {}, {}
+        # cold сканируется первым, чтобы копия в hot имела приоритет
+        for tier in (COLD, HOT):
+            if tier in self.roots:
+                for entry in self._entries(self.roots[tier]):
+                    video_id, ext = os.path.splitext(entry.name)
+                    if ext.lower() in VIDEO_EXTENSIONS:
+                        st = entry.stat()
+                        videos[video_id] = Location(tier, entry.path, st.st_size, ext.lower(), st.st_mtime)
+            if tier in self.thumbnail_roots:
+                for entry in self._entries(self.thumbnail_roots[tier]):
+                    if os.path.splitext(entry.name)[1].lower() in ('.jpg', '.jpeg', '.png', '.webp'):
+                        st = entry.stat()
+                        thumbnails[entry.name] = Location(tier, entry.path, st.st_size,
+                                                          os.path.splitext(entry.name)[1].lower(), st.st_mtime)
+        with self._lock:
+            self._videos = videos
+            self._thumbnails = thumbnails
+            self._missing.clear()
+        logger.info(f"Media storage indexed: {len(videos)} videos, {len(thumbnails)} thumbnails")
+
+    def _is_known_missing(self, key):
+        missed_at = self._missing.get(key)
+        if missed_at is None:
+            return False
+        if time.monotonic() - missed_at > self.negative_ttl:
+            self._missing.pop(key, None)
+            return False
+        return True
+
+    @staticmethod
+    def _stat_location(tier, path, ext):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return Location(tier, path, st.st_size, ext, st.st_mtime)
+
+    def register(self, video_id, path, tier=HOT):
+        """Добавляет только что записанное видео в индекс (один stat)"""
+        ext = os.path.splitext(path)[1].lower()
+        location = self._stat_location(tier, path, ext)
+        if location is None:
+            return None
+        with self._lock:
+            self._videos[video_id] = location
+            self._missing.pop(('video', video_id), None)
+        return location
+
+    def register_thumbnail(self, name, path, tier=HOT):
+        location = self._stat_location(tier, path, os.path.splitext(name)[1].lower())
+        if location is None:
+            return None
+        with self._lock:
+            self._thumbnails[name] = location
+            self._missing.pop(('thumbnail', name), None)
+        return location
+
+    def invalidate(self, video_id):
+        with self._lock:
+            self._videos.pop(video_id, None)
+            self._accesses.pop(video_id, None)
+            self._last_access.pop(video_id, None)
+
+    def invalidate_thumbnail(self, name):
+        with self._lock:
+            self._thumbnails.pop(name, None)
+
+    # --- разрешение путей ---------------------------------------------------
+
+    def locate(self, video_id, track=True):
+        """Location видео или None. track=True учитывает обращение для политики уровней"""
+        with self._lock:
+            location = self._videos.get(video_id)
+            if location is None and self._is_known_missing(('video', video_id)):
+                return None
+        if location is None:
+            location = self._probe_video(video_id)
+            if location is None:
+                return None
+        if track:
+            self._touch(video_id, location)
+        return location
+
+    def _probe_video(self, video_id):
+        for tier in (HOT, COLD):
+            if tier not in self.roots:
+                continue
+            for ext in VIDEO_EXTENSIONS:
+                location = self._stat_location(tier, os.path.join(self.roots[tier], f"{video_id}{ext}"), ext)
+                if location is not None:
+                    with self._lock:
+                        self._videos[video_id] = location
+                    return location
+        with self._lock:
+            self._missing[('video', video_id)] = time.monotonic()
+        return None
+
+    def locate_thumbnail(self, name):
+        with self._lock:
+            location = self._thumbnails.get(name)
+            if location is not None or self._is_known_missing(('thumbnail', name)):
+                return location
+        ext = os.path.splitext(name)[1].lower()
+        for tier in (HOT, COLD):
+            if tier not in self.thumbnail_roots:
+                continue
+            location = self._stat_location(tier, os.path.join(self.thumbnail_roots[tier], name), ext)
+            if location is not None:
+                with self._lock:
+                    self._thumbnails[name] = location
+                return location
+        with self._lock:
+            self._missing[('thumbnail', name)] = time.monotonic()
+        return None
+
+    # --- политика уровней ---------------------------------------------------
+
+    def _touch(self, video_id, location):
+        now = time.monotonic()
+        promote = False
+        with self._lock:
+            self._last_access[video_id] = now
+            if location.tier != COLD or HOT not in self.roots:
+                return
+            hits = self._accesses.setdefault(video_id, deque())
+            hits.append(now)
+            while hits and hits[0] < now - self.promote_window:
+                hits.popleft()
+            if len(hits) >= self.promote_after and video_id not in self._moving:
+                self._moving.add(video_id)
+                promote = True
+        if promote:
+            self._executor.submit(self._promote, video_id, location)
+
+    def _move(self, video_id, location, tier, delete_source):
+        """Атомарно копирует файл в другой уровень и обновляет индекс"""
+        target_dir = self.roots[tier]
+        target = os.path.join(target_dir, os.path.basename(location.path))
+        fd, tmp_path = tempfile.mkstemp(dir=target_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(location.path, tmp_path)
+            shutil.copystat(location.path, tmp_path)
+            os.replace(tmp_path, target)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        new_location = Location(tier, target, location.size, location.ext, location.mtime)
+        with self._lock:
+            if self._videos.get(video_id) == location:
+                self._videos[video_id] = new_location
+        if delete_source:
+            # Открытые дескрипторы текущих отдач продолжат работать
+            os.remove(location.path)
+        return new_location
+
+    def _promote(self, video_id, location):
+        try:
+            self._move(video_id, location, HOT, delete_source=False)
+            logger.info(f"Promoted video {video_id} to hot storage ({location.size / 1024 / 1024:.1f} MB)")
+            self._enforce_hot_capacity(exclude=video_id)
+        except Exception as e:
+            logger.error(f"Failed to promote video {video_id} to hot storage: {e}")
+        finally:
+            with self._lock:
+                self._moving.discard(video_id)
+                self._accesses.pop(video_id, None)
+
+    def _enforce_hot_capacity(self, exclude=None):
+        if not self.hot_max_bytes or COLD not in self.roots:
+            return
+        with self._lock:
+            hot = [(vid, loc) for vid, loc in self._videos.items() if loc.tier == HOT]
+            total = sum(loc.size for _, loc in hot)
+            # Самые давно не просматривавшиеся - первые кандидаты на вытеснение
+            hot.sort(key=lambda item: self._last_access.get(item[0], 0))
+        for video_id, location in hot:
+            if total <= self.hot_max_bytes:
+                break
+            if video_id == exclude:
+                continue
+            try:
+                self._move(video_id, location, COLD, delete_source=True)
+                total -= location.size
+                logger.info(f"Demoted video {video_id} to cold storage")
+            except Exception as e:
+                logger.error(f"Failed to demote video {video_id} to cold storage: {e}")
+
+    def stats(self):
+        with self._lock:
+            by_tier = {}
+            for location in self._videos.values():
+                tier = by_tier.setdefault(location.tier, {'videos': 0, 'bytes': 0})
+                tier['videos'] += 1
+                tier['bytes'] += location.size
+            return {'tiers': by_tier, 'thumbnails': len(self._thumbnails), 'promoting': len(self._moving)}
@@ -0,0 +1,190 @@
+import os
+import re
+import uuid
+import logging
+import mimetypes
+from flask import Response
+
+logger = logging.getLogger(__name__)
+
+RANGE_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_ranges(header, size):
+    """
+    Разбирает заголовок Range. Возвращает список (start, end) включительно
+    или None, если заголовок некорректен и нужно отдать файл целиком.
+    Бросает RangeNotSatisfiable, если ни один диапазон не попадает в файл.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec:
+        return None
+    ranges = []
+    for part in spec.split(','):
+        m = RANGE_RE.match(part)
+        if not m or m.groups() == ('', ''):
+            return None
+        first, last = m.groups()
+        if first == '':
+            suffix = int(last)
+            if suffix == 0:
+                continue
+            ranges.append((max(size - suffix, 0), size - 1))
+            continue
+        start = int(first)
+        end = int(last) if last else size - 1
+        if end < start:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+    if not ranges:
+        raise RangeNotSatisfiable()
+    return ranges
+
+
+class BoundedFile:
+    """
+    Файл, читаемый только в пределах [start, start + length).
+    fileno() доступен, поэтому wsgi.file_wrapper сервера (gunicorn и др.)
+    может отдать диапазон через sendfile со смещения start.
+    """
+
+    def __init__(self, path, start, length):
+        self._f = open(path, 'rb')
+        self._f.seek(start)
+        self._remaining = length
+
+    def read(self, size=-1):
+        if self._remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._f.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self._f.fileno()
+
+    def close(self):
+        self._f.close()
+
+
+def _iter_file(bounded, block_size):
+    try:
+        while True:
+            block = bounded.read(block_size)
+            if not block:
+                break
+            yield block
+    finally:
+        bounded.close()
+
+
+def _part_header(boundary, mimetype, start, end, size):
+    return (
+        f'\r\n--{boundary}\r\n'
+        f'Content-Type: {mimetype}\r\n'
+        f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+    ).encode('ascii')
+
+
+def _iter_multipart(f, ranges, boundary, mimetype, size, block_size):
+    try:
+        for start, end in ranges:
+            yield _part_header(boundary, mimetype, start, end, size)
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                block = f.read(min(block_size, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                yield block
+        yield f'\r\n--{boundary}--\r\n'.encode('ascii')
+    finally:
+        f.close()
+
+
+def _single_response(environ, path, mimetype, start, end, size, block_size, status=206):
+    length = end - start + 1
+    bounded = BoundedFile(path, start, length)
+    file_wrapper = environ.get('wsgi.file_wrapper')
+    if file_wrapper is not None:
+        body = file_wrapper(bounded, block_size)
+    else:
+        body = _iter_file(bounded, block_size)
+    resp = Response(body, status, mimetype=mimetype, direct_passthrough=True)
+    if status == 206:
+        resp.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    resp.headers['Content-Length'] = str(length)
+    resp.headers['Accept-Ranges'] = 'bytes'
+    return resp
+
+
+def range_response(environ, path, range_header, block_size=64 * 1024, max_range_bytes=None, max_ranges=16, size=None):
+    """
+    Потоковый ответ на Range-запрос с постоянным потреблением памяти.
+
+    - один диапазон: 206 через wsgi.file_wrapper (sendfile), иначе генератор блоками block_size;
+    - несколько диапазонов: 206 multipart/byteranges генератором;
+    - max_range_bytes ограничивает объем одного 206 ответа (клиент дозапросит остаток);
+    - size можно передать из индекса хранилища, чтобы не делать stat();
+    - файл открывается до формирования ответа, так что отсутствующий файл дает
+      FileNotFoundError здесь, а не обрыв уже начатого ответа.
+    """
+    if size is None:
+        size = os.path.getsize(path)
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    try:
+        ranges = parse_ranges(range_header, size)
+    except RangeNotSatisfiable:
+        resp = Response(status=416)
+        resp.headers['Content-Range'] = f'bytes */{size}'
+        resp.headers['Accept-Ranges'] = 'bytes'
+        return resp
+
+    if ranges is None:
+        # Некорректный Range игнорируется: отдаем весь файл с кодом 200
+        return _single_response(environ, path, mimetype, 0, size - 1, size, block_size, status=200)
+    if len(ranges) > max_ranges:
+        ranges = ranges[:max_ranges]
+
+    if max_range_bytes:
+        capped = []
+        budget = max_range_bytes
+        for start, end in ranges:
+            if budget <= 0:
+                break
+            end = min(end, start + budget - 1)
+            budget -= end - start + 1
+            capped.append((start, end))
+        ranges = capped
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        return _single_response(environ, path, mimetype, start, end, size, block_size)
+
+    boundary = uuid.uuid4().hex
+    content_length = sum(
+        len(_part_header(boundary, mimetype, start, end, size)) + end - start + 1
+        for start, end in ranges
+    ) + len(f'\r\n--{boundary}--\r\n')
+    f = open(path, 'rb')
+    resp = Response(
+        _iter_multipart(f, ranges, boundary, mimetype, size, block_size),
+        206,
+        mimetype=f'multipart/byteranges; boundary={boundary}',
+        direct_passthrough=True
+    )
+    resp.headers['Content-Length'] = str(content_length)
+    resp.headers['Accept-Ranges'] = 'bytes'
+    return resp
@@ -1,10 +1,8 @@
 import os
-import io
 import time
 import subprocess
 import json
 import re
-import tempfile
 import ssl
 import requests
 from flask import Flask, request, jsonify, render_template, send_file, send_from_directory, abort, flash, redirect, url_for, Response
@@ -14,15 +12,17 @@ from sqlalchemy import text
 from threading import Thread
 from extensions import db
 from models import User, Video, Comment, Subscription, DownloadRequest, VideoCounter, VideoVote
-from utils import get_thumbnail_paths, format_views, fetch_chunks_for_peer, peers, signals, peer_chunks, CHUNK_SIZE
+from utils import get_thumbnail_paths, format_views, fetch_chunks_for_peer, peers, signals, peer_chunks, CHUNK_SIZE, cached_media_response, send_media_file, media_storage, media_validator_cache, invalidate_thumbnail_cache
+from chunk_store import ChunkStore, encode_chunk_batch
+from range_streaming import range_response
+from hls_worker import HlsGenerator
 from config import SUPABASE_CONFIG, CONFIG
 import humanize
 import uuid
 from datetime import datetime
-from sentiment_analyzer import SentimentAnalyzer
+from sentiment_analyzer import SentimentAnalyzer, SentimentWorker
 from googleapiclient.discovery import build
 from dotenv import load_dotenv
-import mimetypes
 import logging
 
 # Логирование
@@ -36,7 +36,23 @@ if not YOUTUBE_API_KEY:
     raise ValueError("YOUTUBE_API_KEY не найден в .env")
 
 # Инициализация анализатора настроений
-sentiment_analyzer = SentimentAnalyzer()
+sentiment_analyzer = SentimentAnalyzer(quantize=CONFIG.SENTIMENT_QUANTIZE, batch_size=CONFIG.SENTIMENT_BATCH_SIZE)
+
+# Хранилище предварительно нарезанных WebRTC-чанков
+chunk_store = ChunkStore(
+    CONFIG.CHUNK_CACHE_DIR,
+    CONFIG.CHUNK_CACHE_MAX_BYTES,
+    segment_seconds=CHUNK_SIZE / 1000000,
+    workers=CONFIG.CHUNK_SEGMENT_WORKERS
+)
+
+# Фоновая генерация HLS-плейлистов
+hls_generator = HlsGenerator(
+    os.path.join(SUPABASE_CONFIG['storage_path'], 'hls'),
+    workers=CONFIG.HLS_WORKERS,
+    failure_backoff=CONFIG.HLS_FAILURE_BACKOFF,
+    failure_backoff_max=CONFIG.HLS_FAILURE_BACKOFF_MAX
+)
 
 # Глобальное хранилище задач
 try:
@@ -47,6 +63,13 @@ except ImportError:
 def init_routes(app, logger):
     logger.info("Инициализация маршрутов")
 
+    # Тональность новых комментариев оценивается пакетами в фоне
+    sentiment_worker = SentimentWorker(
+        app, sentiment_analyzer,
+        batch_size=CONFIG.SENTIMENT_BATCH_SIZE,
+        interval=CONFIG.SENTIMENT_WORKER_INTERVAL
+    ).start()
+
     # Роут для видео
     app.add_url_rule('/videos/<path:filename>', endpoint='videos', view_func=lambda filename: send_from_directory(SUPABASE_CONFIG['storage_path'], filename))
 
@@ -261,67 +284,58 @@ def init_routes(app, logger):
         if not text:
             flash('Комментарий не может быть пустым')
             return redirect(url_for('video_detail', video_id=video_id))
-        sentiment = sentiment_analyzer.analyze(text)
+        # sentiment = NULL - оценка ожидается, ее проставит sentiment_worker
         comment = Comment(
             video_id=video_id,
             user_id=current_user.id,
             text=text,
             created_at=datetime.utcnow(),
-            sentiment=sentiment
+            sentiment=None
         )
         db.session.add(comment)
         db.session.commit()
+        sentiment_worker.notify()
         flash('Комментарий добавлен')
         return redirect(url_for('video_detail', video_id=video_id))
 
     @app.route('/stream/<path:filename>')
     def stream_video(filename):
-        full_path = os.path.join(SUPABASE_CONFIG['storage_path'], filename)
-        
-        if not os.path.exists(full_path):
+        video_id, ext = os.path.splitext(filename)
+        location = media_storage.locate(video_id)
+        if location is None or location.ext != ext.lower():
             logger.error(f"Видеофайл {filename} не найден")
             abort(404)
 
-        range_header = request.headers.get('Range', None)
-        if not range_header:
-            return send_file(full_path)
-
-        size = os.path.getsize(full_path)
-        byte1, byte2 = 0, None
-        m = re.search(r'bytes=(\d+)-(\d*)', range_header)
-        if m:
-            g = m.groups()
-            byte1 = int(g[0])
-            if g[1]:
-                byte2 = int(g[1])
-
-        length = size - byte1
-        if byte2 is not None:
-            length = byte2 - byte1 + 1
-
-        with open(full_path, 'rb') as f:
-            f.seek(byte1)
-            data = f.read(length)
-
-        resp = Response(
-            data,
-            206,
-            mimetype=mimetypes.guess_type(full_path)[0],
-            content_type=mimetypes.guess_type(full_path)[0],
-            direct_passthrough=True
-        )
-        resp.headers.add('Content-Range', f'bytes {byte1}-{byte1 + length - 1}/{size}')
-        resp.headers.add('Accept-Ranges', 'bytes')
-        resp.headers.add('Content-Length', str(length))
-        return resp
+        # Отдаем файл или диапазон блоками (или через sendfile), не читая его целиком в память;
+        # размер берется из индекса хранилища, без stat()
+        try:
+            return range_response(
+                request.environ,
+                location.path,
+                request.headers.get('Range'),
+                block_size=CONFIG.STREAM_BLOCK_SIZE,
+                max_range_bytes=CONFIG.STREAM_MAX_RANGE_BYTES,
+                size=location.size
+            )
+        except FileNotFoundError:
+            # Файл удален мимо приложения: убираем его из индекса
+            logger.error(f"Видеофайл {filename} есть в индексе, но отсутствует на диске")
+            media_storage.invalidate(video_id)
+            abort(404)
 
     @app.route('/stream_video/<filename>')
     def stream_video_file(filename):
-        file_path = os.path.join(SUPABASE_CONFIG['storage_path'], filename)
-        if not os.path.exists(file_path):
+        video_id = os.path.splitext(filename)[0]
+        location = media_storage.locate(video_id)
+        if location is None:
             logger.error(f"Видеофайл {filename} не найден")
             abort(404)
-        return send_file(file_path, mimetype='video/mp4')
+        try:
+            return send_file(location.path, mimetype='video/mp4')
+        except FileNotFoundError:
+            logger.error(f"Видеофайл {filename} есть в индексе, но отсутствует на диске")
+            media_storage.invalidate(video_id)
+            abort(404)
 
     @app.route('/edit_video/<video_id>', methods=['POST'])
     @jwt_required()
@@ -350,6 +364,9 @@ def init_routes(app, logger):
                 thumbnail_path = os.path.join(thumbnail_dir, thumbnail_filename)
                 thumbnail.save(thumbnail_path)
                 video.thumbnail_extension = 'jpg'
+                media_storage.register_thumbnail(thumbnail_filename, thumbnail_path)
+                media_validator_cache.pop(('thumbnail', thumbnail_filename), None)
+                invalidate_thumbnail_cache(video_id)
 
             db.session.commit()
             flash('Видео успешно обновлено!', 'success')
@@ -508,6 +525,14 @@ def init_routes(app, logger):
 
                 db.session.commit()
 
+                # Новые файлы сразу попадают в индекс хранилища
+                media_storage.register(video_id, final_video_path)
+                media_storage.register_thumbnail(f"{video_id}.jpg", final_thumbnail_path)
+                invalidate_thumbnail_cache(video_id)
+
+                # Разовая нарезка на WebRTC-чанки в фоне
+                chunk_store.ensure_segmented(video_id, final_video_path)
+
                 flash('Видео успешно загружено!')
                 return redirect(url_for('video_detail', video_id=video_id))
             except Exception as e:
@@ -702,15 +727,20 @@ def init_routes(app, logger):
         else:
             clean_filename = filename
 
-        primary_path = os.path.join(SUPABASE_CONFIG['storage_path'], 'thumbnails', clean_filename)
-        if os.path.isfile(primary_path):
-            return send_from_directory(os.path.join(SUPABASE_CONFIG['storage_path'], 'thumbnails'), clean_filename)
+        cache_key = ('thumbnail', clean_filename)
+        not_modified = cached_media_response(cache_key)
+        if not_modified is not None:
+            return not_modified
 
-        secondary_path = os.path.join(SUPABASE_CONFIG['storage_path'], clean_filename)
-        if os.path.isfile(secondary_path):
-            return send_from_directory(SUPABASE_CONFIG['storage_path'], clean_filename)
+        location = media_storage.locate_thumbnail(clean_filename)
+        if location is not None:
+            resp = send_media_file(cache_key, os.path.dirname(location.path), os.path.basename(location.path))
+            if resp is not None:
+                return resp
+            # Файл удален мимо приложения
+            media_storage.invalidate_thumbnail(clean_filename)
 
-        logger.warning(f"Эскиз {clean_filename} не найден в основном или вторичном пути")
+        logger.warning(f"Эскиз {clean_filename} не найден ни на одном уровне хранилища")
         return send_from_directory('static', 'default-thumbnail.webp')
 
     @app.route('/api/register_peer', methods=['POST'])
@@ -775,50 +805,40 @@ def init_routes(app, logger):
 
     @app.route('/api/video_metadata/<video_id>')
     def video_metadata(video_id):
-        video_path = None
-        for ext in ['.mp4', '.webm', '.mkv']:
-            path = os.path.join(SUPABASE_CONFIG['storage_path'], f"{video_id}{ext}")
-            if os.path.exists(path):
-                video_path = path
-                break
-        if not video_path:
+        location = media_storage.locate(video_id, track=False)
+        if location is None:
             logger.error(f"Видео {video_id} не найдено")
             return jsonify({'error': 'Video not found'}), 404
-        size = os.path.getsize(video_path)
+        size = location.size
         logger.info(f"Метаданные для видео {video_id}: размер={size}")
         return jsonify({'size': size})
 
     @app.route('/api/chunk/<video_id>/<chunk_id>')
     def get_chunk(video_id, chunk_id):
-        video_path = None
-        for ext in ['.mp4', '.webm', '.mkv']:
-            path = os.path.join(SUPABASE_CONFIG['storage_path'], f"{video_id}{ext}")
-            if os.path.exists(path):
-                video_path = path
-                break
-        if not video_path:
+        location = media_storage.locate(video_id)
+        if location is None:
             logger.error(f"Видео {video_id} не найдено для чанка {chunk_id}")
             return jsonify({'error': 'Video not found'}), 404
-        chunk_num = int(chunk_id.split('_')[1])
-        offset = chunk_num * CHUNK_SIZE
-        try:
-            with tempfile.NamedTemporaryFile(suffix='.webm') as temp_file:
-                cmd = [
-                    'ffmpeg', '-i', video_path,
-                    '-ss', str(offset / 1000000),
-                    '-t', str(CHUNK_SIZE / 1000000),
-                    '-c:v', 'libvpx-vp9', '-c:a', 'opus',
-                    '-threads', '2', '-cpu-used', '4', '-speed', '4',
-                    '-f', 'webm', temp_file.name
-                ]
-                subprocess.run(cmd, check=True, capture_output=True)
-                with open(temp_file.name, 'rb') as f:
-                    chunk = f.read()
-            logger.info(f"Обслужен чанк {chunk_id} для видео {video_id}, размер={len(chunk)}")
-            return send_file(io.BytesIO(chunk), mimetype='video/webm')
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Ошибка FFmpeg для чанка {chunk_id} видео {video_id}: {e.stderr.decode()}")
-            return jsonify({'error': 'Failed to generate chunk'}), 500
+        if ChunkStore.parse_chunk_id(chunk_id) is None:
+            return jsonify({'error': 'Invalid chunk id'}), 400
+        ready, results = chunk_store.get_chunks(video_id, location.path, [chunk_id], signature=location.signature)
+        if not ready:
+            logger.info(f"Видео {video_id} еще нарезается, чанк {chunk_id} недоступен")
+            resp = jsonify({'status': 'preparing'})
+            resp.status_code = 202
+            resp.headers['Retry-After'] = '5'
+            return resp
+        item = results.get(chunk_id)
+        if item is None:
+            logger.error(f"Чанк {chunk_id} для видео {video_id} не найден")
+            return jsonify({'error': 'Chunk not found'}), 404
+        digest, chunk = item
+        logger.info(f"Обслужен чанк {chunk_id} для видео {video_id}, размер={len(chunk)}")
+        resp = Response(chunk, mimetype='video/webm')
+        # Содержимое адресуется хэшем, поэтому чанк можно кэшировать надолго
+        resp.headers['ETag'] = f'"{digest}"'
+        resp.headers['Cache-Control'] = 'public, max-age=86400'
+        return resp
 
     @app.route('/api/request_chunks/<video_id>/<peer_id>', methods=['OPTIONS'])
     def request_chunks_options(video_id, peer_id):
@@ -836,80 +856,81 @@ def init_routes(app, logger):
             logger.error(f"Не предоставлены ID чанков для пира {peer_id} в видео {video_id}")
             return jsonify({'error': 'No chunk IDs provided'}), 400
 
-        video_path = None
-        for ext in ['.mp4', '.webm', '.mkv']:
-            path = os.path.join(SUPABASE_CONFIG['storage_path'], f"{video_id}{ext}")
-            if os.path.exists(path):
-                video_path = path
-                break
-        if not video_path:
-            logger.error(f"Видео {video_id} не найдено в {SUPABASE_CONFIG['storage_path']} для пира {peer_id}")
+        location = media_storage.locate(video_id)
+        if location is None:
+            logger.error(f"Видео {video_id} не найдено в хранилище для пира {peer_id}")
             return jsonify({'error': 'Video not found'}), 404
 
-        results = {}
-        for chunk_id in chunk_ids:
-            chunk_num = int(chunk_id.split('_')[1])
-            offset = chunk_num * CHUNK_SIZE
-            try:
-                with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as temp_file:
-                    temp_file_path = temp_file.name
-                cmd = [
-                    'ffmpeg', '-i', video_path,
-                    '-ss', str(offset / 1000000),
-                    '-t', str(CHUNK_SIZE / 1000000),
-                    '-c:v', 'libvpx-vp9', '-c:a', 'opus',
-                    '-threads', '2', '-cpu-used', '4', '-speed', '4',
-                    '-f', 'webm', temp_file_path
-                ]
-                subprocess.run(cmd, check=True, capture_output=True, text=True)
-                with open(temp_file_path, 'rb') as f:
-                    chunk = f.read()
-                os.unlink(temp_file_path)
-                results[chunk_id] = chunk.hex()
-                if video_id not in peer_chunks:
-                    peer_chunks[video_id] = {}
-                if peer_id not in peer_chunks[video_id]:
-                    peer_chunks[video_id][peer_id] = []
-                if chunk_id not in peer_chunks[video_id][peer_id]:
-                    peer_chunks[video_id][peer_id].append(chunk_id)
-                logger.info(f"Доставлен {chunk_id} пиру {peer_id} для видео {video_id}, размер={len(chunk)}")
-            except subprocess.CalledProcessError as e:
-                logger.error(f"Ошибка FFmpeg для {chunk_id}: {e.stderr.decode()}")
-                results[chunk_id] = None
-            except Exception as e:
-                logger.error(f"Ошибка доставки {chunk_id} пиру {peer_id}: {str(e)}")
-                results[chunk_id] = None
+        ready, results = chunk_store.get_chunks(video_id, location.path, chunk_ids, signature=location.signature)
+        if not ready:
+            logger.info(f"Видео {video_id} еще нарезается, пир {peer_id} должен повторить запрос")
+            resp = jsonify({'status': 'preparing'})
+            resp.status_code = 202
+            resp.headers['Retry-After'] = '5'
+            resp.headers['Access-Control-Allow-Origin'] = '*'
+            return resp
 
-        return jsonify(results)
+        if video_id not in peer_chunks:
+            peer_chunks[video_id] = {}
+        if peer_id not in peer_chunks[video_id]:
+            peer_chunks[video_id][peer_id] = []
+        for chunk_id, item in results.items():
+            if item is None:
+                continue
+            if chunk_id not in peer_chunks[video_id][peer_id]:
+                peer_chunks[video_id][peer_id].append(chunk_id)
+        delivered = sum(1 for item in results.values() if item is not None)
+        logger.info(f"Доставлено {delivered}/{len(chunk_ids)} чанков пиру {peer_id} для видео {video_id}")
+
+        # Устаревший формат для старых клиентов: JSON с hex-строками
+        if request.args.get('encoding') == 'hex':
+            return jsonify({cid: (item[1].hex() if item else None) for cid, item in results.items()})
+
+        resp = Response(encode_chunk_batch(results), mimetype='application/octet-stream')
+        resp.headers['Access-Control-Allow-Origin'] = '*'
+        return resp
 
     @app.route('/hls/<video_id>.m3u8')
     def serve_hls(video_id):
-        video_path = None
-        for ext in ['.mp4', '.webm', '.mkv']:
-            path = os.path.join(SUPABASE_CONFIG['storage_path'], f"{video_id}{ext}")
-            if os.path.exists(path):
-                video_path = path
-                break
-        if not video_path:
+        location = media_storage.locate(video_id)
+        if location is None:
             logger.error(f"Видео {video_id} не найдено для HLS")
             return jsonify({'error': 'Video not found'}), 404
-        hls_dir = os.path.join(SUPABASE_CONFIG['storage_path'], 'hls', video_id)
-        hls_playlist = os.path.join(hls_dir, f"{video_id}.m3u8")
-        if os.path.exists(hls_playlist):
-            logger.info(f"Обслуживается кэшированный плейлист HLS: {hls_playlist}")
-            return send_file(hls_playlist, mimetype='application/vnd.apple.mpegurl')
-        os.makedirs(hls_dir, exist_ok=True)
-        cmd = [
-            'ffmpeg', '-i', video_path, '-c:v', 'copy', '-c:a', 'copy',
-            '-hls_time', '10', '-hls_list_size', '0', '-f', 'hls', hls_playlist
-        ]
-        try:
-            subprocess.run(cmd, check=True, capture_output=True)
-            logger.info(f"Сгенерирован плейлист HLS: {hls_playlist}")
-            return send_file(hls_playlist, mimetype='application/vnd.apple.mpegurl')
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Ошибка FFmpeg для HLS {video_id}: {e.stderr.decode()}")
-            return jsonify({'error': 'Failed to generate HLS playlist'}), 500
+        status = hls_generator.request(video_id, location.path)
+        if status == 'ready':
+            logger.info(f"Обслуживается кэшированный плейлист HLS для видео {video_id}")
+            return send_file(hls_generator.playlist_path(video_id), mimetype='application/vnd.apple.mpegurl')
+        if status == 'failed':
+            resp = jsonify({'error': 'HLS generation failed', 'video_id': video_id})
+            resp.status_code = 503
+            resp.headers['Retry-After'] = str(max(1, hls_generator.retry_after(video_id, location.path)))
+            return resp
+
+        # Плейлист еще дописывается: отдаем уже готовые сегменты (EVENT-плейлист без ENDLIST),
+        # плеер будет перезапрашивать его сам
+        partial = hls_generator.progressive_playlist(video_id)
+        if partial is not None:
+            resp = Response(partial, mimetype='application/vnd.apple.mpegurl')
+            resp.headers['Cache-Control'] = 'no-cache'
+            return resp
+
+        resp = jsonify({'status': 'preparing', 'video_id': video_id})
+        resp.status_code = 202
+        resp.headers['Retry-After'] = str(CONFIG.HLS_RETRY_AFTER)
+        return resp
+
+    @app.route('/hls/<video_id>/<segment>')
+    def serve_hls_segment(video_id, segment):
+        if not segment.endswith('.ts'):
+            abort(404)
+        # video_id попадает в путь каталога: принимаем только известные хранилищу видео
+        # (иначе '..' вывел бы за пределы каталога HLS)
+        if media_storage.locate(video_id, track=False) is None:
+            abort(404)
+        resp = send_from_directory(hls_generator.video_dir(video_id), segment, mimetype='video/mp2t')
+        # В имени сегмента есть версия исходника, так что по одному URL всегда одни и те же байты
+        resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return resp
 
     @app.route('/api/task_progress/<task_id>', methods=['GET'])
     def task_progress(task_id):
@@ -1011,14 +1032,19 @@ def init_routes(app, logger):
         clean_filename = filename
         if filename.startswith('static/avatars/'):
             clean_filename = filename[len('static/avatars/'):]
-        
-        avatar_path = os.path.join(avatar_dir, clean_filename)
-        if os.path.isfile(avatar_path):
-            return send_from_directory(avatar_dir, clean_filename)
-        
-        default_path = os.path.join('static', default_avatar)
-        if os.path.isfile(default_path):
-            return send_from_directory('static', default_avatar)
+
+        cache_key = ('avatar', clean_filename)
+        not_modified = cached_media_response(cache_key)
+        if not_modified is not None:
+            return not_modified
+
+        resp = send_media_file(cache_key, avatar_dir, clean_filename)
+        if resp is not None:
+            return resp
+
+        resp = send_media_file(('avatar', default_avatar), 'static', default_avatar)
+        if resp is not None:
+            return resp
         
         logger.warning(f"Аватар {clean_filename} не найден, дефолтный аватар также отсутствует")
         abort(404)
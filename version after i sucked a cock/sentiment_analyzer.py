@@ -4,10 +4,18 @@ warnings.filterwarnings("ignore", category=FutureWarning, module="transformers.u
 from transformers import AutoModelForSequenceClassification, AutoTokenizer, pipeline
 import torch
 import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
 
 class SentimentAnalyzer:
-    def __init__(self, model_path="./rubert-tiny2-russian-sentiment", model_name="seara/rubert-tiny2-russian-sentiment"):
+    def __init__(self, model_path="./rubert-tiny2-russian-sentiment", model_name="seara/rubert-tiny2-russian-sentiment",
+                 quantize=False, batch_size=32):
         model_path = os.path.abspath(model_path)
+        self.batch_size = batch_size
         try:
             if not os.path.exists(model_path):
                 print(f"Директория модели {model_path} не найдена. Загружаем модель {model_name}...")
@@ -21,32 +29,109 @@ class SentimentAnalyzer:
                 print(f"Загружаем модель из {model_path}")
             model = AutoModelForSequenceClassification.from_pretrained(model_path)
             tokenizer = AutoTokenizer.from_pretrained(model_path)
+            use_gpu = torch.cuda.is_available()
+            if quantize and not use_gpu:
+                # Динамическое int8-квантование Linear-слоев: быстрее на CPU при той же разметке
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
             self.classifier = pipeline(
                 "sentiment-analysis",
                 model=model,
                 tokenizer=tokenizer,
                 top_k=None,
-                device=0 if torch.cuda.is_available() else -1
+                device=0 if use_gpu else -1
             )
         except Exception as e:
             raise RuntimeError(f"Не удалось загрузить модель из {model_path}: {str(e)}")
 
-    def analyze(self, text):
+    @staticmethod
+    def _label(results):
+        scores = {result['label'].lower(): result['score'] for result in results}
+        positive_score = scores.get('positive', 0.0)
+        neutral_score = scores.get('neutral', 0.0)
+        negative_score = scores.get('negative', 0.0)
+        max_score = max(positive_score, neutral_score, negative_score)
+        if max_score == positive_score:
+            return 1.0
+        elif max_score == neutral_score:
+            return 0.5
+        else:
+            return 0.0
+
+    def analyze_batch(self, texts, fallback=True):
+        """
+        Оценки для списка текстов одним прогоном пайплайна (пакетами по batch_size).
+        При ошибке модели - 0.5 для всех текстов, а при fallback=False - None.
+        """
         try:
-            text = text[:512]
-            with torch.no_grad():
-                results = self.classifier(text)[0]
-            scores = {result['label'].lower(): result['score'] for result in results}
-            positive_score = scores.get('positive', 0.0)
-            neutral_score = scores.get('neutral', 0.0)
-            negative_score = scores.get('negative', 0.0)
-            max_score = max(positive_score, neutral_score, negative_score)
-            if max_score == positive_score:
-                return 1.0
-            elif max_score == neutral_score:
-                return 0.5
-            else:
-                return 0.0
+            texts = [text[:512] for text in texts]
+            with torch.inference_mode():
+                results = self.classifier(texts, batch_size=self.batch_size, truncation=True)
+            return [self._label(result) for result in results]
         except Exception as e:
             print(f"Ошибка при анализе текста: {str(e)}")
-            return 0.5
\ No newline at end of file
+            return [0.5] * len(texts) if fallback else None
+
+    def analyze(self, text):
+        return self.analyze_batch([text])[0]
+
+
+class SentimentWorker:
+    """
+    Фоновый поток, который оценивает новые комментарии пакетами.
+
+    Комментарий сохраняется с sentiment = NULL (оценка ожидается), notify()
+    будит поток; он выбирает до batch_size неоцененных комментариев, оценивает
+    их одним прогоном модели и записывает результат одним bulk-обновлением.
+    Раз в interval секунд поток проверяет очередь и без notify() (например,
+    после перезапуска).
+    """
+
+    def __init__(self, app, analyzer, batch_size=32, interval=30):
+        self.app = app
+        self.analyzer = analyzer
+        self.batch_size = batch_size
+        self.interval = interval
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sentiment-worker', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def notify(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    self.drain()
+            except Exception as e:
+                logger.error(f"Ошибка фоновой оценки комментариев: {e}")
+
+    def drain(self):
+        """Оценивает все ожидающие комментарии. Возвращает их количество"""
+        from extensions import db
+        from models import Comment
+
+        processed = 0
+        while True:
+            comments = (Comment.query.filter(Comment.sentiment.is_(None))
+                        .order_by(Comment.id).limit(self.batch_size).all())
+            if not comments:
+                break
+            started = time.time()
+            scores = self.analyzer.analyze_batch([comment.text for comment in comments], fallback=False)
+            if scores is None:
+                # Модель недоступна: комментарии остаются неоцененными до следующего прохода
+                logger.warning(f"Модель недоступна, {len(comments)} комментариев ждут оценки")
+                break
+            db.session.bulk_update_mappings(Comment, [
+                {'id': comment.id, 'sentiment': str(score)} for comment, score in zip(comments, scores)
+            ])
+            db.session.commit()
+            processed += len(comments)
+            logger.info(f"Оценено {len(comments)} комментариев за {time.time() - started:.2f}s")
+        return processed
@@ -1,9 +1,10 @@
 import os
 import logging
 from sqlalchemy import text
-from config import SUPABASE_CONFIG
+from config import SUPABASE_CONFIG, CONFIG
+from media_storage import MediaStorage
 from models import db
-from flask import url_for, current_app
+from flask import url_for, current_app, request, send_from_directory, Response
 from cachetools import TTLCache
 
 # Логирование
@@ -27,7 +28,74 @@ CHUNK_SIZE = 1024 * 1024  # 1 MB
 thumbnail_cache = TTLCache(maxsize=1000, ttl=600)
 
 # Вторичный путь для хранения видео и thumbnails
-SECONDARY_STORAGE_PATH = '/run/media/impostorboy/server/videos'
+SECONDARY_STORAGE_PATH = CONFIG.STORAGE_COLD_PATH
+
+# Индекс расположения медиафайлов по уровням хранения (hot/cold)
+media_storage = MediaStorage(
+    SUPABASE_CONFIG['storage_path'],
+    SECONDARY_STORAGE_PATH,
+    promote_after=CONFIG.STORAGE_PROMOTE_AFTER,
+    promote_window=CONFIG.STORAGE_PROMOTE_WINDOW,
+    hot_max_bytes=CONFIG.STORAGE_HOT_MAX_BYTES
+)
+
+# Кэш валидаторов отдаваемых медиафайлов (эскизы, аватары):
+# {(вид, имя): (директория, файл, etag, mtime)}. Теплый кэш позволяет ответить 304
+# без поиска файла по путям и без stat()
+media_validator_cache = TTLCache(maxsize=5000, ttl=600)
+
+
+def _file_etag(st):
+    return f"{st.st_ino:x}-{st.st_size:x}-{int(st.st_mtime):x}"
+
+
+def _not_modified(etag, mtime):
+    """Проверяет If-None-Match (приоритетно) и If-Modified-Since текущего запроса"""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    since = request.if_modified_since
+    return since is not None and int(mtime) <= int(since.timestamp())
+
+
+def _not_modified_response(etag, mtime, max_age):
+    resp = Response(status=304)
+    resp.set_etag(etag)
+    resp.last_modified = int(mtime)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = max_age
+    return resp
+
+
+def cached_media_response(key, max_age=86400):
+    """Быстрый путь: 304 по кэшу валидаторов или None"""
+    entry = media_validator_cache.get(key)
+    if entry is None:
+        return None
+    _, _, etag, mtime = entry
+    if _not_modified(etag, mtime):
+        return _not_modified_response(etag, mtime, max_age)
+    return None
+
+
+def send_media_file(key, directory, filename, max_age=86400):
+    """
+    Отдает файл с сильным ETag (inode-size-mtime) и Last-Modified, запоминая
+    валидаторы в media_validator_cache. Возвращает None, если файла нет.
+    """
+    entry = media_validator_cache.get(key)
+    if entry is None or entry[0] != directory or entry[1] != filename:
+        try:
+            st = os.stat(os.path.join(directory, filename))
+        except OSError:
+            return None
+        entry = (directory, filename, _file_etag(st), st.st_mtime)
+        media_validator_cache[key] = entry
+    _, _, etag, mtime = entry
+    if _not_modified(etag, mtime):
+        return _not_modified_response(etag, mtime, max_age)
+    resp = send_from_directory(directory, filename, etag=etag, last_modified=int(mtime), max_age=max_age)
+    resp.cache_control.public = True
+    return resp
 
 def get_thumbnail_paths(video_ids):
     """
@@ -58,25 +126,16 @@ def get_thumbnail_paths(video_ids):
             ext = ext.lstrip('.') if ext else 'jpg'
             thumbnail_name = f"{video_id}.{ext}"
 
-            primary_path = os.path.join(SUPABASE_CONFIG['storage_path'], 'thumbnails', thumbnail_name)
-            if os.path.exists(primary_path) and os.access(primary_path, os.R_OK):
-                with current_app.app_context():
-                    thumbnail_url = url_for('stream_thumbnail', filename=thumbnail_name, _external=True)
-                logger.debug(f"Thumbnail found for video {video_id} at primary path: {primary_path}")
-                thumbnail_cache[video_id] = thumbnail_url
-                cached_results[video_id] = thumbnail_url
-                continue
-
-            secondary_path = os.path.join(SECONDARY_STORAGE_PATH, thumbnail_name)
-            if os.path.exists(secondary_path) and os.access(secondary_path, os.R_OK):
+            location = media_storage.locate_thumbnail(thumbnail_name)
+            if location is not None:
                 with current_app.app_context():
                     thumbnail_url = url_for('stream_thumbnail', filename=thumbnail_name, _external=True)
-                logger.debug(f"Thumbnail found for video {video_id} at secondary path: {secondary_path}")
+                logger.debug(f"Thumbnail found for video {video_id} in {location.tier} storage: {location.path}")
                 thumbnail_cache[video_id] = thumbnail_url
                 cached_results[video_id] = thumbnail_url
                 continue
 
-            logger.warning(f"Thumbnail file not found for video {video_id} at {primary_path} or {secondary_path}")
+            logger.warning(f"Thumbnail file not found for video {video_id} in any storage tier")
             with current_app.app_context():
                 default_url = url_for('static', filename='default-thumbnail.webp', _external=True)
             thumbnail_cache[video_id] = default_url
@@ -121,24 +180,12 @@ def fetch_chunks_for_peer(video_id, peer_id):
     Назначает чанки видео для пира в WebRTC.
     """
     try:
-        video_path = None
-        for ext in ['.mp4', '.webm', '.mkv']:
-            path = os.path.join(SUPABASE_CONFIG['storage_path'], f"{video_id}{ext}")
-            if os.path.exists(path):
-                video_path = path
-                break
-        if not video_path:
-            # Проверяем вторичный путь
-            for ext in ['.mp4', '.webm', '.mkv']:
-                path = os.path.join(SECONDARY_STORAGE_PATH, f"{video_id}{ext}")
-                if os.path.exists(path):
-                    video_path = path
-                    break
-        if not video_path:
+        location = media_storage.locate(video_id, track=False)
+        if location is None:
             logger.error(f"Video {video_id} not found for peer {peer_id}")
             return
 
-        size = os.path.getsize(video_path)
+        size = location.size
         total_chunks = (size + CHUNK_SIZE - 1) // CHUNK_SIZE
         if video_id not in peer_chunks:
             peer_chunks[video_id] = {}